@@ -15,6 +15,7 @@ class WebSocketClient:
         self.devices: Dict[str, Dict[str, Any]] = {}
         self.message_queue = asyncio.Queue()
         self.device_tasks: Set[asyncio.Task] = set()
+        self.sequences: Dict[str, Dict[str, Any]] = {}
         self.initialized = False
         
         self.max_retries = 5
@@ -113,26 +114,63 @@ class WebSocketClient:
                     print(f"Max retries reached for device {device_uuid}")
 
     async def _device_connection_loop(self, device_uuid: str):
-        """Main connection loop for a device"""
-        async with websockets.connect(f"{self.base_url}/ws/devices/{device_uuid}") as ws:
+        """Main connection loop for a device, following the redirect to the API worker owning it"""
+        url = self._device_url(device_uuid)
+        while url:
+            url = await self._device_connection(device_uuid, url)
+
+    def _device_url(self, device_uuid: str) -> str:
+        """URL of a device, resuming from the last message received when there is one"""
+        url = f"{self.base_url}/ws/devices/{device_uuid}"
+        sequence = self.sequences.get(device_uuid)
+        if sequence and sequence.get("epoch"):
+            url += f"?epoch={sequence['epoch']}&last_seq={sequence['seq']}"
+        return url
+
+    def _track_sequence(self, device_uuid: str, data: Dict[str, Any]):
+        """Remember the epoch and last sequence number received for a device"""
+        event = data.get("event")
+        if event == "connection_established":
+            self.sequences[device_uuid] = {"epoch": data.get("epoch"), "seq": data.get("seq", 0)}
+        elif event == "resumed":
+            self.sequences.setdefault(device_uuid, {"seq": 0})["epoch"] = data.get("epoch")
+        elif "seq" in data and device_uuid in self.sequences:
+            self.sequences[device_uuid]["seq"] = data["seq"]
+
+    async def _device_connection(self, device_uuid: str, url: str) -> Optional[str]:
+        """Receive the messages of a device until the connection closes, returns the redirect URL if any"""
+        async with websockets.connect(url) as ws:
             print(f"Connected to device {device_uuid}")
             while True:
                 try:
                     data = await ws.recv()
+                    redirect_url = self._redirect_url(data)
+                    if redirect_url:
+                        print(f"Device {device_uuid} redirected to {redirect_url}")
+                        return redirect_url
                     await self._handle_device_message(device_uuid, data)
                     
                 except websockets.exceptions.ConnectionClosed:
                     print(f"Connection closed for device {device_uuid}")
-                    break
+                    return None
                     
                 except json.JSONDecodeError as e:
                     print(f"JSON decode error for {device_uuid}: {e}")
                     continue
 
+    @staticmethod
+    def _redirect_url(raw_data: str) -> Optional[str]:
+        """Return the URL of a redirect message sent by an API worker not owning the device"""
+        if '"redirect"' not in raw_data:
+            return None
+        data = json.loads(raw_data)
+        return data.get("url") if data.get("event") == "redirect" else None
+
     async def _handle_device_message(self, device_uuid: str, raw_data: str):
         """Process a message from a device"""
         try:
             parsed_data = json.loads(raw_data)
+            self._track_sequence(device_uuid, parsed_data)
             parsed_data["device_uuid"] = device_uuid
             
             self._update_device_data(device_uuid, parsed_data)
@@ -182,21 +220,27 @@ class WebSocketClient:
              ValueError(f"Device {device_uuid} not found")
         
         try:
-            async with websockets.connect(f"{self.base_url}/ws/devices/{device_uuid}") as ws:
-                command = {
-                    "method": "simulation_mode",
-                    "params": {
-                        "name": "SimulationMode",
-                        "args": enabled
+            url = f"{self.base_url}/ws/devices/{device_uuid}"
+            while True:
+                async with websockets.connect(url) as ws:
+                    command = {
+                        "method": "simulation_mode",
+                        "params": {
+                            "name": "SimulationMode",
+                            "args": enabled
+                        }
                     }
-                }
-                
-                await ws.send(json.dumps(command))
-                response_data = await ws.recv()
-                response = json.loads(response_data)
-                
-                print(f"Simulation mode {'enabled' if enabled else 'disabled'}")
-                return response
+                    
+                    await ws.send(json.dumps(command))
+                    response_data = await ws.recv()
+                    redirect_url = self._redirect_url(response_data)
+                    if redirect_url:
+                        url = redirect_url
+                        continue
+                    response = json.loads(response_data)
+                    
+                    print(f"Simulation mode {'enabled' if enabled else 'disabled'}")
+                    return response
                 
         except Exception as e:
             print(f"Failed to send simulation mode to {device_uuid}: {e}")
@@ -13,24 +13,66 @@ class DatabaseConnectorApp:
         with open(file_path, 'r', encoding='utf-8') as file:
             config_data = json.load(file)
         self.websocket_client = OpenFactoryWebSocketClient(config_data["base_url"] if config_data else "")
-        self.db_manager = DatabaseManager()
+        self.asset_refresh_interval = config_data.get("asset_refresh_interval_seconds", 30) if config_data else 30
+        self.db_manager = DatabaseManager(config_data)
+        self.ingestion_config = config_data.get("ingestion", {}) if config_data else {}
+        self.kafka_source = None
     
     async def run(self):
         """Run the application"""
         print("Application is running. Press Ctrl+C to stop.")
+        if self.ingestion_config.get("source", "websocket") == "kafka":
+            await self._run_kafka_ingestion()
+            return
         try:
             message_handler = MessageRouter(self.db_manager)
 
             self.websocket_client.set_message_handler(message_handler.handle_message)
 
             self.assets = self.db_manager.fetch_all_assets()
-            
+
+            asset_refresh_task = asyncio.create_task(self._refresh_assets())
             await self.websocket_client.start(self.assets)
+            asset_refresh_task.cancel()
         except KeyboardInterrupt:
             print("\nShutting down app...")
             await self.websocket_client.stop()
             self.db_manager.disconnect()
 
+    async def _run_kafka_ingestion(self):
+        """Consume ASSETS_STREAM directly instead of going through the websocket API"""
+        from kafka_source import KafkaIngestionSource
+
+        kafka_config = self.ingestion_config.get("kafka", {})
+        self.kafka_source = KafkaIngestionSource(
+            self.db_manager,
+            bootstrap_servers=os.getenv("KAFKA_BROKER", kafka_config.get("bootstrap_servers", "broker:29092")),
+            topic=kafka_config.get("topic", "ofa_assets"),
+            group_id=kafka_config.get("group_id", "database_connector"),
+            max_poll_records=kafka_config.get("max_poll_records", 1000),
+            poll_timeout_ms=kafka_config.get("poll_timeout_ms", 1000),
+            timezone_name=kafka_config.get("timezone", "Canada/Eastern")
+        )
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.kafka_source.run)
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            print("\nShutting down app...")
+            self.kafka_source.stop()
+            self.db_manager.disconnect()
+
+    async def _refresh_assets(self):
+        """Subscribe to assets added to (or unsubscribe from assets removed from) OpenFactoryLink"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.asset_refresh_interval)
+            try:
+                assets = await loop.run_in_executor(self.db_manager.executor, self.db_manager.fetch_all_assets)
+                if assets and set(assets) != set(self.assets):
+                    self.assets = assets
+                    await self.websocket_client.set_assets(assets)
+            except Exception as e:
+                print(f"Error refreshing assets: {e}")
+
 if __name__ == "__main__":
     try:
         app = DatabaseConnectorApp()
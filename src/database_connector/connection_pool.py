@@ -0,0 +1,151 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+import pyodbc
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of pyodbc connections with per-connection health checks"""
+
+    def __init__(self, connection_string: str, size: int = 4, health_check_interval: float = 30.0,
+                 reconnect_delay: float = 5.0, max_reconnect_delay: float = 60.0, checkout_timeout: float = 30.0):
+        """
+        Args:
+            connection_string: ODBC connection string
+            size: Maximum number of open connections
+            health_check_interval: Idle time (s) after which a connection is checked before being handed out
+            reconnect_delay: Initial delay (s) between two failed connection attempts
+            max_reconnect_delay: Upper bound (s) of the exponential reconnect delay
+            checkout_timeout: Time (s) to wait for a free connection before giving up
+        """
+        self.connection_string = connection_string
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.checkout_timeout = checkout_timeout
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._next_attempt = 0.0
+        self._closed = False
+
+    def warm_up(self, retries: int = 5):
+        """
+        Open a first connection, retrying every reconnect_delay without the exponential backoff so startup
+        is not held up, raises ConnectionError on failure
+        """
+        for attempt in range(retries):
+            try:
+                print(f"Attempting to connect to SQL Server (attempt {attempt + 1}/{retries})")
+                with self.connection():
+                    print("Database connection established successfully.")
+                    return
+            except pyodbc.Error as e:
+                print(f"Connection attempt {attempt + 1} failed: {e}")
+                if attempt < retries - 1:
+                    with self._lock:
+                        self._next_attempt = 0.0
+                    print(f"Retrying in {self.reconnect_delay} seconds...")
+                    time.sleep(self.reconnect_delay)
+        raise ConnectionError("Failed to connect to the database after retries.")
+
+    @contextmanager
+    def connection(self) -> Iterator[pyodbc.Connection]:
+        """Check out a healthy connection, returning it to the pool afterwards"""
+        if self._closed:
+            raise pyodbc.Error("Connection pool is closed")
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise pyodbc.Error(f"No database connection available after {self.checkout_timeout} seconds")
+
+        connection = None
+        try:
+            connection = self._checkout()
+            yield connection
+        except Exception:
+            if connection is not None and not self._is_healthy(connection):
+                self._discard(connection)
+                connection = None
+            raise
+        finally:
+            if connection is not None:
+                if self._closed:
+                    self._discard(connection)
+                else:
+                    self._idle.put((connection, time.monotonic()))
+            self._slots.release()
+
+    def ping(self) -> bool:
+        """Tell whether a connection can currently be checked out and used"""
+        try:
+            with self.connection() as connection:
+                return self._is_healthy(connection)
+        except pyodbc.Error:
+            return False
+
+    def close_all(self):
+        """Close every idle connection and refuse new checkouts"""
+        self._closed = True
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(connection)
+        print("Database connections closed.")
+
+    def _checkout(self) -> pyodbc.Connection:
+        """Return an idle connection, checking it if it sat idle too long, or open a new one"""
+        while True:
+            try:
+                connection, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+
+            if time.monotonic() - last_used < self.health_check_interval or self._is_healthy(connection):
+                return connection
+            print("Dropping unhealthy database connection")
+            self._discard(connection)
+
+    def _connect(self) -> pyodbc.Connection:
+        """Open a new connection, failing fast while the reconnect delay is running"""
+        with self._lock:
+            wait = self._next_attempt - time.monotonic()
+        if wait > 0:
+            raise pyodbc.Error(f"Database unavailable, next connection attempt in {wait:.1f} seconds")
+
+        try:
+            connection = pyodbc.connect(self.connection_string)
+        except pyodbc.Error:
+            with self._lock:
+                self._next_attempt = time.monotonic() + self._current_delay()
+                self._failures += 1
+            raise
+
+        with self._lock:
+            self._failures = 0
+            self._next_attempt = 0.0
+        return connection
+
+    def _current_delay(self) -> float:
+        return min(self.reconnect_delay * (2 ** self._failures), self.max_reconnect_delay)
+
+    def _is_healthy(self, connection: pyodbc.Connection) -> bool:
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def _discard(self, connection: pyodbc.Connection):
+        try:
+            connection.close()
+        except pyodbc.Error:
+            pass
@@ -1,87 +1,160 @@
-from typing import List
+from typing import Any, Deque, Dict, List, Optional, Tuple
 import pyodbc
 import os
-import time
-from init_db.build_bd import main as init_db
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from init_db.build_bd import main as init_db, maintain_partitions
+from insert_type_strategy.interfaces.insert_type_strategy import IInsertTypeStrategy
 from insert_type_strategy_factory import InsertTypeFactory
+from insert_buffer import InsertBuffer, Row
+from variable_cache import VariableCache, MISS
+from connection_pool import ConnectionPool
+from spool import Spool
+from rollup_manager import RollupManager
+from retention_manager import RetentionManager
 from dotenv import load_dotenv
 
 class DatabaseManager:
     """Connects to and executes queries in database"""
 
-    def __init__(self):
+    def __init__(self, config: Optional[dict] = None):
         load_dotenv()
         self.server = os.getenv("SERVER", "")
         self.database_name = os.getenv("DATABASE")
         self.user = os.getenv("USER")
         self.password = os.getenv("PASSWORD")
-        self.max_retries = 5
-        self.retry_delay = 5
-        self.connection = None
+        pool_config = (config or {}).get("connection_pool", {})
+        self.max_retries = pool_config.get("startup_retries", 5)
+        self.pool = ConnectionPool(
+            self._connection_string(self.database_name),
+            size=pool_config.get("size", 4),
+            health_check_interval=pool_config.get("health_check_interval_seconds", 30.0),
+            reconnect_delay=pool_config.get("reconnect_delay_seconds", 5.0),
+            max_reconnect_delay=pool_config.get("max_reconnect_delay_seconds", 60.0)
+        )
+        self.executor = ThreadPoolExecutor(max_workers=self.pool.size, thread_name_prefix="db-writer")
+        self.schema_config = (config or {}).get("schema", {})
+        self.layout = self.schema_config.get("layout", "standard")
+        self._stop_event = threading.Event()
         self.create_database_if_not_exists() ##Temporary fix to ensure database exists before connecting
-        if not self.connect():
-            raise ConnectionError("Failed to connect to the database after retries.")
+        self.connect()
         try:
-            init_db(self.connection, self.server)
+            with self.pool.connection() as connection:
+                init_db(connection, self.server, self.layout, self.schema_config.get("migrate", False))
             print("Database schema initialized successfully")
         except Exception as e:
             print(f"Database schema initialization failed: {e}")
-       
+
+        rollup_config = (config or {}).get("rollups", {})
+        self.rollups = None
+        if rollup_config.get("enabled", True) and self._table_exists("ValueRollup"):
+            self.rollups = RollupManager(
+                bucket_seconds=rollup_config.get("bucket_seconds", [1, 60, 3600]),
+                lateness_horizon=rollup_config.get("lateness_horizon_seconds", 3600.0),
+                track_late=self._table_exists("ValueRollupLate")
+            )
+        elif rollup_config.get("enabled", True):
+            print("ValueRollup table not found, rollups are disabled")
+
+        cache_config = (config or {}).get("variable_cache", {})
+        self.variable_cache = VariableCache(
+            self.fetch_rows,
+            refresh_interval=cache_config.get("refresh_interval_seconds", 30.0),
+            negative_ttl=cache_config.get("negative_ttl_seconds", 300.0)
+        )
+        self.lookup_retry_delay = cache_config.get("lookup_retry_seconds", 5.0)
+        self.max_pending_values = cache_config.get("max_pending_values", 1000)
+        # Lookups of dataitems missing from the cache run apart from the InsertBuffer flushes, one per dataitem
+        self.lookup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-lookup")
+        self._pending: Dict[Tuple[str, str], Deque[Tuple[Any, Any]]] = {}
+        self._pending_lock = threading.Lock()
+        try:
+            self.variable_cache.load()
+        except Exception as e:
+            print(f"Error preloading variable cache: {e}")
+        self.variable_cache.start()
+
+        spool_config = (config or {}).get("spool", {})
+        spool_directory = spool_config.get("directory", "spool")
+        if not os.path.isabs(spool_directory):
+            spool_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), spool_directory)
+        self.spool = Spool(
+            spool_directory,
+            self._write_to_database,
+            InsertTypeFactory.strategy_for_table,
+            self.pool.ping,
+            max_bytes=spool_config.get("max_bytes", 512 * 1024 * 1024),
+            segment_bytes=spool_config.get("segment_bytes", 8 * 1024 * 1024),
+            replay_interval=spool_config.get("replay_interval_seconds", 5.0)
+        )
+        self.spool.start()
+
+        buffer_config = (config or {}).get("insert_buffer", {})
+        self.insert_buffer = InsertBuffer(
+            self.write_batch,
+            max_batch_size=buffer_config.get("max_batch_size", 500),
+            flush_interval=buffer_config.get("flush_interval_seconds", 1.0),
+            report_interval=buffer_config.get("report_interval_seconds", 30.0),
+            executor=self.executor
+        )
+        self.insert_buffer.start()
+
+        if self.layout == "partitioned":
+            threading.Thread(target=self._run_partition_maintenance, daemon=True).start()
+
+        retention_config = (config or {}).get("retention", {})
+        values_retention = retention_config.get("enabled", False)
+        rollup_days = rollup_config.get("retention_days", {}) if self.rollups else {}
+        self.retention = None
+        if values_retention or any(rollup_days.values()):
+            self.retention = RetentionManager(
+                self.pool.connection,
+                default_days=retention_config.get("default_days", 0) if values_retention else 0,
+                type_days=retention_config.get("type_days", {}) if values_retention else {},
+                variable_days=retention_config.get("variable_days", {}) if values_retention else {},
+                rollup_days=rollup_days,
+                partitioned=self.layout == "partitioned",
+                interval=retention_config.get("interval_minutes", 60) * 60,
+                chunk_size=retention_config.get("chunk_size", 5000),
+                chunk_pause=retention_config.get("chunk_pause_seconds", 0.1)
+            )
+            self.retention.start()
     
-    def connect(self):
-        """Connect to SQL Server with retry logic"""
-        connection_string = (
+    def _connection_string(self, database_name: str) -> str:
+        return (
             f"DRIVER={{ODBC Driver 17 for SQL Server}};"
             f"SERVER={self.server};"
-            f"DATABASE={self.database_name};"
+            f"DATABASE={database_name};"
             f"UID={self.user};"
             f"PWD={self.password};"
             f"TrustServerCertificate=yes;"
             f"Connection Timeout=30;"
         )
-        
-        for attempt in range(self.max_retries):
-            try:
-                print(f"Attempting to connect to SQL Server (attempt {attempt + 1}/{self.max_retries})")
-                print(f"Server: {self.server}")
-                print(f"Database: {self.database_name}")
-                print(f"User: {self.user}")
-                
-                self.connection = pyodbc.connect(connection_string)
-                print("Database connection established successfully.")
-                return True
-                
-            except pyodbc.Error as e:
-                print(f"Connection attempt {attempt + 1} failed: {e}")
-                if attempt < self.max_retries - 1:
-                    print(f"Retrying in {self.retry_delay} seconds...")
-                    time.sleep(self.retry_delay)
-                else:
-                    print("All connection attempts failed.")
-                    return False
-        
-        return False
+
+    def connect(self):
+        """Open the first pooled connection, later reconnects are handled per connection by the pool"""
+        print(f"Server: {self.server}")
+        print(f"Database: {self.database_name}")
+        print(f"User: {self.user}")
+        self.pool.warm_up(self.max_retries)
     
     def disconnect(self):
-        """Disconnect from database"""
-        if self.connection:
-            self.connection.close()
-            print("Database connection closed.")
+        """Flush buffered values and disconnect from database"""
+        self._stop_event.set()
+        self.variable_cache.stop()
+        self.lookup_executor.shutdown(wait=True)
+        self.insert_buffer.stop()
+        self.spool.stop()
+        if self.retention:
+            self.retention.stop()
+        self.executor.shutdown(wait=True)
+        self.pool.close_all()
     
     def create_database_if_not_exists(self):
         """Create database if it doesn't exist"""
         try:
-            master_connection_string = (
-                f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-                f"SERVER={self.server};"
-                f"DATABASE=master;"
-                f"UID={self.user};"
-                f"PWD={self.password};"
-                f"TrustServerCertificate=yes;"
-                f"Connection Timeout=30;"
-            )
-            
-            master_conn = pyodbc.connect(master_connection_string, autocommit=True)
+            master_conn = pyodbc.connect(self._connection_string("master"), autocommit=True)
             cursor = master_conn.cursor()
             
             cursor.execute(f"SELECT name FROM sys.databases WHERE name = '{self.database_name}'")
@@ -102,24 +175,138 @@ class DatabaseManager:
         
         return True
     
-    def insert_value(self, asset_uuid, dataitem_id, update_value, update_timestamp):
-        """Insert new value into StrValue table"""
-        variable_id = self.fetch_variable_id(asset_uuid, dataitem_id)
-        var_type = self.fetch_type(variable_id)
-        if variable_id and var_type:
-            insertStrategy = InsertTypeFactory.create_strategy(var_type)
-            insertStrategy.insert_value(self.connection, variable_id, update_value, update_timestamp)
+    def insert_value(self, asset_uuid, dataitem_id, update_value, update_timestamp, blocking=False):
+        """
+        Queue new value for the next batched insert into its value table.
+        Unless blocking is set, dataitems missing from the variable cache are resolved on the lookup executor
+        so the caller never waits on the database.
+        """
+        resolution = self.variable_cache.get(asset_uuid, dataitem_id)
+        if resolution is MISS:
+            if not blocking:
+                self._defer_value((asset_uuid, dataitem_id), update_value, update_timestamp)
+                return
+            resolution = self.variable_cache.resolve(asset_uuid, dataitem_id)
+        self._queue_value(resolution, update_value, update_timestamp)
+
+    def _defer_value(self, key: Tuple[str, str], update_value, update_timestamp):
+        """
+        Keep a value until its dataitem is resolved, a single lookup is submitted per missing dataitem.
+        At most max_pending_values values are kept per dataitem, the oldest are dropped first.
+        """
+        with self._pending_lock:
+            values = self._pending.get(key)
+            if values is not None:
+                values.append((update_value, update_timestamp))
+                return
+            self._pending[key] = deque([(update_value, update_timestamp)], maxlen=self.max_pending_values)
+        self.lookup_executor.submit(self._resolve_pending, key)
+
+    def _resolve_pending(self, key: Tuple[str, str]):
+        """Resolve a dataitem missing from the variable cache, then queue the values kept for it"""
+        try:
+            resolution = self.variable_cache.resolve(*key)
+        except Exception:
+            # Nothing was cached, the values stay pending until the lookup reaches the database
+            if not self._stop_event.is_set():
+                timer = threading.Timer(self.lookup_retry_delay, self._retry_lookup, (key,))
+                timer.daemon = True
+                timer.start()
+            return
+        with self._pending_lock:
+            values = self._pending.pop(key, ())
+        for update_value, update_timestamp in values:
+            self._queue_value(resolution, update_value, update_timestamp)
+
+    def _retry_lookup(self, key: Tuple[str, str]):
+        if not self._stop_event.is_set():
+            self.lookup_executor.submit(self._resolve_pending, key)
+
+    def flush(self) -> bool:
+        """Persist every queued value (in the database or the spool), returns False if they could not be"""
+        return self.insert_buffer.flush()
 
+    def _queue_value(self, resolution, update_value, update_timestamp):
+        if not resolution:
+            return
+        variable_id, insertStrategy = resolution
+        try:
+            value = insertStrategy.convert_value(update_value)
+        except (TypeError, ValueError) as e:
+            print(f"Invalid value {update_value} for variable {variable_id}: {e}")
+            return
+        self.insert_buffer.add(insertStrategy, (variable_id, value, update_timestamp))
+
+    def write_batch(self, batches: Dict[IInsertTypeStrategy, List[Row]]):
+        """Insert buffered rows, spooling them to disk while the spool has a backlog or if the database fails"""
+        if self.spool.has_backlog():
+            self.spool.append(batches)
+            return
+        try:
+            self._write_to_database(batches)
+        except Exception as e:
+            row_count = self.spool.append(batches)
+            print(f"Database insert failed, spooled {row_count} rows: {e}")
+
+    def _write_to_database(self, batches: Dict[IInsertTypeStrategy, List[Row]]):
+        """Insert rows of every value table and fold them into the rollups in a single transaction"""
+        rollup_rows, late_rows, watermark = self.rollups.aggregate(batches) if self.rollups else ([], [], None)
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                for strategy, rows in batches.items():
+                    strategy.insert_values(cursor, rows)
+                if self.rollups:
+                    self.rollups.merge(cursor, rollup_rows, late_rows)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+        if self.rollups:
+            self.rollups.advance(watermark)
+
+    def fetch_rows(self, query: str, params: tuple = ()) -> List[tuple]:
+        """Execute a query and return all resulting rows"""
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+    def _table_exists(self, table_name: str) -> bool:
+        try:
+            return self.fetch_rows("SELECT OBJECT_ID(?, 'U')", (f"dbo.{table_name}",))[0][0] is not None
+        except Exception as e:
+            print(f"Error looking up table {table_name}: {e}")
+            return False
+
+    def _run_partition_maintenance(self):
+        """Periodically add upcoming monthly partitions and move cold ones to columnstore"""
+        interval = self.schema_config.get("maintenance_interval_hours", 24) * 3600
+        while True:
+            try:
+                with self.pool.connection() as connection:
+                    maintain_partitions(
+                        connection,
+                        hot_months=self.schema_config.get("hot_months", 3),
+                        months_ahead=self.schema_config.get("months_ahead", 3)
+                    )
+                print("Partition maintenance completed")
+            except Exception as e:
+                print(f"Partition maintenance failed: {e}")
+            if self._stop_event.wait(interval):
+                break
 
     def fetch_all_assets(self) -> List[str]:
         """Fetch all assets from the database"""
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT DISTINCT AssetUuid FROM OpenFactoryLink ")
             assets = []
-            for row in cursor:
+            for row in self.fetch_rows("SELECT DISTINCT AssetUuid FROM OpenFactoryLink "):
                 assets += [elem for elem in row]
-            cursor.close()
             return assets
         except Exception as e:
             print(f"Error fetching assets: {e}")
@@ -131,13 +318,10 @@ class DatabaseManager:
     def fetch_variable_id(self, asset_uuid: str, dataitem_id: str) -> str:
         """Fetch VariableId from DataitemId"""
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT VariableId FROM OpenFactoryLink WHERE DataitemId = ? AND AssetUuid = ?", (dataitem_id, asset_uuid))
-            result = cursor.fetchone()
-            cursor.close()
+            rows = self.fetch_rows("SELECT VariableId FROM OpenFactoryLink WHERE DataitemId = ? AND AssetUuid = ?", (dataitem_id, asset_uuid))
 
-            if result:
-                return result[0]
+            if rows:
+                return rows[0][0]
             else:
                 print(f"No VariableId found for AssetUuid={asset_uuid} and DataitemId={dataitem_id}")
                 return ''
@@ -148,13 +332,10 @@ class DatabaseManager:
     def fetch_type(self, variable_id: str) -> str:
         """Fetch data Type from VariableId"""
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT Nom FROM Type WHERE Id = (SELECT TypeId FROM Variable WHERE Id = ?)", (variable_id))
-            result = cursor.fetchone()
-            cursor.close()
+            rows = self.fetch_rows("SELECT Nom FROM Type WHERE Id = (SELECT TypeId FROM Variable WHERE Id = ?)", (variable_id,))
 
-            if result:
-                return result[0]
+            if rows:
+                return rows[0][0]
             else:
                 print(f"No type found for this VariableId")
                 return ''
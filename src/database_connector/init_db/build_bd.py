@@ -1,10 +1,17 @@
 import os
 import re
 
-def main(connection, server: str = None):
+def main(connection, server: str = None, layout: str = "standard", migrate: bool = False):
+    """
+    Initialize the database schema.
+    layout "partitioned" replaces the value tables with monthly partitioned ones (see partitioned_values.sql).
+    migrate converts existing standard value tables to the partitioned layout instead of recreating the schema.
+    """
     server = server or os.getenv("SQL_SERVER", "localhost")
     
-    if connection:
+    if connection and migrate:
+        migrate_to_partitioned(connection)
+    elif connection:
         try:
             script_path = os.path.join(os.path.dirname(__file__), 'init_db.sql')
             if os.path.exists(script_path):
@@ -19,6 +26,10 @@ def main(connection, server: str = None):
                                 cursor.execute(command)
                         cursor.commit()
                         print("Database schema initialized successfully.") 
+
+            if layout == "partitioned":
+                script_path = os.path.join(os.path.dirname(__file__), 'partitioned_values.sql')
+                execute_sql_script(connection, script_path, "Partitioned value tables script")
             
             script_path = os.path.join(os.path.dirname(__file__), 'cnc_insert_demo.sql')
             if os.path.exists(script_path):
@@ -41,6 +52,42 @@ def main(connection, server: str = None):
     else:
         print("Failed to connect to the database.")
 
+def is_partitioned(connection, table_name: str) -> bool:
+    """Tell whether a table is stored on a partition scheme"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sys.indexes i JOIN sys.partition_schemes ps ON ps.data_space_id = i.data_space_id "
+            "WHERE i.object_id = OBJECT_ID(?) AND i.index_id IN (0, 1)", (f"dbo.{table_name}",)
+        )
+        return cursor.fetchone() is not None
+
+def migrate_to_partitioned(connection):
+    """Move the rows of the standard value tables into the partitioned layout, keeping their ids"""
+    if is_partitioned(connection, 'FloatValue'):
+        print("Value tables are already partitioned, nothing to migrate.")
+        return True
+
+    init_dir = os.path.dirname(__file__)
+    steps = [
+        ('migrate_to_partitioned.sql', "Legacy value tables rename script"),
+        ('partitioned_values.sql', "Partitioned value tables script"),
+        ('migrate_copy_values.sql', "Legacy value copy script"),
+    ]
+    for script_name, description in steps:
+        if not execute_sql_script(connection, os.path.join(init_dir, script_name), description):
+            print(f"Migration to partitioned value tables stopped at {script_name}")
+            return False
+    print("Value tables migrated to the partitioned layout.")
+    return True
+
+def maintain_partitions(connection, hot_months: int = 3, months_ahead: int = 3):
+    """Create the upcoming monthly partitions and move partitions older than hot_months to columnstore"""
+    with connection.cursor() as cursor:
+        cursor.execute("EXEC dbo.AddValuePartitions @MonthsAhead = ?", (months_ahead,))
+        cursor.commit()
+        cursor.execute("EXEC dbo.ArchiveColdValuePartitions @HotMonths = ?", (hot_months,))
+        cursor.commit()
+
 def execute_sql_script(connection, script_path, script_name):
     """Execute a SQL script file, handling batches properly"""
     if not os.path.exists(script_path):
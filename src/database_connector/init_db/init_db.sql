@@ -1,5 +1,11 @@
 USE mytest;
 
+IF OBJECT_ID('dbo.ValueRollupLate', 'U') IS NOT NULL
+    DROP TABLE dbo.ValueRollupLate;
+
+IF OBJECT_ID('dbo.ValueRollup', 'U') IS NOT NULL
+    DROP TABLE dbo.ValueRollup;
+
 IF OBJECT_ID('dbo.OpenFactoryLink', 'U') IS NOT NULL
     DROP TABLE dbo.OpenFactoryLink;
 
@@ -108,8 +114,32 @@ CREATE TABLE FloatValue (
 	Timestamp DATETIME2 NOT NULL
 );
 
+CREATE INDEX IX_StrValue_Variable_Timestamp ON StrValue (VariableId, Timestamp) INCLUDE (Value);
+
+CREATE INDEX IX_IntValue_Variable_Timestamp ON IntValue (VariableId, Timestamp) INCLUDE (Value);
+
+CREATE INDEX IX_FloatValue_Variable_Timestamp ON FloatValue (VariableId, Timestamp) INCLUDE (Value);
+
 CREATE TABLE OpenFactoryLink (
 	DataItemId NVARCHAR(255) PRIMARY KEY,
 	VariableId INT FOREIGN KEY REFERENCES Variable(Id),
 	AssetUuid NVARCHAR(255) NOT NULL
+);
+
+CREATE TABLE ValueRollup (
+	VariableId INT NOT NULL FOREIGN KEY REFERENCES Variable(Id),
+	BucketSeconds INT NOT NULL,
+	BucketStart DATETIME2 NOT NULL,
+	MinValue FLOAT NOT NULL,
+	MaxValue FLOAT NOT NULL,
+	SumValue FLOAT NOT NULL,
+	SampleCount BIGINT NOT NULL,
+	LastValue FLOAT NOT NULL,
+	LastTimestamp DATETIME2 NOT NULL,
+	PRIMARY KEY (VariableId, BucketSeconds, BucketStart)
+);
+
+CREATE TABLE ValueRollupLate (
+	VariableId INT NOT NULL PRIMARY KEY FOREIGN KEY REFERENCES Variable(Id),
+	LatestSkipped DATETIME2 NOT NULL
 )
\ No newline at end of file
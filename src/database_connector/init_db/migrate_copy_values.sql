@@ -0,0 +1,40 @@
+USE mytest;
+GO
+
+-- Step 2: copy legacy rows into the partitioned tables by chunks of 100000 ids, keeping their ids,
+-- committing each chunk, then drop each legacy table once the row counts match
+DECLARE @table SYSNAME, @sql NVARCHAR(MAX);
+
+DECLARE legacy_tables CURSOR LOCAL FAST_FORWARD FOR
+    SELECT name FROM (VALUES ('StrValue'), ('IntValue'), ('FloatValue')) AS value_tables(name)
+    WHERE OBJECT_ID('dbo.' + name + '_Legacy', 'U') IS NOT NULL;
+
+OPEN legacy_tables;
+FETCH NEXT FROM legacy_tables INTO @table;
+WHILE @@FETCH_STATUS = 0
+BEGIN
+    SET @sql = N'DECLARE @from BIGINT = 0, @max BIGINT, @chunk BIGINT = 100000;'
+             + N' SELECT @max = ISNULL(MAX(Id), 0) FROM dbo.' + QUOTENAME(@table + N'_Legacy') + N';'
+             + N' SET IDENTITY_INSERT dbo.' + QUOTENAME(@table) + N' ON;'
+             + N' WHILE @from < @max'
+             + N' BEGIN'
+             + N'   INSERT INTO dbo.' + QUOTENAME(@table) + N' (Id, VariableId, Value, Timestamp)'
+             + N'   SELECT Id, VariableId, Value, Timestamp FROM dbo.' + QUOTENAME(@table + N'_Legacy')
+             + N'   WHERE Id > @from AND Id <= @from + @chunk AND VariableId IS NOT NULL;'
+             + N'   IF @@TRANCOUNT > 0 COMMIT TRANSACTION;'
+             + N'   SET @from += @chunk;'
+             + N' END'
+             + N' SET IDENTITY_INSERT dbo.' + QUOTENAME(@table) + N' OFF;'
+             + N' DBCC CHECKIDENT (''dbo.' + @table + N''', RESEED);'
+             + N' IF (SELECT COUNT_BIG(*) FROM dbo.' + QUOTENAME(@table + N'_Legacy') + N' WHERE VariableId IS NOT NULL)'
+             + N'  = (SELECT COUNT_BIG(*) FROM dbo.' + QUOTENAME(@table) + N')'
+             + N'   DROP TABLE dbo.' + QUOTENAME(@table + N'_Legacy') + N';'
+             + N' ELSE'
+             + N'   PRINT ''Row counts differ, keeping dbo.' + @table + N'_Legacy'';';
+    EXEC sp_executesql @sql;
+    PRINT 'Migrated ' + @table;
+    FETCH NEXT FROM legacy_tables INTO @table;
+END
+CLOSE legacy_tables;
+DEALLOCATE legacy_tables;
+GO
\ No newline at end of file
@@ -0,0 +1,13 @@
+USE mytest;
+GO
+
+-- Step 1: move the standard value tables out of the way (run before partitioned_values.sql)
+IF OBJECT_ID('dbo.StrValue', 'U') IS NOT NULL AND OBJECT_ID('dbo.StrValue_Legacy', 'U') IS NULL
+    EXEC sp_rename 'dbo.StrValue', 'StrValue_Legacy';
+
+IF OBJECT_ID('dbo.IntValue', 'U') IS NOT NULL AND OBJECT_ID('dbo.IntValue_Legacy', 'U') IS NULL
+    EXEC sp_rename 'dbo.IntValue', 'IntValue_Legacy';
+
+IF OBJECT_ID('dbo.FloatValue', 'U') IS NOT NULL AND OBJECT_ID('dbo.FloatValue_Legacy', 'U') IS NULL
+    EXEC sp_rename 'dbo.FloatValue', 'FloatValue_Legacy';
+GO
\ No newline at end of file
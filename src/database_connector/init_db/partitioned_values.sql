@@ -0,0 +1,185 @@
+USE mytest;
+GO
+
+IF OBJECT_ID('dbo.StrValue', 'U') IS NOT NULL
+    DROP TABLE dbo.StrValue;
+
+IF OBJECT_ID('dbo.IntValue', 'U') IS NOT NULL
+    DROP TABLE dbo.IntValue;
+
+IF OBJECT_ID('dbo.FloatValue', 'U') IS NOT NULL
+    DROP TABLE dbo.FloatValue;
+
+IF OBJECT_ID('dbo.StrValueArchive', 'U') IS NOT NULL
+    DROP TABLE dbo.StrValueArchive;
+
+IF OBJECT_ID('dbo.IntValueArchive', 'U') IS NOT NULL
+    DROP TABLE dbo.IntValueArchive;
+
+IF OBJECT_ID('dbo.FloatValueArchive', 'U') IS NOT NULL
+    DROP TABLE dbo.FloatValueArchive;
+GO
+
+-- Monthly partitions (RANGE RIGHT, one boundary per first day of month) from 12 months back to 12 months ahead.
+-- dbo.AddValuePartitions keeps adding the upcoming months.
+IF NOT EXISTS (SELECT 1 FROM sys.partition_functions WHERE name = 'ValueMonthlyFunction')
+BEGIN
+    DECLARE @start DATE = DATEADD(MONTH, -12, DATEFROMPARTS(YEAR(SYSDATETIME()), MONTH(SYSDATETIME()), 1));
+    DECLARE @sql NVARCHAR(MAX) = N'CREATE PARTITION FUNCTION ValueMonthlyFunction (DATETIME2) AS RANGE RIGHT FOR VALUES (';
+    DECLARE @i INT = 0;
+    WHILE @i <= 24
+    BEGIN
+        SET @sql += CASE WHEN @i > 0 THEN N', ' ELSE N'' END
+                  + N'''' + CONVERT(NVARCHAR(10), DATEADD(MONTH, @i, @start), 23) + N'''';
+        SET @i += 1;
+    END
+    SET @sql += N');';
+    EXEC sp_executesql @sql;
+END
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.partition_schemes WHERE name = 'ValueMonthlyScheme')
+    CREATE PARTITION SCHEME ValueMonthlyScheme AS PARTITION ValueMonthlyFunction ALL TO ([PRIMARY]);
+GO
+
+-- Hot tables: rowstore, clustered on (VariableId, Timestamp), every index aligned on the monthly scheme
+CREATE TABLE StrValue (
+	Id BIGINT IDENTITY NOT NULL,
+	VariableId INT NOT NULL FOREIGN KEY REFERENCES Variable(Id),
+	Value NVARCHAR(255) NOT NULL,
+	Timestamp DATETIME2 NOT NULL,
+	CONSTRAINT PK_StrValue PRIMARY KEY NONCLUSTERED (Id, Timestamp) ON ValueMonthlyScheme(Timestamp)
+) ON ValueMonthlyScheme(Timestamp);
+
+CREATE CLUSTERED INDEX CIX_StrValue_Variable_Timestamp ON StrValue (VariableId, Timestamp) ON ValueMonthlyScheme(Timestamp);
+
+CREATE TABLE IntValue (
+	Id BIGINT IDENTITY NOT NULL,
+	VariableId INT NOT NULL FOREIGN KEY REFERENCES Variable(Id),
+	Value INT NOT NULL,
+	Timestamp DATETIME2 NOT NULL,
+	CONSTRAINT PK_IntValue PRIMARY KEY NONCLUSTERED (Id, Timestamp) ON ValueMonthlyScheme(Timestamp)
+) ON ValueMonthlyScheme(Timestamp);
+
+CREATE CLUSTERED INDEX CIX_IntValue_Variable_Timestamp ON IntValue (VariableId, Timestamp) ON ValueMonthlyScheme(Timestamp);
+
+CREATE TABLE FloatValue (
+	Id BIGINT IDENTITY NOT NULL,
+	VariableId INT NOT NULL FOREIGN KEY REFERENCES Variable(Id),
+	Value FLOAT NOT NULL,
+	Timestamp DATETIME2 NOT NULL,
+	CONSTRAINT PK_FloatValue PRIMARY KEY NONCLUSTERED (Id, Timestamp) ON ValueMonthlyScheme(Timestamp)
+) ON ValueMonthlyScheme(Timestamp);
+
+CREATE CLUSTERED INDEX CIX_FloatValue_Variable_Timestamp ON FloatValue (VariableId, Timestamp) ON ValueMonthlyScheme(Timestamp);
+GO
+
+-- Cold tables: clustered columnstore on the same scheme, filled by dbo.ArchiveColdValuePartitions
+CREATE TABLE StrValueArchive (
+	Id BIGINT NOT NULL,
+	VariableId INT NOT NULL,
+	Value NVARCHAR(255) NOT NULL,
+	Timestamp DATETIME2 NOT NULL
+) ON ValueMonthlyScheme(Timestamp);
+
+CREATE CLUSTERED COLUMNSTORE INDEX CCI_StrValueArchive ON StrValueArchive ON ValueMonthlyScheme(Timestamp);
+
+CREATE TABLE IntValueArchive (
+	Id BIGINT NOT NULL,
+	VariableId INT NOT NULL,
+	Value INT NOT NULL,
+	Timestamp DATETIME2 NOT NULL
+) ON ValueMonthlyScheme(Timestamp);
+
+CREATE CLUSTERED COLUMNSTORE INDEX CCI_IntValueArchive ON IntValueArchive ON ValueMonthlyScheme(Timestamp);
+
+CREATE TABLE FloatValueArchive (
+	Id BIGINT NOT NULL,
+	VariableId INT NOT NULL,
+	Value FLOAT NOT NULL,
+	Timestamp DATETIME2 NOT NULL
+) ON ValueMonthlyScheme(Timestamp);
+
+CREATE CLUSTERED COLUMNSTORE INDEX CCI_FloatValueArchive ON FloatValueArchive ON ValueMonthlyScheme(Timestamp);
+GO
+
+-- Hot and cold rows together, for historical queries
+CREATE OR ALTER VIEW dbo.StrValueHistory AS
+SELECT Id, VariableId, Value, Timestamp FROM dbo.StrValue
+UNION ALL
+SELECT Id, VariableId, Value, Timestamp FROM dbo.StrValueArchive;
+GO
+
+CREATE OR ALTER VIEW dbo.IntValueHistory AS
+SELECT Id, VariableId, Value, Timestamp FROM dbo.IntValue
+UNION ALL
+SELECT Id, VariableId, Value, Timestamp FROM dbo.IntValueArchive;
+GO
+
+CREATE OR ALTER VIEW dbo.FloatValueHistory AS
+SELECT Id, VariableId, Value, Timestamp FROM dbo.FloatValue
+UNION ALL
+SELECT Id, VariableId, Value, Timestamp FROM dbo.FloatValueArchive;
+GO
+
+-- Make sure the partitions of the next @MonthsAhead months exist (splitting an empty partition is metadata only)
+CREATE OR ALTER PROCEDURE dbo.AddValuePartitions @MonthsAhead INT = 3
+AS
+BEGIN
+    SET NOCOUNT ON;
+    DECLARE @month DATE = DATEFROMPARTS(YEAR(SYSDATETIME()), MONTH(SYSDATETIME()), 1);
+    DECLARE @last DATE = DATEADD(MONTH, @MonthsAhead, @month);
+    DECLARE @boundary DATETIME2;
+    WHILE @month <= @last
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM sys.partition_range_values rv
+            JOIN sys.partition_functions pf ON pf.function_id = rv.function_id
+            WHERE pf.name = 'ValueMonthlyFunction' AND CAST(rv.value AS DATE) = @month
+        )
+        BEGIN
+            SET @boundary = CAST(@month AS DATETIME2);
+            ALTER PARTITION SCHEME ValueMonthlyScheme NEXT USED [PRIMARY];
+            ALTER PARTITION FUNCTION ValueMonthlyFunction() SPLIT RANGE (@boundary);
+        END
+        SET @month = DATEADD(MONTH, 1, @month);
+    END
+END
+GO
+
+-- Move every partition older than @HotMonths months from the rowstore tables to their columnstore archive
+CREATE OR ALTER PROCEDURE dbo.ArchiveColdValuePartitions @HotMonths INT = 3
+AS
+BEGIN
+    SET NOCOUNT ON;
+    DECLARE @cutoff DATETIME2 = DATEADD(MONTH, -@HotMonths, DATEFROMPARTS(YEAR(SYSDATETIME()), MONTH(SYSDATETIME()), 1));
+    DECLARE @table SYSNAME, @partition INT, @sql NVARCHAR(MAX);
+
+    DECLARE cold_partitions CURSOR LOCAL FAST_FORWARD FOR
+        SELECT t.name, p.partition_number
+        FROM sys.partitions p
+        JOIN sys.tables t ON t.object_id = p.object_id
+        JOIN sys.indexes i ON i.object_id = p.object_id AND i.index_id = p.index_id
+        JOIN sys.partition_schemes ps ON ps.data_space_id = i.data_space_id
+        JOIN sys.partition_range_values rv ON rv.function_id = ps.function_id AND rv.boundary_id = p.partition_number
+        WHERE t.name IN ('StrValue', 'IntValue', 'FloatValue') AND i.index_id = 1 AND p.rows > 0
+          AND CAST(rv.value AS DATETIME2) <= @cutoff;
+
+    OPEN cold_partitions;
+    FETCH NEXT FROM cold_partitions INTO @table, @partition;
+    WHILE @@FETCH_STATUS = 0
+    BEGIN
+        SET @sql = N'BEGIN TRANSACTION;'
+                 + N' INSERT INTO dbo.' + QUOTENAME(@table + N'Archive') + N' (Id, VariableId, Value, Timestamp)'
+                 + N' SELECT Id, VariableId, Value, Timestamp FROM dbo.' + QUOTENAME(@table)
+                 + N' WHERE $PARTITION.ValueMonthlyFunction(Timestamp) = @partition;'
+                 + N' TRUNCATE TABLE dbo.' + QUOTENAME(@table) + N' WITH (PARTITIONS (' + CAST(@partition AS NVARCHAR(10)) + N'));'
+                 + N' COMMIT TRANSACTION;';
+        EXEC sp_executesql @sql, N'@partition INT', @partition = @partition;
+        PRINT 'Archived partition ' + CAST(@partition AS NVARCHAR(10)) + ' of ' + @table;
+        FETCH NEXT FROM cold_partitions INTO @table, @partition;
+    END
+    CLOSE cold_partitions;
+    DEALLOCATE cold_partitions;
+END
+GO
\ No newline at end of file
@@ -0,0 +1,172 @@
+import threading
+import time
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from insert_type_strategy.interfaces.insert_type_strategy import IInsertTypeStrategy
+
+Row = Tuple[Any, Any, Any]
+
+
+class InsertBuffer:
+    """Write-behind buffer gathering value rows per value table and flushing them in batches"""
+
+    def __init__(self, write_batch: Callable[[Dict[IInsertTypeStrategy, List[Row]]], None],
+                 max_batch_size: int = 500, flush_interval: float = 1.0, report_interval: float = 30.0,
+                 executor: Optional[Executor] = None):
+        """
+        Args:
+            write_batch: Callable writing {strategy: rows} in a single transaction
+            max_batch_size: Number of pending rows that triggers a flush
+            flush_interval: Maximum time (s) a row may wait in the buffer before being flushed
+            report_interval: Time (s) between two printed throughput reports (0 disables them)
+            executor: Executor running size triggered flushes, flushes inline when None
+        """
+        self.write_batch = write_batch
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.report_interval = report_interval
+        self.executor = executor
+
+        self._pending: Dict[type, Tuple[IInsertTypeStrategy, List[Row]]] = {}
+        self._pending_count = 0
+        self._oldest_pending = None
+        self._flush_scheduled = False
+        self.failure_count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._flusher_thread = None
+
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def start(self):
+        """Start the background thread enforcing the time threshold"""
+        if self._flusher_thread and self._flusher_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._flusher_thread = threading.Thread(target=self._run_flusher, daemon=True)
+        self._flusher_thread.start()
+
+    def stop(self):
+        """Stop the background thread and flush what is left in the buffer"""
+        self._stop_event.set()
+        if self._flusher_thread:
+            self._flusher_thread.join(timeout=self.flush_interval + 5)
+            self._flusher_thread = None
+        self.flush()
+
+    def add(self, strategy: IInsertTypeStrategy, row: Row):
+        """Queue a (variable_id, value, timestamp) row for the table handled by strategy"""
+        with self._lock:
+            entry = self._pending.get(type(strategy))
+            if entry is None:
+                entry = (strategy, [])
+                self._pending[type(strategy)] = entry
+            entry[1].append(row)
+            self._pending_count += 1
+            if self._oldest_pending is None:
+                self._oldest_pending = time.monotonic()
+            schedule_flush = self._pending_count >= self.max_batch_size and not self._flush_scheduled
+            if schedule_flush and self.executor:
+                self._flush_scheduled = True
+
+        if schedule_flush:
+            if self.executor:
+                self.executor.submit(self.flush)
+            else:
+                self.flush()
+
+    def pending_count(self) -> int:
+        """Number of rows waiting to be flushed"""
+        return self._pending_count
+
+    def flush(self) -> bool:
+        """Write every pending row in one transaction, returns False if the rows could not be written"""
+        with self._flush_lock:
+            with self._lock:
+                self._flush_scheduled = False
+                if not self._pending_count:
+                    return True
+                batches = {strategy: rows for strategy, rows in self._pending.values()}
+                row_count = self._pending_count
+                oldest_pending = self._oldest_pending
+                self._pending = {}
+                self._pending_count = 0
+                self._oldest_pending = None
+
+            try:
+                self.write_batch(batches)
+            except Exception as e:
+                print(f"Error flushing {row_count} buffered rows: {e}")
+                with self._stats_lock:
+                    self._stats["failed_rows"] += row_count
+                self.failure_count += 1
+                return False
+
+            self._record_flush(row_count, time.monotonic() - oldest_pending)
+            return True
+
+    def get_stats(self) -> Dict[str, float]:
+        """Return throughput statistics gathered since the last report"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        elapsed = time.monotonic() - stats.pop("since")
+        flushes = stats["flushes"]
+        return {
+            "flushes": flushes,
+            "rows": stats["rows"],
+            "failed_rows": stats["failed_rows"],
+            "avg_batch_size": stats["rows"] / flushes if flushes else 0.0,
+            "max_batch_size": stats["max_batch_size"],
+            "avg_flush_latency_ms": stats["total_latency"] * 1000 / flushes if flushes else 0.0,
+            "max_flush_latency_ms": stats["max_latency"] * 1000,
+            "rows_per_second": stats["rows"] / elapsed if elapsed > 0 else 0.0,
+            "pending_rows": self._pending_count,
+        }
+
+    def _run_flusher(self):
+        """Flush on the time threshold and print periodic throughput reports"""
+        tick = min(self.flush_interval, 0.1) if self.flush_interval > 0 else 0.1
+        last_report = time.monotonic()
+        while not self._stop_event.wait(tick):
+            oldest_pending = self._oldest_pending
+            if oldest_pending is not None and time.monotonic() - oldest_pending >= self.flush_interval:
+                self.flush()
+
+            if self.report_interval and time.monotonic() - last_report >= self.report_interval:
+                self._report()
+                last_report = time.monotonic()
+
+    def _record_flush(self, row_count: int, latency: float):
+        with self._stats_lock:
+            self._stats["flushes"] += 1
+            self._stats["rows"] += row_count
+            self._stats["total_latency"] += latency
+            self._stats["max_latency"] = max(self._stats["max_latency"], latency)
+            self._stats["max_batch_size"] = max(self._stats["max_batch_size"], row_count)
+
+    def _reset_stats(self):
+        with self._stats_lock:
+            self._stats = {
+                "since": time.monotonic(),
+                "flushes": 0,
+                "rows": 0,
+                "failed_rows": 0,
+                "total_latency": 0.0,
+                "max_latency": 0.0,
+                "max_batch_size": 0,
+            }
+
+    def _report(self):
+        stats = self.get_stats()
+        self._reset_stats()
+        if not stats["flushes"] and not stats["failed_rows"]:
+            return
+        print(
+            f"Insert buffer: {stats['rows']} rows in {stats['flushes']} flushes "
+            f"({stats['rows_per_second']:.1f} rows/s, avg batch {stats['avg_batch_size']:.1f}, "
+            f"max batch {stats['max_batch_size']}), flush latency avg {stats['avg_flush_latency_ms']:.1f} ms "
+            f"max {stats['max_flush_latency_ms']:.1f} ms, {stats['failed_rows']} failed rows, "
+            f"{stats['pending_rows']} pending"
+        )
@@ -1,11 +1,24 @@
 from abc import ABC, abstractmethod
-from pyodbc import Connection
+from typing import Any, List, Tuple
+from pyodbc import Connection, Cursor
 
 
 class IInsertTypeStrategy(ABC):
     """Abstract base class for different value insert strategies"""
 
+    table_name: str = ""
+    value_type: type = str
+
+    def convert_value(self, update_value: Any) -> Any:
+        "Convert a received value to the column type of the strategy's table"
+        return self.value_type(update_value)
+
     @abstractmethod
     def insert_value(self, connection: Connection, variable_id: str, update_value: int, update_timestamp: str):
         "Insert new value for a variable"
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    def insert_values(self, cursor: Cursor, rows: List[Tuple[Any, Any, Any]]):
+        "Insert a batch of (variable_id, value, timestamp) rows without committing"
+        pass
@@ -1,8 +1,12 @@
 from insert_type_strategy.interfaces.insert_type_strategy import IInsertTypeStrategy
-from pyodbc import Connection
+from typing import Any, List, Tuple
+from pyodbc import Connection, Cursor
 
 class InsertTypeInt(IInsertTypeStrategy):
-    """Inserts str values into StrValue table."""
+    """Inserts int values into IntValue table."""
+
+    value_type = int
+    table_name = "IntValue"
 
     def insert_value(self, connection: Connection, variable_id: str, update_value: int, update_timestamp: str):
         "Insert new value for a variable"
@@ -13,4 +17,9 @@ class InsertTypeInt(IInsertTypeStrategy):
             cursor.commit()
             cursor.close()
         except Exception as e:
-            print(f"Error updating variable {variable_id}: {e}")
\ No newline at end of file
+            print(f"Error updating variable {variable_id}: {e}")
+
+    def insert_values(self, cursor: Cursor, rows: List[Tuple[Any, Any, Any]]):
+        "Insert a batch of (variable_id, value, timestamp) rows without committing"
+        cursor.fast_executemany = True
+        cursor.executemany(f"INSERT INTO {self.table_name} (VariableId, Value, Timestamp) VALUES (?, ?, ?)", rows)
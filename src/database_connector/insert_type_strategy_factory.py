@@ -1,4 +1,6 @@
 import json
+import os
+from typing import Dict, Optional
 from insert_type_strategy.interfaces.insert_type_strategy import IInsertTypeStrategy
 from insert_type_strategy.strategies.insert_type_float import InsertTypeFloat
 from insert_type_strategy.strategies.insert_type_int import InsertTypeInt
@@ -7,16 +9,44 @@ from insert_type_strategy.strategies.insert_type_str import InsertTypeStr
 class InsertTypeFactory:
     """Factory class to create insert type strategies based on dataitem type"""
 
-    @staticmethod
-    def create_strategy(type: str) -> IInsertTypeStrategy:
-        """Create an insert type strategy based on provided type."""
-        type_convention = {}
-        with open('type_convention.json') as f:
-            type_convention = json.load(f)
-            
-        if type in type_convention.get('str'):
-            return InsertTypeStr()
-        elif type in type_convention.get('int'):
-            return InsertTypeInt()
-        elif type in type_convention.get('float'):
-            return InsertTypeFloat()
+    _type_convention: Optional[Dict] = None
+    _strategies: Dict[str, IInsertTypeStrategy] = {}
+
+    @classmethod
+    def create_strategy(cls, type: str) -> IInsertTypeStrategy:
+        """Create an insert type strategy based on provided type, reusing one instance per type."""
+        if type in cls._strategies:
+            return cls._strategies[type]
+
+        type_convention = cls._load_type_convention()
+        strategy = None
+        if type in type_convention.get('str', []):
+            strategy = InsertTypeStr()
+        elif type in type_convention.get('int', []):
+            strategy = InsertTypeInt()
+        elif type in type_convention.get('float', []):
+            strategy = InsertTypeFloat()
+
+        if strategy:
+            cls._strategies[type] = strategy
+        return strategy
+
+    @classmethod
+    def strategy_for_table(cls, table_name: str) -> Optional[IInsertTypeStrategy]:
+        """Return the insert strategy writing into the given value table"""
+        for strategy_class in (InsertTypeStr, InsertTypeInt, InsertTypeFloat):
+            if strategy_class.table_name == table_name:
+                return next(
+                    (strategy for strategy in cls._strategies.values() if isinstance(strategy, strategy_class)),
+                    strategy_class()
+                )
+        return None
+
+    @classmethod
+    def _load_type_convention(cls) -> Dict:
+        """Read type_convention.json once"""
+        if cls._type_convention is None:
+            file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'type_convention.json')
+            with open(file_path) as f:
+                cls._type_convention = json.load(f)
+        return cls._type_convention
@@ -0,0 +1,102 @@
+import json
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+from kafka import KafkaConsumer
+
+INGESTED_TYPES = ('Events', 'Condition', 'Samples')
+
+
+class KafkaIngestionSource:
+    """Consumes ASSETS_STREAM directly and commits offsets only once the matching SQL batch is persisted"""
+
+    def __init__(self, db_manager, bootstrap_servers: str = "broker:29092", topic: str = "ofa_assets",
+                 group_id: str = "database_connector", max_poll_records: int = 1000,
+                 poll_timeout_ms: int = 1000, timezone_name: str = "Canada/Eastern"):
+        """
+        Args:
+            db_manager: DatabaseManager the consumed values are written with
+            bootstrap_servers: Kafka bootstrap servers
+            topic: Kafka topic backing ASSETS_STREAM
+            group_id: Consumer group shared by every connector instance
+            max_poll_records: Maximum number of records handled per poll (one SQL batch)
+            poll_timeout_ms: Time (ms) a poll waits for records
+            timezone_name: Timezone of the stored timestamps, matching the websocket stream
+        """
+        self.db_manager = db_manager
+        self.bootstrap_servers = bootstrap_servers
+        self.topic = topic
+        self.group_id = group_id
+        self.max_poll_records = max_poll_records
+        self.poll_timeout_ms = poll_timeout_ms
+        self.timezone = ZoneInfo(timezone_name)
+        self.consumer: Optional[KafkaConsumer] = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        """Poll batches and write them until stopped (blocking)"""
+        self._stop_event.clear()
+        self.consumer = KafkaConsumer(
+            self.topic,
+            bootstrap_servers=self.bootstrap_servers,
+            group_id=self.group_id,
+            value_deserializer=lambda m: json.loads(m.decode('utf-8')) if m else None,
+            key_deserializer=lambda m: m.decode('utf-8') if m else None,
+            auto_offset_reset='latest',
+            enable_auto_commit=False,
+            max_poll_records=self.max_poll_records
+        )
+        print(f"Consuming {self.topic} directly with group {self.group_id}")
+
+        try:
+            while not self._stop_event.is_set():
+                records = self.consumer.poll(timeout_ms=self.poll_timeout_ms, max_records=self.max_poll_records)
+                if not records:
+                    continue
+
+                failures = self.db_manager.insert_buffer.failure_count
+                try:
+                    for messages in records.values():
+                        for message in messages:
+                            self._queue_message(message)
+                    persisted = self.db_manager.flush() and self.db_manager.insert_buffer.failure_count == failures
+                except Exception as e:
+                    # A variable lookup failed, nothing was cached for it
+                    print(f"Batch could not be resolved: {e}")
+                    self.db_manager.flush()
+                    self._stop_event.wait(self.db_manager.lookup_retry_delay)
+                    persisted = False
+
+                if persisted:
+                    self.consumer.commit()
+                else:
+                    print("Batch could not be persisted, consuming it again")
+                    for partition, messages in records.items():
+                        self.consumer.seek(partition, messages[0].offset)
+        except Exception as e:
+            print(f"Error in Kafka ingestion: {e}")
+            raise
+        finally:
+            self.consumer.close()
+            self.consumer = None
+
+    def stop(self):
+        """Stop consuming after the current batch"""
+        self._stop_event.set()
+
+    def _queue_message(self, message):
+        value = message.value
+        if not isinstance(value, dict) or message.key is None:
+            return
+        if value.get('TYPE') not in INGESTED_TYPES or value.get('VALUE') == 'UNAVAILABLE':
+            return
+
+        timestamp = datetime.fromtimestamp(message.timestamp / 1000, tz=timezone.utc)
+        self.db_manager.insert_value(
+            message.key,
+            value.get('ID'),
+            value.get('VALUE'),
+            timestamp.astimezone(self.timezone).replace(tzinfo=None),
+            blocking=True
+        )
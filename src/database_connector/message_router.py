@@ -1,4 +1,4 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Union
 from dataclasses import dataclass
 from datetime import datetime
 import json
@@ -20,12 +20,12 @@ class MessageRouter:
         self.db_manager = db_manager
         self.subscribed_devices: Dict[str, Dict] = {}
     
-    def handle_message(self, raw_message: str):
+    def handle_message(self, raw_message: Union[str, Dict]):
         """
         Main message handler - routes incoming WebSocket messages to appropriate actions
         """
         try:
-            message_data = json.loads(raw_message)
+            message_data = json.loads(raw_message) if isinstance(raw_message, (str, bytes)) else raw_message
             if(message_data.get('event', False)):
                 return
             device_message = self.parse_device_message(message_data)
@@ -0,0 +1,207 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, ContextManager, Dict, List, Optional, Tuple
+
+VALUE_TABLES = ("StrValue", "IntValue", "FloatValue")
+ROLLUP_TABLE = "ValueRollup"
+
+VARIABLE_TYPES_QUERY = "SELECT v.Id, t.Nom FROM Variable v LEFT JOIN Type t ON t.Id = v.TypeId"
+
+EXPIRED_PARTITIONS_QUERY = """
+SELECT p.partition_number, p.rows
+FROM sys.partitions p
+JOIN sys.indexes i ON i.object_id = p.object_id AND i.index_id = p.index_id
+JOIN sys.partition_schemes ps ON ps.data_space_id = i.data_space_id
+JOIN sys.partition_range_values rv ON rv.function_id = ps.function_id AND rv.boundary_id = p.partition_number
+WHERE p.object_id = OBJECT_ID(?) AND i.index_id IN (0, 1) AND p.rows > 0 AND CAST(rv.value AS DATETIME2) <= ?
+"""
+
+
+class RetentionManager:
+    """Scheduled purge of value rows past their retention, per VariableId or per Type, and of rollups per bucket size"""
+
+    def __init__(self, connection: Callable[[], ContextManager], default_days: float = 0,
+                 type_days: Optional[Dict[str, float]] = None, variable_days: Optional[Dict[str, float]] = None,
+                 rollup_days: Optional[Dict[str, float]] = None, partitioned: bool = False,
+                 interval: float = 3600.0, chunk_size: int = 5000, chunk_pause: float = 0.1):
+        """
+        Args:
+            connection: Callable returning a context manager yielding a database connection
+            default_days: Retention (days) of variables without a more specific policy (0 keeps them)
+            type_days: Retention (days) per Type name, 0 keeps the values of that type
+            variable_days: Retention (days) per VariableId, overriding the Type and default policies
+            rollup_days: Retention (days) of the ValueRollup rows per bucket size (s), 0 keeps that bucket size
+            partitioned: Whether the value tables use the monthly partitioned layout
+            interval: Time (s) between two retention runs
+            chunk_size: Number of rows deleted per transaction
+            chunk_pause: Time (s) waited between two chunks so inserts are never queued behind the purge
+        """
+        self.connection = connection
+        self.default_days = default_days
+        self.type_days = type_days or {}
+        self.variable_days = {int(variable_id): days for variable_id, days in (variable_days or {}).items()}
+        self.rollup_days = {int(bucket): days for bucket, days in (rollup_days or {}).items() if days}
+        self.partitioned = partitioned
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.chunk_pause = chunk_pause
+        self.total_reclaimed = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the scheduled retention thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the retention thread, interrupting a running purge between two chunks"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.chunk_pause + 30)
+            self._thread = None
+
+    def run_once(self) -> Dict[str, int]:
+        """Purge every table once, returns the number of reclaimed rows per table"""
+        started = time.monotonic()
+        now = datetime.now()
+        variables = self._variables()
+        cutoffs, partition_cutoff = self._variable_cutoffs(variables, now)
+
+        reclaimed: Dict[str, int] = {}
+        truncated = 0
+        for table_name in VALUE_TABLES if cutoffs else ():
+            tables = [table_name, f"{table_name}Archive"] if self.partitioned else [table_name]
+            for target in tables:
+                if self.partitioned and partition_cutoff:
+                    partitions, row_count = self._truncate_expired_partitions(target, partition_cutoff)
+                    truncated += partitions
+                    if row_count:
+                        reclaimed[target] = reclaimed.get(target, 0) + row_count
+                for variable_id, cutoff in cutoffs.items():
+                    if self._stop_event.is_set():
+                        break
+                    deleted = self._delete_chunked(
+                        f"DELETE TOP (?) FROM {target} WHERE VariableId = ? AND Timestamp < ?", (variable_id, cutoff)
+                    )
+                    if deleted:
+                        reclaimed[target] = reclaimed.get(target, 0) + deleted
+
+        deleted = self._purge_rollups([variable_id for variable_id, _ in variables], now)
+        if deleted:
+            reclaimed[ROLLUP_TABLE] = deleted
+
+        total = sum(reclaimed.values())
+        self.total_reclaimed += total
+        if total or truncated:
+            details = ", ".join(f"{table_name}: {count}" for table_name, count in reclaimed.items())
+            print(
+                f"Retention reclaimed {total} rows ({details or 'none deleted'}) and truncated {truncated} "
+                f"partitions in {time.monotonic() - started:.1f} s, {self.total_reclaimed} rows reclaimed since start"
+            )
+        return reclaimed
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error applying retention: {e}")
+            if self._stop_event.wait(self.interval):
+                break
+
+    def _variables(self) -> List[Tuple[int, str]]:
+        """Return the VariableId and Type name of every variable"""
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(VARIABLE_TYPES_QUERY)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+    def _variable_cutoffs(self, variables: List[Tuple[int, str]],
+                          now: datetime) -> Tuple[Dict[int, datetime], Optional[datetime]]:
+        """
+        Resolve the retention of every variable, returns {VariableId: oldest timestamp to keep} and the time
+        before which whole partitions can be dropped (None while some variable keeps its values forever)
+        """
+        cutoffs = {}
+        for variable_id, type_name in variables:
+            days = self._retention_days(variable_id, type_name)
+            if days:
+                cutoffs[variable_id] = now - timedelta(days=days)
+        partition_cutoff = min(cutoffs.values()) if cutoffs and len(cutoffs) == len(variables) else None
+        return cutoffs, partition_cutoff
+
+    def _retention_days(self, variable_id: int, type_name: str) -> float:
+        if variable_id in self.variable_days:
+            return self.variable_days[variable_id]
+        return self.type_days.get(type_name, self.default_days)
+
+    def _truncate_expired_partitions(self, table_name: str, cutoff: datetime) -> Tuple[int, int]:
+        """
+        Truncate the partitions ending before the longest retention, a metadata only operation,
+        returns the number of truncated partitions and of the rows they held
+        """
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(EXPIRED_PARTITIONS_QUERY, (f"dbo.{table_name}", cutoff))
+                partitions = cursor.fetchall()
+                for partition, _ in partitions:
+                    cursor.execute(f"TRUNCATE TABLE dbo.{table_name} WITH (PARTITIONS ({int(partition)}))")
+                connection.commit()
+            finally:
+                cursor.close()
+        return len(partitions), sum(row_count for _, row_count in partitions)
+
+    def _purge_rollups(self, variable_ids: List[int], now: datetime) -> int:
+        """
+        Delete the rollup buckets past the retention of their bucket size, variable by variable so each chunk
+        seeks the (VariableId, BucketSeconds, BucketStart) key, returns the number of deleted rows
+        """
+        if not self.rollup_days or not self._table_exists(ROLLUP_TABLE):
+            return 0
+        deleted = 0
+        for bucket, days in self.rollup_days.items():
+            cutoff = now - timedelta(days=days)
+            for variable_id in variable_ids:
+                if self._stop_event.is_set():
+                    return deleted
+                deleted += self._delete_chunked(
+                    f"DELETE TOP (?) FROM {ROLLUP_TABLE} WHERE VariableId = ? AND BucketSeconds = ? AND BucketStart < ?",
+                    (variable_id, bucket, cutoff)
+                )
+        return deleted
+
+    def _table_exists(self, table_name: str) -> bool:
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT OBJECT_ID(?, 'U')", (f"dbo.{table_name}",))
+                return cursor.fetchone()[0] is not None
+            finally:
+                cursor.close()
+
+    def _delete_chunked(self, statement: str, params: tuple) -> int:
+        """Run a DELETE TOP (?) statement in short transactions until it deletes less than a chunk, returns the deleted rows"""
+        deleted = 0
+        while not self._stop_event.is_set():
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute(statement, (self.chunk_size, *params))
+                    row_count = max(cursor.rowcount, 0)
+                    connection.commit()
+                finally:
+                    cursor.close()
+            deleted += row_count
+            if row_count < self.chunk_size:
+                break
+            self._stop_event.wait(self.chunk_pause)
+        return deleted
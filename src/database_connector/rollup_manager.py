@@ -0,0 +1,147 @@
+import re
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from insert_type_strategy.interfaces.insert_type_strategy import IInsertTypeStrategy
+from insert_buffer import Row
+
+EPOCH = datetime(1970, 1, 1)
+ROLLUP_TYPES = (int, float)
+
+MERGE_ROLLUP = """
+MERGE ValueRollup WITH (HOLDLOCK) AS target
+USING (SELECT ? AS VariableId, ? AS BucketSeconds, ? AS BucketStart, ? AS MinValue, ? AS MaxValue,
+              ? AS SumValue, ? AS SampleCount, ? AS LastValue, ? AS LastTimestamp) AS source
+ON target.VariableId = source.VariableId AND target.BucketSeconds = source.BucketSeconds
+   AND target.BucketStart = source.BucketStart
+WHEN MATCHED THEN UPDATE SET
+    MinValue = CASE WHEN source.MinValue < target.MinValue THEN source.MinValue ELSE target.MinValue END,
+    MaxValue = CASE WHEN source.MaxValue > target.MaxValue THEN source.MaxValue ELSE target.MaxValue END,
+    SumValue = target.SumValue + source.SumValue,
+    SampleCount = target.SampleCount + source.SampleCount,
+    LastValue = CASE WHEN source.LastTimestamp >= target.LastTimestamp THEN source.LastValue ELSE target.LastValue END,
+    LastTimestamp = CASE WHEN source.LastTimestamp >= target.LastTimestamp THEN source.LastTimestamp ELSE target.LastTimestamp END
+WHEN NOT MATCHED THEN INSERT
+    (VariableId, BucketSeconds, BucketStart, MinValue, MaxValue, SumValue, SampleCount, LastValue, LastTimestamp)
+    VALUES (source.VariableId, source.BucketSeconds, source.BucketStart, source.MinValue, source.MaxValue,
+            source.SumValue, source.SampleCount, source.LastValue, source.LastTimestamp);
+"""
+
+MERGE_LATE = """
+MERGE ValueRollupLate WITH (HOLDLOCK) AS target
+USING (SELECT ? AS VariableId, ? AS LatestSkipped) AS source
+ON target.VariableId = source.VariableId
+WHEN MATCHED AND source.LatestSkipped > target.LatestSkipped THEN UPDATE SET LatestSkipped = source.LatestSkipped
+WHEN NOT MATCHED THEN INSERT (VariableId, LatestSkipped) VALUES (source.VariableId, source.LatestSkipped);
+"""
+
+RollupRow = Tuple[int, int, datetime, float, float, float, int, float, datetime]
+LateRow = Tuple[int, datetime]
+
+
+class RollupManager:
+    """
+    Folds written numeric values into the ValueRollup table (min/max/sum/count/last per bucket).
+    The newest timestamp of the values skipped for being too late is recorded per variable in ValueRollupLate,
+    rollups of that variable are incomplete up to it and readers fall back to the raw values there.
+    """
+
+    def __init__(self, bucket_seconds: Iterable[int] = (1, 60, 3600), lateness_horizon: float = 3600.0,
+                 track_late: bool = True):
+        """
+        Args:
+            bucket_seconds: Bucket sizes (s) maintained for every numeric variable
+            lateness_horizon: Age (s) behind the newest written timestamp after which a late value
+                is no longer folded into the rollups
+            track_late: Record the skipped late values in ValueRollupLate
+        """
+        self.bucket_seconds = sorted(set(int(b) for b in bucket_seconds))
+        self.lateness_horizon = timedelta(seconds=lateness_horizon)
+        self.track_late = track_late
+        self.watermark: Optional[datetime] = None
+        self.late_rows = 0
+        self._lock = threading.Lock()
+
+    def aggregate(self, batches: Dict[IInsertTypeStrategy, List[Row]]
+                  ) -> Tuple[List[RollupRow], List[LateRow], Optional[datetime]]:
+        """
+        Aggregate the numeric rows of a batch per variable and bucket, returns the rows to merge,
+        the newest skipped late timestamp per variable and the new watermark
+        """
+        with self._lock:
+            watermark = self.watermark
+        horizon = watermark - self.lateness_horizon if watermark else None
+
+        buckets: Dict[Tuple[int, int, datetime], list] = {}
+        late: Dict[int, datetime] = {}
+        late_rows = 0
+        for strategy, rows in batches.items():
+            if strategy.value_type not in ROLLUP_TYPES:
+                continue
+            for variable_id, value, timestamp in rows:
+                timestamp = parse_timestamp(timestamp)
+                if timestamp is None or value is None:
+                    continue
+                if horizon and timestamp < horizon:
+                    late_rows += 1
+                    if variable_id not in late or timestamp > late[variable_id]:
+                        late[variable_id] = timestamp
+                    continue
+                if watermark is None or timestamp > watermark:
+                    watermark = timestamp
+                for bucket in self.bucket_seconds:
+                    key = (variable_id, bucket, bucket_start(timestamp, bucket))
+                    aggregate = buckets.get(key)
+                    if aggregate is None:
+                        buckets[key] = [value, value, value, 1, value, timestamp]
+                        continue
+                    aggregate[0] = min(aggregate[0], value)
+                    aggregate[1] = max(aggregate[1], value)
+                    aggregate[2] += value
+                    aggregate[3] += 1
+                    if timestamp >= aggregate[5]:
+                        aggregate[4] = value
+                        aggregate[5] = timestamp
+
+        if late_rows:
+            with self._lock:
+                self.late_rows += late_rows
+            print(f"Skipped {late_rows} values older than the rollup lateness horizon")
+        return [(*key, *aggregate) for key, aggregate in buckets.items()], list(late.items()), watermark
+
+    def merge(self, cursor, rollup_rows: List[RollupRow], late_rows: Optional[List[LateRow]] = None):
+        """Merge aggregated rows into ValueRollup and the skipped late values into ValueRollupLate without committing"""
+        if rollup_rows:
+            cursor.executemany(MERGE_ROLLUP, rollup_rows)
+        if late_rows and self.track_late:
+            cursor.executemany(MERGE_LATE, late_rows)
+
+    def advance(self, watermark: Optional[datetime]):
+        """Move the watermark forward once the batch it was computed from is committed"""
+        if watermark is None:
+            return
+        with self._lock:
+            if self.watermark is None or watermark > self.watermark:
+                self.watermark = watermark
+
+
+def bucket_start(timestamp: datetime, bucket: int) -> datetime:
+    """Start of the bucket of the given size (s) holding timestamp"""
+    seconds = int((timestamp - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=seconds - seconds % bucket)
+
+
+def parse_timestamp(timestamp) -> Optional[datetime]:
+    """Parse a stream or spooled timestamp into a naive datetime, returns None if it can not be parsed"""
+    if isinstance(timestamp, datetime):
+        return timestamp.replace(tzinfo=None)
+    if not isinstance(timestamp, str):
+        return None
+    text = timestamp.strip().replace(" ", "T", 1)
+    if text.endswith("Z"):
+        text = text[:-1]
+    text = re.sub(r"(\.\d{6})\d+", r"\1", text)
+    try:
+        return datetime.fromisoformat(text).replace(tzinfo=None)
+    except ValueError:
+        return None
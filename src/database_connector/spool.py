@@ -0,0 +1,297 @@
+import json
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from insert_type_strategy.interfaces.insert_type_strategy import IInsertTypeStrategy
+from insert_buffer import Row
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+REJECTED_SUFFIX = ".rejected"
+
+
+SpooledRow = Tuple[IInsertTypeStrategy, Row]
+
+
+class Spool:
+    """
+    Disk-backed, append-only spool of rows the database rejected, replayed in bulk once it is reachable again.
+    When the database answers but rejects a segment, its rows are retried in halves and only the rows rejected
+    on their own are set aside, in a segment-*.log.rejected file of the same format. Renaming such a file back
+    to segment-*.log queues its rows for replay again. Rejected files count in max_bytes and are dropped
+    before any segment still to replay.
+    """
+
+    def __init__(self, directory: str, write_batch: Callable[[Dict[IInsertTypeStrategy, List[Row]]], None],
+                 strategy_for_table: Callable[[str], Optional[IInsertTypeStrategy]],
+                 is_database_available: Callable[[], bool], max_bytes: int = 512 * 1024 * 1024,
+                 segment_bytes: int = 8 * 1024 * 1024, replay_interval: float = 5.0):
+        """
+        Args:
+            directory: Directory holding the segment files
+            write_batch: Callable writing {strategy: rows} to the database in a single transaction
+            strategy_for_table: Callable returning the insert strategy of a value table
+            is_database_available: Callable telling whether the database currently answers
+            max_bytes: Disk usage above which the oldest rejected files, then the oldest segments are dropped
+            segment_bytes: Size after which the current segment is closed and a new one started
+            replay_interval: Time (s) between two replay attempts while the spool holds rows
+        """
+        self.directory = directory
+        self.write_batch = write_batch
+        self.strategy_for_table = strategy_for_table
+        self.is_database_available = is_database_available
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.replay_interval = replay_interval
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._segments: List[str] = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+        self._sizes: Dict[str, int] = {name: os.path.getsize(self._path(name)) for name in self._segments}
+        self._rejected_sizes: Dict[str, int] = {
+            name: os.path.getsize(self._path(name)) for name in sorted(os.listdir(self.directory))
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX + REJECTED_SUFFIX)
+        }
+        sequences = [self._sequence(name) for name in self._segments]
+        sequences += [self._sequence(name[:-len(REJECTED_SUFFIX)]) for name in self._rejected_sizes]
+        self._next_sequence = max(sequences) + 1 if sequences else 0
+        self._writer = None
+        self._writer_segment = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._replay_thread = None
+        if self._segments:
+            print(f"Spool holds {len(self._segments)} segments ({sum(self._sizes.values())} bytes) to replay")
+
+    def start(self):
+        """Start the background replay thread"""
+        if self._replay_thread and self._replay_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._replay_thread = threading.Thread(target=self._run_replay, daemon=True)
+        self._replay_thread.start()
+
+    def stop(self):
+        """Stop replaying and close the current segment"""
+        self._stop_event.set()
+        if self._replay_thread:
+            self._replay_thread.join(timeout=self.replay_interval + 5)
+            self._replay_thread = None
+        with self._lock:
+            self._close_writer()
+
+    def has_backlog(self) -> bool:
+        """True while rows are waiting on disk, new rows must then be spooled too to keep them in order"""
+        return bool(self._segments)
+
+    def append(self, batches: Dict[IInsertTypeStrategy, List[Row]]) -> int:
+        """Append rows to the current segment and sync it to disk, returns the number of spooled rows"""
+        lines = self._encode([(strategy, row) for strategy, rows in batches.items() for row in rows])
+        if not lines:
+            return 0
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+
+        with self._lock:
+            writer = self._current_writer()
+            writer.write(data)
+            writer.flush()
+            os.fsync(writer.fileno())
+            self._sizes[self._writer_segment] += len(data)
+            if self._sizes[self._writer_segment] >= self.segment_bytes:
+                self._close_writer()
+            self._enforce_max_bytes()
+        return len(lines)
+
+    def replay(self) -> int:
+        """Replay segments oldest first until the spool is empty or the database fails, returns replayed rows"""
+        replayed = 0
+        while not self._stop_event.is_set():
+            with self._lock:
+                if not self._segments:
+                    break
+                segment = self._segments[0]
+                if segment == self._writer_segment:
+                    self._close_writer()
+
+            batches, row_count = self._read_segment(segment)
+            try:
+                if batches:
+                    self.write_batch(batches)
+            except Exception as e:
+                if self.is_database_available():
+                    print(f"Database rejected spooled segment {segment}, isolating the rejected rows: {e}")
+                    written = self._isolate_rejected(segment, batches)
+                    if written is not None:
+                        replayed += written
+                        continue
+                print(f"Spool replay paused, database unavailable: {e}")
+                break
+
+            self._remove(segment)
+            replayed += row_count
+
+        if replayed:
+            print(f"Replayed {replayed} spooled rows, {len(self._segments)} segments left")
+        return replayed
+
+    def _isolate_rejected(self, segment: str, batches: Dict[IInsertTypeStrategy, List[Row]]) -> Optional[int]:
+        """
+        Write the rows of a rejected segment in halves, setting aside only the rows the database rejects alone.
+        Returns the number of rows written, or None if the database became unavailable, the rows not written yet
+        are then kept in the segment.
+        """
+        pending = [[(strategy, row) for strategy, rows in batches.items() for row in rows]]
+        rejected: List[SpooledRow] = []
+        written = 0
+        while pending:
+            chunk = pending.pop()
+            try:
+                self.write_batch(self._group(chunk))
+            except Exception as e:
+                if not self.is_database_available():
+                    remaining = [spooled for part in [chunk] + pending[::-1] for spooled in part]
+                    self._rewrite(segment, remaining)
+                    self._append_rejected(segment, rejected)
+                    return None
+                if len(chunk) == 1:
+                    print(f"Database rejected spooled row {chunk[0][1]} of {chunk[0][0].table_name}: {e}")
+                    rejected.extend(chunk)
+                    continue
+                middle = len(chunk) // 2
+                pending.append(chunk[middle:])
+                pending.append(chunk[:middle])
+                continue
+            written += len(chunk)
+
+        self._append_rejected(segment, rejected)
+        self._remove(segment)
+        print(f"Replayed spooled segment {segment}, {len(rejected)} rejected rows set aside")
+        return written
+
+    def _run_replay(self):
+        while not self._stop_event.wait(self.replay_interval):
+            if self._segments:
+                try:
+                    self.replay()
+                except Exception as e:
+                    print(f"Error replaying spool: {e}")
+
+    def _read_segment(self, segment: str):
+        """Group the rows of a segment per insert strategy, keeping their order"""
+        batches: Dict[IInsertTypeStrategy, List[Row]] = {}
+        row_count = 0
+        with open(self._path(segment), "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    table_name, variable_id, value, timestamp = json.loads(line)
+                except ValueError:
+                    print(f"Skipping corrupted line in spool segment {segment}")
+                    continue
+                strategy = self.strategy_for_table(table_name)
+                if not strategy:
+                    print(f"Skipping spooled row for unknown table {table_name}")
+                    continue
+                batches.setdefault(strategy, []).append((variable_id, value, timestamp))
+                row_count += 1
+        return batches, row_count
+
+    def _current_writer(self):
+        if self._writer is None:
+            segment = f"{SEGMENT_PREFIX}{self._next_sequence:012d}{SEGMENT_SUFFIX}"
+            self._next_sequence += 1
+            self._writer = open(self._path(segment), "ab")
+            self._writer_segment = segment
+            self._segments.append(segment)
+            self._sizes[segment] = 0
+        return self._writer
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._writer_segment = None
+
+    def _enforce_max_bytes(self):
+        """Drop the oldest rejected files, then the oldest closed segments while the spool exceeds max_bytes"""
+        while self._rejected_sizes and self._used_bytes() > self.max_bytes:
+            rejected = min(self._rejected_sizes)
+            print(f"Spool exceeds {self.max_bytes} bytes, dropping oldest rejected rows {rejected}")
+            self._rejected_sizes.pop(rejected)
+            try:
+                os.remove(self._path(rejected))
+            except FileNotFoundError:
+                pass
+        while self._used_bytes() > self.max_bytes and len(self._segments) > 1:
+            segment = self._segments[0]
+            if segment == self._writer_segment:
+                break
+            print(f"Spool exceeds {self.max_bytes} bytes, dropping oldest segment {segment}")
+            self._remove_locked(segment)
+
+    def _used_bytes(self) -> int:
+        return sum(self._sizes.values()) + sum(self._rejected_sizes.values())
+
+    def _remove(self, segment: str):
+        with self._lock:
+            self._remove_locked(segment)
+
+    def _remove_locked(self, segment: str):
+        if segment in self._segments:
+            self._segments.remove(segment)
+        self._sizes.pop(segment, None)
+        try:
+            os.remove(self._path(segment))
+        except FileNotFoundError:
+            pass
+
+    def _rewrite(self, segment: str, rows: List[SpooledRow]):
+        """Replace the content of a closed segment with the rows still to replay"""
+        data = "".join(line + "\n" for line in self._encode(rows)).encode("utf-8")
+        temporary = self._path(segment + ".tmp")
+        with open(temporary, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        with self._lock:
+            if segment not in self._segments:
+                os.remove(temporary)
+                return
+            os.replace(temporary, self._path(segment))
+            self._sizes[segment] = len(data)
+
+    def _append_rejected(self, segment: str, rows: List[SpooledRow]):
+        """Set rejected rows aside next to their segment"""
+        if not rows:
+            return
+        rejected = segment + REJECTED_SUFFIX
+        data = "".join(line + "\n" for line in self._encode(rows)).encode("utf-8")
+        with self._lock:
+            with open(self._path(rejected), "ab") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            self._rejected_sizes[rejected] = self._rejected_sizes.get(rejected, 0) + len(data)
+            self._enforce_max_bytes()
+
+    @staticmethod
+    def _encode(rows: List[SpooledRow]) -> List[str]:
+        return [
+            json.dumps([strategy.table_name, variable_id, value, timestamp], default=str)
+            for strategy, (variable_id, value, timestamp) in rows
+        ]
+
+    @staticmethod
+    def _group(rows: List[SpooledRow]) -> Dict[IInsertTypeStrategy, List[Row]]:
+        batches: Dict[IInsertTypeStrategy, List[Row]] = {}
+        for strategy, row in rows:
+            batches.setdefault(strategy, []).append(row)
+        return batches
+
+    def _path(self, segment: str) -> str:
+        return os.path.join(self.directory, segment)
+
+    @staticmethod
+    def _sequence(segment: str) -> int:
+        return int(segment[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
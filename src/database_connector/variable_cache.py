@@ -0,0 +1,173 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from insert_type_strategy_factory import InsertTypeFactory
+from insert_type_strategy.interfaces.insert_type_strategy import IInsertTypeStrategy
+
+Resolution = Tuple[Any, IInsertTypeStrategy]
+
+MISS = object()
+
+MAPPING_QUERY = (
+    "SELECT l.AssetUuid, l.DataItemId, l.VariableId, t.Nom "
+    "FROM OpenFactoryLink l "
+    "JOIN Variable v ON v.Id = l.VariableId "
+    "JOIN Type t ON t.Id = v.TypeId"
+)
+
+CHANGE_QUERY = (
+    "SELECT (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(DataItemId, VariableId, AssetUuid)) FROM OpenFactoryLink), "
+    "(SELECT COUNT(*) FROM OpenFactoryLink), "
+    "(SELECT CHECKSUM_AGG(BINARY_CHECKSUM(Id, TypeId)) FROM Variable)"
+)
+
+
+class VariableCache:
+    """In-memory (asset_uuid, dataitem_id) -> (VariableId, insert strategy) resolution cache"""
+
+    def __init__(self, fetch_rows: Callable[[str, tuple], List[tuple]],
+                 refresh_interval: float = 30.0, negative_ttl: float = 300.0):
+        """
+        Args:
+            fetch_rows: Callable executing a query with parameters and returning all rows
+            refresh_interval: Time (s) between two polls of OpenFactoryLink for changes (0 disables polling)
+            negative_ttl: Time (s) an unknown (asset_uuid, dataitem_id) stays cached as unknown
+        """
+        self.fetch_rows = fetch_rows
+        self.refresh_interval = refresh_interval
+        self.negative_ttl = negative_ttl
+
+        self._mapping: Dict[Tuple[str, str], Resolution] = {}
+        self._unknown: Dict[Tuple[str, str], float] = {}
+        self._signature = None
+        self._lock = threading.Lock()
+        self._lookup_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._poll_thread = None
+
+    def load(self):
+        """Preload the whole mapping"""
+        signature = self._fetch_signature()
+        mapping = self._fetch_mapping()
+        with self._lock:
+            self._mapping = mapping
+            self._unknown.clear()
+            self._signature = signature
+        print(f"Variable cache loaded with {len(mapping)} dataitems")
+
+    def start(self):
+        """Start polling OpenFactoryLink for changes"""
+        if not self.refresh_interval or (self._poll_thread and self._poll_thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._poll_thread = threading.Thread(target=self._run_poller, daemon=True)
+        self._poll_thread.start()
+
+    def stop(self):
+        """Stop polling"""
+        self._stop_event.set()
+        if self._poll_thread:
+            self._poll_thread.join(timeout=5)
+            self._poll_thread = None
+
+    def get(self, asset_uuid: str, dataitem_id: str):
+        """Return the cached resolution, None for a known unknown dataitem, or MISS when the database must be queried"""
+        key = (asset_uuid, dataitem_id)
+        resolution = self._mapping.get(key)
+        if resolution is not None:
+            return resolution
+
+        expires_at = self._unknown.get(key)
+        if expires_at is not None and expires_at > time.monotonic():
+            return None
+        return MISS
+
+    def resolve(self, asset_uuid: str, dataitem_id: str) -> Optional[Resolution]:
+        """
+        Return (VariableId, strategy) for a dataitem, or None if it is not linked to a variable.
+        Raises the database error when the lookup fails, nothing is cached then.
+        """
+        resolution = self.get(asset_uuid, dataitem_id)
+        if resolution is not MISS:
+            return resolution
+
+        with self._lookup_lock:
+            resolution = self.get(asset_uuid, dataitem_id)
+            if resolution is not MISS:
+                return resolution
+            return self._lookup((asset_uuid, dataitem_id))
+
+    def assets(self) -> List[str]:
+        """Return every AssetUuid present in the mapping"""
+        return sorted({asset_uuid for asset_uuid, _ in self._mapping})
+
+    def refresh(self) -> bool:
+        """Apply OpenFactoryLink changes to the mapping if any, returns True when the mapping changed"""
+        signature = self._fetch_signature()
+        if signature == self._signature:
+            return False
+
+        mapping = self._fetch_mapping()
+        with self._lock:
+            added = mapping.keys() - self._mapping.keys()
+            removed = self._mapping.keys() - mapping.keys()
+            changed = [
+                key for key in mapping.keys() & self._mapping.keys()
+                if mapping[key][0] != self._mapping[key][0] or mapping[key][1] is not self._mapping[key][1]
+            ]
+            for key in removed:
+                del self._mapping[key]
+            for key in list(added) + changed:
+                self._mapping[key] = mapping[key]
+                self._unknown.pop(key, None)
+            self._signature = signature
+
+        print(f"Variable cache refreshed: {len(added)} added, {len(changed)} changed, {len(removed)} removed")
+        return True
+
+    def _lookup(self, key: Tuple[str, str]) -> Optional[Resolution]:
+        """Resolve a single dataitem missing from the mapping and cache the outcome of a successful query"""
+        asset_uuid, dataitem_id = key
+        try:
+            rows = self.fetch_rows(f"{MAPPING_QUERY} WHERE l.AssetUuid = ? AND l.DataItemId = ?",
+                                   (asset_uuid, dataitem_id))
+        except Exception as e:
+            print(f"Error resolving AssetUuid={asset_uuid} and DataitemId={dataitem_id}: {e}")
+            raise
+
+        resolution = self._to_resolution(rows[0]) if rows else None
+        with self._lock:
+            if resolution:
+                self._mapping[key] = resolution
+            else:
+                self._unknown[key] = time.monotonic() + self.negative_ttl
+        if not resolution:
+            print(f"No VariableId found for AssetUuid={asset_uuid} and DataitemId={dataitem_id}")
+        return resolution
+
+    def _fetch_mapping(self) -> Dict[Tuple[str, str], Resolution]:
+        mapping = {}
+        for row in self.fetch_rows(MAPPING_QUERY, ()):
+            resolution = self._to_resolution(row)
+            if resolution:
+                mapping[(row[0], row[1])] = resolution
+        return mapping
+
+    def _fetch_signature(self) -> tuple:
+        rows = self.fetch_rows(CHANGE_QUERY, ())
+        return tuple(rows[0]) if rows else ()
+
+    def _to_resolution(self, row) -> Optional[Resolution]:
+        _, _, variable_id, type_name = row
+        strategy = InsertTypeFactory.create_strategy(type_name)
+        if not strategy:
+            print(f"No insert strategy for type {type_name} of VariableId={variable_id}")
+            return None
+        return variable_id, strategy
+
+    def _run_poller(self):
+        while not self._stop_event.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing variable cache: {e}")
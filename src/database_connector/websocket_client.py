@@ -1,17 +1,22 @@
 import asyncio
-import os
+import json
 import websockets
-from typing import Dict, Callable, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Set
+from urllib.parse import quote
 
 class OpenFactoryWebSocketClient:
-    """WebSocket client for OpenFactory to connect and interact with devices."""
+    """WebSocket client for OpenFactory receiving the messages of all assets over a single connection."""
     
     def __init__(self, base_url: str = "ws://ofa-api:8000"):
         """Initialize the WebSocket client with the base URL."""
         self.base_url = base_url
-        self.connection_tasks: Dict[str, asyncio.Task] = {}
+        self.assets: Set[str] = set()
+        self.connection_task: Optional[asyncio.Task] = None
+        self.websocket = None
         self.message_handler: Optional[Callable] = None
         self.running = False
+        self.epoch: Optional[str] = None
+        self.last_seq: Dict[str, int] = {}
         
     def set_message_handler(self, handler: Callable):
         """Set the message handler function"""
@@ -20,63 +25,106 @@ class OpenFactoryWebSocketClient:
     async def start(self, assets: List[str]):
         """Start the WebSocket client and begin listening for messages"""
         self.running = True
+        self.assets = set(assets)
         
         print(f"Starting WebSocket client with assets: {assets}")
         
-        for asset_uuid in assets:
-            if asset_uuid not in self.connection_tasks:
-                print(f"Creating connection task for asset: {asset_uuid}")
-                task = asyncio.create_task(self._maintain_connection(asset_uuid))
-                self.connection_tasks[asset_uuid] = task
-        
-        if self.connection_tasks:
-            await asyncio.gather(*self.connection_tasks.values(), return_exceptions=True)
+        if not self.connection_task:
+            self.connection_task = asyncio.create_task(self._maintain_connection())
+            await asyncio.gather(self.connection_task, return_exceptions=True)
+
+    async def set_assets(self, assets: List[str]):
+        """Update the subscribed assets on the live connection"""
+        added = set(assets) - self.assets
+        removed = self.assets - set(assets)
+        self.assets = set(assets)
+        if added:
+            await self._send_control("subscribe", sorted(added))
+        if removed:
+            await self._send_control("unsubscribe", sorted(removed))
+
+    async def _send_control(self, method: str, assets: List[str]):
+        """Send a subscribe/unsubscribe control message, the next reconnect applies it otherwise"""
+        if not self.websocket:
+            return
+        print(f"Sending {method} for assets: {assets}")
+        try:
+            await self.websocket.send(json.dumps({"method": method, "params": {"assets": assets}}))
+        except websockets.exceptions.ConnectionClosed as e:
+            print(f"Could not send {method}, connection closed: {e}")
 
-    async def _maintain_connection(self, device_uuid: str):
-        """Maintain a persistent connection to a device's WebSocket"""
+    async def _maintain_connection(self):
+        """Maintain a persistent connection to the multiplexed WebSocket stream"""
         while self.running:
             try:
-                await self._listen_for_messages(device_uuid)
+                await self._listen_for_messages()
             except Exception as e:
-                print(f"Connection error for device {device_uuid}: {e}")
+                print(f"Connection error for stream: {e}")
                 print("Retrying connection in 5 seconds...")
                 await asyncio.sleep(5)
 
-    async def _listen_for_messages(self, device_uuid: str):
-        """Subscribe to a device's WebSocket stream and listen for messages"""
-        device_ws_url = f"{self.base_url}/ws/devices/{device_uuid}"
+    async def _listen_for_messages(self):
+        """Subscribe to the WebSocket stream of all assets and listen for messages, resuming where the last connection stopped"""
+        assets = ",".join(quote(asset, safe="") for asset in sorted(self.assets))
+        stream_ws_url = f"{self.base_url}/ws/stream?assets={assets}&policy=disconnect"
+        if self.epoch and self.last_seq:
+            last_seq = ",".join(f"{quote(asset, safe='')}:{seq}" for asset, seq in self.last_seq.items() if asset in self.assets)
+            stream_ws_url += f"&epoch={self.epoch}&last_seq={last_seq}"
         
-        print(f"Attempting to connect to: {device_ws_url}")
+        print(f"Attempting to connect to: {stream_ws_url}")
         
         try:
-            async with websockets.connect(device_ws_url) as ws:
-                print(f"Successfully connected to WebSocket for device {device_uuid}")
+            async with websockets.connect(stream_ws_url) as ws:
+                print(f"Successfully connected to WebSocket stream for {len(self.assets)} assets")
+                self.websocket = ws
                 
                 while self.running:
                     try:
-                        msg = await ws.recv()
-                        self.message_handler(msg)
+                        raw_message = await ws.recv()
                     except websockets.exceptions.ConnectionClosed as e:
-                        print(f"WebSocket connection closed for {device_uuid}: {e}")
+                        print(f"WebSocket stream connection closed: {e}")
                         break
+                    try:
+                        msg = json.loads(raw_message)
+                    except json.JSONDecodeError as e:
+                        print(f"Skipping undecodable message: {e}")
+                        continue
+                    if not isinstance(msg, dict):
+                        print(f"Skipping unexpected message: {raw_message[:200]}")
+                        continue
+                    self._track_sequence(msg)
+                    self.message_handler(msg)
                         
         except websockets.exceptions.InvalidURI as e:
-            print(f"Invalid WebSocket URI for {device_uuid}: {e}")
-            print(f"Attempted URL: {device_ws_url}")
+            print(f"Invalid WebSocket URI: {e}")
+            print(f"Attempted URL: {stream_ws_url}")
             raise
         except asyncio.TimeoutError:
-            print(f"Connection timeout for {device_uuid}")
+            print("Connection timeout for stream")
             raise
         except Exception as e:
-            print(f"Unexpected error connecting to {device_uuid}: {type(e).__name__}: {e}")
+            print(f"Unexpected error connecting to stream: {type(e).__name__}: {e}")
             raise
+        finally:
+            self.websocket = None
+
+    def _track_sequence(self, message: Dict[str, Any]):
+        """Remember the last sequence number received per asset, sent back to resume after a reconnect"""
+        event = message.get("event")
+        if event in ("connection_established", "resumed"):
+            if message.get("epoch") != self.epoch:
+                self.epoch = message.get("epoch")
+                self.last_seq.clear()
+            if event == "connection_established" and message.get("device_uuid"):
+                self.last_seq[message["device_uuid"]] = message.get("seq", 0)
+        elif "seq" in message and message.get("asset_uuid"):
+            self.last_seq[message["asset_uuid"]] = message["seq"]
 
     async def stop(self):
         """Stop the WebSocket client"""
         self.running = False
         
-        for task in self.connection_tasks.values():
-            task.cancel()
-            
-        if self.connection_tasks:
-            await asyncio.gather(*self.connection_tasks.values(), return_exceptions=True)
\ No newline at end of file
+        if self.connection_task:
+            self.connection_task.cancel()
+            await asyncio.gather(self.connection_task, return_exceptions=True)
+            self.connection_task = None
\ No newline at end of file
@@ -8,11 +8,8 @@ from openfactory.assets import Asset
 from openfactory.kafka import KSQLDBClient
 
 from config import Config
-from services.device_service import DeviceService
-from services.stream_service import StreamService
-from connection.connection_manager import ConnectionManager
-from connection.websockets_manager import WebsocketsManager
-from topic_subscription import TopicSubscriber
+from services.ksql_client import AsyncKSQLClient
+from workers import build_websockets_manager, start_worker, websocket_server_options
 
 class OpenFactoryAPI(OpenFactoryApp):
     """Main application class that orchestrates all components"""
@@ -25,19 +22,26 @@ class OpenFactoryAPI(OpenFactoryApp):
 
 
         self.ksqlClient = ksqlClient
-        self.topic_subscriber = TopicSubscriber()
-        self.connection_manager = ConnectionManager()
-        self.websockets_manager = WebsocketsManager(
-            self.connection_manager,
-            DeviceService(self.ksqlClient), 
-            StreamService(self.ksqlClient),
-            self.topic_subscriber,
-            self
-        )
+        self.async_ksql_client = None
+        self.websockets_manager = None
+        self.connection_manager = None
+        self.topic_subscriber = None
+        if config.workers <= 1:
+            # In worker mode each worker builds its own stack, the parent process only supervises them
+            self.async_ksql_client = AsyncKSQLClient(
+                config.ksqldb_url,
+                timeout=config.ksql_timeout,
+                cache_ttl=config.ksql_cache_ttl,
+                max_connections=config.ksql_max_connections
+            )
+            self.websockets_manager = build_websockets_manager(config, self, self.async_ksql_client)
+            self.connection_manager = self.websockets_manager.connection_manager
+            self.topic_subscriber = self.websockets_manager.topic_subscriber
         
         self.websocket_server = None
         self.websocket_task = None
         self.websocket_thread = None
+        self.worker_processes = []
 
     def initialize_asset(self, device_uuid: str):
         return Asset(
@@ -55,6 +59,10 @@ class OpenFactoryAPI(OpenFactoryApp):
         """
         print("Starting OpenFactory main loop...")
         
+        if self.config.workers > 1:
+            self._run_workers()
+            return
+        
         self.websocket_thread = threading.Thread(
             target=self._run_websocket_server_thread, 
             daemon=True
@@ -63,6 +71,8 @@ class OpenFactoryAPI(OpenFactoryApp):
         
         while self.running:
             try:
+                if self.topic_subscriber:
+                    self.topic_subscriber.ensure_running()
                 total_connections = sum(
                     len(connections) for connections in self.connection_manager.device_connections.values()
                 )
@@ -71,12 +81,42 @@ class OpenFactoryAPI(OpenFactoryApp):
                         f"Active WebSocket connections: {total_connections} "
                         f"across {len(self.connection_manager.device_connections)} devices"
                     )
+                    stats = self.connection_manager.get_queue_stats()
+                    print(
+                        f"Outbound queues: {stats['queued_frames']} frames queued (max depth {stats['max_queue_depth']}), "
+                        f"{stats['dropped_frames']} dropped, {stats['coalesced_frames']} coalesced, "
+                        f"{stats['slow_client_disconnects']} slow clients disconnected, "
+                        f"{stats['filtered_updates']} updates filtered"
+                    )
                 time.sleep(30)
             except KeyboardInterrupt:
                 print("Shutting down WebSocket API...")
                 self.running = False
                 break
 
+    def _run_workers(self):
+        """
+        Run the websocket server in worker processes sharing the listening port, restarting any that dies.
+        """
+        self.worker_processes = [start_worker(self.config, worker_id) for worker_id in range(self.config.workers)]
+        print(f"Started {self.config.workers} websocket API workers")
+        
+        try:
+            while self.running:
+                for worker_id, process in enumerate(self.worker_processes):
+                    if not process.is_alive():
+                        print(f"Worker {worker_id} exited with code {process.exitcode}, restarting it")
+                        self.worker_processes[worker_id] = start_worker(self.config, worker_id)
+                time.sleep(5)
+        except KeyboardInterrupt:
+            print("Shutting down WebSocket API workers...")
+            self.running = False
+        finally:
+            for process in self.worker_processes:
+                process.terminate()
+            for process in self.worker_processes:
+                process.join(timeout=5)
+
     def _run_websocket_server_thread(self):
         """
         Run WebSocket server in its own thread with its own event loop.
@@ -99,8 +139,7 @@ class OpenFactoryAPI(OpenFactoryApp):
                 self.websockets_manager.handle_connection,
                 self.config.websocket_host,
                 self.config.websocket_port,
-                ping_interval=self.config.ping_interval,
-                ping_timeout=self.config.ping_timeout
+                **websocket_server_options(self.config)
             )
             print(f"WebSocket server started on {self.config.websocket_host}:{self.config.websocket_port}")
             
@@ -114,6 +153,7 @@ class OpenFactoryAPI(OpenFactoryApp):
             if self.websocket_server:
                 self.websocket_server.close()
                 await self.websocket_server.wait_closed()
+            await self.async_ksql_client.close()
 
     def app_event_loop_stopped(self):
         """
@@ -125,12 +165,23 @@ class OpenFactoryAPI(OpenFactoryApp):
 
 def main():
     """Main entry point"""
-    config = Config()
+    config = Config(
+        ksqldb_url=os.getenv('KSQLDB_URL', 'http://ksqldb-server:8088'),
+        kafka_brokers=os.getenv('KAFKA_BROKER', 'broker:29092'),
+        stream_mode=os.getenv('STREAM_MODE', 'per_device'),
+        workers=int(os.getenv('API_WORKERS', '1')),
+        worker_routing=os.getenv('API_WORKER_ROUTING', 'redirect'),
+        metrics_enabled=os.getenv('METRICS_ENABLED', 'false').lower() == 'true',
+        history_server=os.getenv('HISTORY_SQL_SERVER', ''),
+        history_database=os.getenv('HISTORY_SQL_DATABASE', ''),
+        history_user=os.getenv('HISTORY_SQL_USER', ''),
+        history_password=os.getenv('HISTORY_SQL_PASSWORD', '')
+    )
     
     api = OpenFactoryAPI(
         app_uuid='OFA-API',
         config=config,
-        ksqlClient=KSQLDBClient(os.getenv('KSQLDB_URL', 'http://ksqldb-server:8088')),
+        ksqlClient=KSQLDBClient(config.ksqldb_url),
         bootstrap_servers=os.getenv('KAFKA_BROKER', 'broker:29092')
     )
     
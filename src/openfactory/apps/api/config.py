@@ -1,12 +1,53 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import List
 
 @dataclass
 class Config:
     ksqldb_url: str = "http://ksqldb-server:8088"
+    ksql_timeout: float = 5.0
+    ksql_cache_ttl: float = 2.0
+    ksql_max_connections: int = 10
     kafka_brokers: str = "broker:29092"
+    kafka_group_id: str = "api_device_streams"
+    stream_mode: str = "per_device"
+    shared_stream_topic: str = "ofa_api_device_stream"
+    shared_stream_partitions: int = 6
     websocket_host: str = "0.0.0.0"
     websocket_port: int = 8000
+    workers: int = 1
+    worker_base_port: int = 8100
+    worker_routing: str = "redirect"
     ping_interval: int = 30
     ping_timeout: int = 10
+    compression: str = "deflate"
+    compression_level: int = 6
+    max_batch_frames: int = 100
+    replay_buffer_size: int = 1000
+    metrics_enabled: bool = False
     message_timeout: int = 30
-    log_level: str = "INFO"
\ No newline at end of file
+    outbound_queue_size: int = 1000
+    device_queue_policy: str = "drop_oldest"
+    stream_queue_policy: str = "disconnect"
+    power_totals_topic: str = "IVAC_POWER_STATE_TOTALS"
+    moving_average_dataitems: List[str] = field(default_factory=lambda: [
+        "pm1_concentration", "pm2_5_concentration", "pm4_concentration", "pm10_concentration"
+    ])
+    log_level: str = "INFO"
+    history_server: str = ""
+    history_database: str = ""
+    history_user: str = ""
+    history_password: str = ""
+    history_page_size: int = 1000
+    history_max_rows: int = 100000
+    history_timezone: str = "Canada/Eastern"
+
+    def history_connection_string(self) -> str:
+        return (
+            f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+            f"SERVER={self.history_server};"
+            f"DATABASE={self.history_database};"
+            f"UID={self.history_user};"
+            f"PWD={self.history_password};"
+            f"TrustServerCertificate=yes;"
+            f"Connection Timeout=30;"
+        )
\ No newline at end of file
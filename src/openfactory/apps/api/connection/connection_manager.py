@@ -1,57 +1,248 @@
 import asyncio
-import json
+import time
 from collections import defaultdict
-from typing import Dict, Set
+from typing import Callable, Dict, List, Optional, Set, Tuple
 from websockets.server import WebSocketServerProtocol
 
+from connection.frames import encode_frame, frame_size, JSON
+from connection.outbound_queue import OutboundQueue, DROP_OLDEST
+from connection.subscription_filter import SubscriptionFilter
+from metrics import REGISTRY
+
+ENCODE_SECONDS = REGISTRY.histogram(
+    "ofa_api_encode_seconds", "Time spent encoding a broadcast message", ("encoding",),
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+)
+DEVICE_MESSAGES = REGISTRY.counter("ofa_api_device_messages_total", "Device messages queued for clients", ("device",))
+DEVICE_QUEUED_BYTES = REGISTRY.counter(
+    "ofa_api_device_queued_bytes_total", "Encoded bytes of the device messages queued for clients", ("device",)
+)
+
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, max_queue_size: int = 1000, endpoint_policies: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            max_queue_size: Maximum number of frames waiting to be sent to one client
+            endpoint_policies: Slow client policy (drop_oldest, coalesce or disconnect) per endpoint name
+        """
         self.device_connections: Dict[str, Set[WebSocketServerProtocol]] = defaultdict(set)
-        self.connection_to_device: Dict[WebSocketServerProtocol, str] = {}
-        self.message_queues: Dict[WebSocketServerProtocol, asyncio.Queue] = {}
+        self.connection_to_devices: Dict[WebSocketServerProtocol, Set[str]] = {}
+        self.message_queues: Dict[WebSocketServerProtocol, OutboundQueue] = {}
+        self.subscription_filters: Dict[Tuple[WebSocketServerProtocol, str], SubscriptionFilter] = {}
+        self._trailing_timers: Dict[Tuple[WebSocketServerProtocol, str], asyncio.TimerHandle] = {}
+        self.max_queue_size = max_queue_size
+        self.endpoint_policies = endpoint_policies or {}
+        self.dropped_messages = 0
+        self.coalesced_messages = 0
+        self.slow_client_disconnects = 0
+        self.filtered_updates = 0
         self._lock = asyncio.Lock()
-    
-    async def add_connection(self, websocket: WebSocketServerProtocol, device_uuid: str):
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """Expose the connection and outbound queue statistics, read when the metrics are scraped"""
+        REGISTRY.gauge("ofa_api_connections", "Open websocket connections",
+                       function=lambda: len(self.connection_to_devices))
+        REGISTRY.gauge("ofa_api_outbound_queued_frames", "Frames waiting in the outbound queues",
+                       function=lambda: sum(queue.qsize() for queue in list(self.message_queues.values())))
+        REGISTRY.gauge("ofa_api_outbound_queue_depth_max", "Depth of the deepest outbound queue",
+                       function=lambda: max((queue.qsize() for queue in list(self.message_queues.values())), default=0))
+        for name, stat, documentation in (
+            ("ofa_api_outbound_dropped_frames_total", "dropped_frames", "Frames dropped by the slow client policies"),
+            ("ofa_api_outbound_coalesced_frames_total", "coalesced_frames", "Frames replaced by a newer frame of the same dataitem"),
+            ("ofa_api_slow_client_disconnects_total", "slow_client_disconnects", "Connections closed for being too slow"),
+            ("ofa_api_filtered_updates_total", "filtered_updates", "Device updates dropped by subscription filters"),
+        ):
+            REGISTRY.counter(name, documentation, function=lambda stat=stat: self.get_queue_stats()[stat])
+
+    async def register_connection(self, websocket: WebSocketServerProtocol, endpoint: str = "device",
+                                  encoding: str = JSON, policy: Optional[str] = None):
+        """
+        Register a WebSocket connection with its bounded outgoing message queue and frame encoding.
+        The slow client policy is the one the client asked for, else the one of its endpoint.
+        """
+        async with self._lock:
+            if websocket not in self.connection_to_devices:
+                self.connection_to_devices[websocket] = set()
+                self.message_queues[websocket] = OutboundQueue(
+                    self.max_queue_size,
+                    policy or self.endpoint_policies.get(endpoint, DROP_OLDEST),
+                    encoding
+                )
+
+    async def add_connection(self, websocket: WebSocketServerProtocol, device_uuid: str, endpoint: str = "device",
+                             encoding: str = JSON):
         """Add a new WebSocket connection for a device"""
+        await self.register_connection(websocket, endpoint, encoding)
+        await self.subscribe(websocket, device_uuid)
+
+    async def subscribe(self, websocket: WebSocketServerProtocol, device_uuid: str,
+                        backlog: Optional[Callable[[], Optional[List[Dict]]]] = None) -> Optional[List[Dict]]:
+        """
+        Subscribe a registered connection to the messages of a device.
+        The messages returned by backlog are queued in the same step, so none is missed or sent twice;
+        the backlog is returned.
+        """
         async with self._lock:
+            if websocket not in self.connection_to_devices:
+                return None
+            messages = backlog() if backlog is not None else None
+            queue = self.message_queues.get(websocket)
+            if messages and queue is not None:
+                subscription_filter = self.subscription_filters.get((websocket, device_uuid))
+                for message in messages:
+                    data = message.get("data")
+                    if subscription_filter is not None and isinstance(data, dict) and not subscription_filter.accept(data):
+                        continue
+                    queue.put_nowait(encode_frame(message, queue.encoding))
             self.device_connections[device_uuid].add(websocket)
-            self.connection_to_device[websocket] = device_uuid
-            self.message_queues[websocket] = asyncio.Queue()
-    
+            self.connection_to_devices[websocket].add(device_uuid)
+            return messages
+
+    async def unsubscribe(self, websocket: WebSocketServerProtocol, device_uuid: str):
+        """Stop sending the messages of a device to a connection"""
+        async with self._lock:
+            self.device_connections[device_uuid].discard(websocket)
+            if websocket in self.connection_to_devices:
+                self.connection_to_devices[websocket].discard(device_uuid)
+            self._forget_filter(websocket, device_uuid)
+
     async def remove_connection(self, websocket: WebSocketServerProtocol):
         """Remove a WebSocket connection"""
         async with self._lock:
-            if websocket in self.connection_to_device:
-                device_uuid = self.connection_to_device[websocket]
-                self.device_connections[device_uuid].discard(websocket)
-                del self.connection_to_device[websocket]
-                if websocket in self.message_queues:
-                    del self.message_queues[websocket]
+            if websocket in self.connection_to_devices:
+                for device_uuid in self.connection_to_devices[websocket]:
+                    self.device_connections[device_uuid].discard(websocket)
+                    self._forget_filter(websocket, device_uuid)
+                del self.connection_to_devices[websocket]
+                queue = self.message_queues.pop(websocket, None)
+                if queue is not None:
+                    self.dropped_messages += queue.dropped
+                    self.coalesced_messages += queue.coalesced
 
     async def cleanup_all_connections(self):
-        for websocket in self.connection_to_device.keys():
+        for websocket in list(self.connection_to_devices.keys()):
             await self.remove_connection(websocket)
-    
+
     async def broadcast_to_device_connections(self, device_uuid: str, message: Dict):
-        """Broadcast a message to all connections for a specific device"""
-        if device_uuid not in self.device_connections:
+        """Broadcast a message to all connections for a specific device, encoding it only once per encoding"""
+        connections = self.device_connections.get(device_uuid)
+        if not connections:
             return
-        
-        connections_copy = self.device_connections[device_uuid].copy()
-        for connection in connections_copy:
-            if connection in self.message_queues:
-                queue = self.message_queues[connection]
-                try:
-                    await queue.put(json.dumps(message))
-                except Exception as e:
-                    print(f"Error queuing message for connection: {e}")
-                    await self.remove_connection(connection)
+
+        frames = {}
+        sizes = {}
+        data = message.get("data")
+        key = (device_uuid, data.get("ID")) if isinstance(data, dict) else None
+        now = time.monotonic()
+        queued = 0
+        queued_size = 0
+        for connection in tuple(connections):
+            queue = self.message_queues.get(connection)
+            if queue is None:
+                continue
+            subscription_filter = self.subscription_filters.get((connection, device_uuid)) if self.subscription_filters else None
+            if subscription_filter is not None and isinstance(data, dict) and not subscription_filter.accept(data, now, message):
+                self._schedule_trailing(connection, device_uuid, subscription_filter)
+                continue
+            frame = frames.get(queue.encoding)
+            if frame is None:
+                with ENCODE_SECONDS.time(encoding=queue.encoding):
+                    frame = frames[queue.encoding] = encode_frame(message, queue.encoding)
+                sizes[queue.encoding] = frame_size(frame)
+            if not queue.put_nowait(frame, key):
+                await self._disconnect_slow_client(connection)
+                continue
+            queued += 1
+            queued_size += sizes[queue.encoding]
+        if queued:
+            DEVICE_MESSAGES.inc(queued, device=device_uuid)
+            DEVICE_QUEUED_BYTES.inc(queued_size, device=device_uuid)
+
+    def _schedule_trailing(self, websocket: WebSocketServerProtocol, device_uuid: str,
+                           subscription_filter: SubscriptionFilter):
+        """Send the updates a filter holds back once their interval expires, one timer per subscription"""
+        due = subscription_filter.next_due()
+        if due is None or (websocket, device_uuid) in self._trailing_timers:
+            return
+        self._trailing_timers[(websocket, device_uuid)] = asyncio.get_running_loop().call_later(
+            max(0.0, due - time.monotonic()), self._send_trailing, websocket, device_uuid
+        )
+
+    def _send_trailing(self, websocket: WebSocketServerProtocol, device_uuid: str):
+        """Queue the held updates of a subscription that are due"""
+        self._trailing_timers.pop((websocket, device_uuid), None)
+        subscription_filter = self.subscription_filters.get((websocket, device_uuid))
+        queue = self.message_queues.get(websocket)
+        if subscription_filter is None or queue is None:
+            return
+        for message in subscription_filter.due():
+            if not queue.put_nowait(encode_frame(message, queue.encoding), (device_uuid, message["data"].get("ID"))):
+                asyncio.create_task(self._disconnect_slow_client(websocket))
+                return
+        self._schedule_trailing(websocket, device_uuid, subscription_filter)
+
+    async def _disconnect_slow_client(self, websocket: WebSocketServerProtocol):
+        """Close a connection whose queue overflowed under the disconnect policy"""
+        print(f"Closing slow WebSocket client, {self.max_queue_size} frames queued")
+        self.slow_client_disconnects += 1
+        await self.remove_connection(websocket)
+        asyncio.create_task(websocket.close(code=1013, reason="Client too slow"))
 
     def get_connection_count(self, device_uuid: str) -> int:
         """Get the number of active connections for a device"""
         return len(self.device_connections[device_uuid])
-    
-    def get_message_queue(self, websocket: WebSocketServerProtocol) -> asyncio.Queue:
+
+    def get_subscriptions(self, websocket: WebSocketServerProtocol) -> Set[str]:
+        """Get the devices a connection is subscribed to"""
+        return set(self.connection_to_devices.get(websocket, ()))
+
+    def set_latest_mode(self, websocket: WebSocketServerProtocol, interval: Optional[float]):
+        """Switch a connection to latest-value batches every interval (s), or back to every message with None"""
+        queue = self.message_queues.get(websocket)
+        if queue is not None:
+            queue.set_latest_mode(interval)
+
+    def set_filter(self, websocket: WebSocketServerProtocol, device_uuid: str,
+                   subscription_filter: Optional[SubscriptionFilter]):
+        """Filter the updates of a device sent to a connection, None sends every update"""
+        self._forget_filter(websocket, device_uuid)
+        if subscription_filter is not None:
+            self.subscription_filters[(websocket, device_uuid)] = subscription_filter
+
+    def get_filter(self, websocket: WebSocketServerProtocol, device_uuid: str) -> Optional[SubscriptionFilter]:
+        return self.subscription_filters.get((websocket, device_uuid))
+
+    def _forget_filter(self, websocket: WebSocketServerProtocol, device_uuid: str):
+        timer = self._trailing_timers.pop((websocket, device_uuid), None)
+        if timer is not None:
+            timer.cancel()
+        subscription_filter = self.subscription_filters.pop((websocket, device_uuid), None)
+        if subscription_filter is not None:
+            self.filtered_updates += subscription_filter.filtered
+
+    def set_batching(self, websocket: WebSocketServerProtocol, max_frames: int):
+        """Send up to max_frames queued frames as one batch frame, 1 sends every frame on its own"""
+        queue = self.message_queues.get(websocket)
+        if queue is not None:
+            queue.max_batch = max(1, max_frames)
+
+    def get_queue_stats(self) -> Dict[str, int]:
+        """Return outbound queue depth and drop counters, including those of closed connections"""
+        queues = list(self.message_queues.values())
+        return {
+            "connections": len(queues),
+            "queued_frames": sum(queue.qsize() for queue in queues),
+            "max_queue_depth": max((queue.max_depth for queue in queues), default=0),
+            "dropped_frames": self.dropped_messages + sum(queue.dropped for queue in queues),
+            "coalesced_frames": self.coalesced_messages + sum(queue.coalesced for queue in queues),
+            "slow_client_disconnects": self.slow_client_disconnects,
+            "filtered_updates": self.filtered_updates + sum(
+                subscription_filter.filtered for subscription_filter in self.subscription_filters.values()
+            ),
+        }
+
+    def get_message_queue(self, websocket: WebSocketServerProtocol) -> OutboundQueue:
         """Get the message queue for a connection"""
-        return self.message_queues.get(websocket)
\ No newline at end of file
+        return self.message_queues.get(websocket)
@@ -0,0 +1,116 @@
+import json
+import sys
+from array import array
+from typing import Any, List, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+MSGPACK_F32 = "msgpack-f32"
+ENCODINGS = (JSON, MSGPACK, MSGPACK_F32)
+SUBPROTOCOLS = {f"ofa.{encoding}": encoding for encoding in ENCODINGS}
+
+PACKED_FLOAT64 = 1
+PACKED_FLOAT32 = 2
+MIN_PACKED_LENGTH = 8
+
+
+def encode_frame(message: Any, encoding: str = JSON) -> Union[str, bytes]:
+    """
+    Encode a message into a frame: JSON text (with orjson when it is installed) or MessagePack binary.
+    In MessagePack, lists of floats are packed as little-endian float64 (msgpack) or float32 (msgpack-f32)
+    arrays in ext types 1 and 2. Strings and lists holding integers are sent as they are, so every encoding
+    decodes to the same types.
+    """
+    if encoding == JSON:
+        if orjson is not None:
+            return orjson.dumps(message, default=str).decode("utf-8")
+        return json.dumps(message, default=str)
+    return msgpack.packb(_pack_arrays(message, encoding == MSGPACK_F32), default=str, use_bin_type=True)
+
+
+def encode_batch(frames: List[Union[str, bytes]], encoding: str = JSON) -> Union[str, bytes]:
+    """Join already encoded frames into one batch frame without decoding them"""
+    if encoding == JSON:
+        return f'{{"event": "batch", "count": {len(frames)}, "messages": [{", ".join(frames)}]}}'
+    return b"".join([
+        b"\x83",
+        msgpack.packb("event"), msgpack.packb("batch"),
+        msgpack.packb("count"), msgpack.packb(len(frames)),
+        msgpack.packb("messages"), msgpack.Packer().pack_array_header(len(frames)),
+        *frames
+    ])
+
+
+def frame_size(frame: Union[str, bytes]) -> int:
+    """Size (bytes) of a frame on the wire, text frames are sent UTF-8 encoded"""
+    if isinstance(frame, bytes) or frame.isascii():
+        return len(frame)
+    return len(frame.encode("utf-8"))
+
+
+def decode_frame(raw: Union[str, bytes]) -> Any:
+    """Decode a client frame, text frames are JSON and binary frames MessagePack"""
+    if isinstance(raw, str):
+        return json.loads(raw)
+    if msgpack is None:
+        raise ValueError("Binary frames require msgpack")
+    return msgpack.unpackb(raw, raw=False, ext_hook=_unpack_ext)
+
+
+def negotiate_encoding(subprotocol: Optional[str], query: dict) -> str:
+    """Pick the encoding of a connection from its websocket subprotocol, else its encoding query parameter"""
+    encoding = SUBPROTOCOLS.get(subprotocol) or query.get("encoding", [JSON])[0]
+    if encoding not in ENCODINGS:
+        return JSON
+    if encoding != JSON and msgpack is None:
+        print(f"Encoding {encoding} requested but msgpack is not installed, using json")
+        return JSON
+    return encoding
+
+
+def select_subprotocol(connection, subprotocols: List[str]) -> Optional[str]:
+    """
+    websockets select_subprotocol hook: accept the first ofa.* subprotocol offered, and clients offering
+    none, which then negotiate with the encoding query parameter or default to JSON
+    """
+    for subprotocol in subprotocols:
+        if subprotocol in SUBPROTOCOLS:
+            return subprotocol
+    return None
+
+
+def _pack_arrays(value: Any, float32: bool) -> Any:
+    if isinstance(value, dict):
+        return {k: _pack_arrays(v, float32) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) >= MIN_PACKED_LENGTH and all(isinstance(v, float) for v in value):
+            return _packed(value, float32)
+        return [_pack_arrays(v, float32) for v in value]
+    return value
+
+
+def _packed(values, float32: bool):
+    packed = array("f" if float32 else "d", values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return msgpack.ExtType(PACKED_FLOAT32 if float32 else PACKED_FLOAT64, packed.tobytes())
+
+
+def _unpack_ext(code: int, data: bytes):
+    if code not in (PACKED_FLOAT64, PACKED_FLOAT32):
+        return msgpack.ExtType(code, data)
+    values = array("f" if code == PACKED_FLOAT32 else "d")
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tolist()
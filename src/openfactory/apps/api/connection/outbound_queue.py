@@ -0,0 +1,135 @@
+import asyncio
+from collections import deque
+from typing import Any, Dict, Hashable, List, Optional
+
+from connection.frames import encode_batch, JSON
+
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+
+class OutboundQueue:
+    """
+    Bounded queue of frames waiting to be sent to one client.
+    When the queue is full, the policy decides what gives: the oldest frame is dropped (drop_oldest),
+    a pending frame of the same dataitem is replaced by the new one (coalesce, falling back to drop_oldest),
+    or the queue reports the overflow so the connection is closed (disconnect). Below maxsize no frame is lost.
+    In latest-value mode, keyed frames are kept in a dirty map holding the latest frame per dataitem
+    and sent together as one batch frame at most once per interval.
+    """
+
+    def __init__(self, maxsize: int = 1000, policy: str = DROP_OLDEST, encoding: str = JSON):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown outbound queue policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.encoding = encoding
+        self.max_batch = 1
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.overflowed = False
+        self._entries = deque()
+        self._pending_keys: Dict[Hashable, list] = {}
+        self._not_empty = asyncio.Event()
+        self.latest_interval: Optional[float] = None
+        self._dirty: Dict[Hashable, Any] = {}
+        self._next_flush = 0.0
+
+    def set_latest_mode(self, interval: Optional[float]):
+        """Send only the latest frame per dataitem, batched every interval (s), or every frame when None"""
+        self.latest_interval = interval
+        if interval is None and self._dirty:
+            for frame in self._dirty.values():
+                self._entries.append([None, frame])
+            self._dirty.clear()
+            self._not_empty.set()
+
+    def put_nowait(self, frame: Any, key: Optional[Hashable] = None) -> bool:
+        """Queue a frame, returns False when the client is too slow and must be disconnected"""
+        if self.overflowed:
+            return False
+
+        if self.latest_interval is not None and key is not None:
+            if key in self._dirty:
+                self.coalesced += 1
+            elif len(self._dirty) >= self.maxsize:
+                self.dropped += 1
+                return True
+            self._dirty[key] = frame
+            self._not_empty.set()
+            return True
+
+        if len(self._entries) >= self.maxsize:
+            if self.policy == COALESCE and key is not None:
+                entry = self._pending_keys.get(key)
+                if entry is not None:
+                    entry[1] = frame
+                    self.coalesced += 1
+                    return True
+            if self.policy == DISCONNECT:
+                self.overflowed = True
+                self.dropped += 1
+                return False
+            self._drop_oldest()
+
+        entry = [key, frame]
+        self._entries.append(entry)
+        if self.policy == COALESCE and key is not None:
+            self._pending_keys[key] = entry
+        self.max_depth = max(self.max_depth, len(self._entries))
+        self._not_empty.set()
+        return True
+
+    async def get(self) -> Any:
+        """Wait for and return the oldest queued frame, or the batch of latest values once it is due"""
+        while True:
+            if self._entries:
+                return self.get_nowait()
+            if self._dirty:
+                delay = self._next_flush - asyncio.get_running_loop().time()
+                if delay <= 0:
+                    return self._flush_dirty()
+                await asyncio.sleep(delay)
+                continue
+            self._not_empty.clear()
+            await self._not_empty.wait()
+
+    async def get_many(self) -> List[Any]:
+        """Wait for the next frame, then take the frames already queued behind it, up to max_batch"""
+        frames = [await self.get()]
+        while len(frames) < self.max_batch and self._entries:
+            frames.append(self.get_nowait())
+        return frames
+
+    def get_nowait(self) -> Any:
+        """Return the oldest queued frame, raises asyncio.QueueEmpty when there is none"""
+        if not self._entries:
+            raise asyncio.QueueEmpty()
+        key, frame = self._entries.popleft()
+        self._forget(key)
+        return frame
+
+    def qsize(self) -> int:
+        return len(self._entries) + len(self._dirty)
+
+    def empty(self) -> bool:
+        return not self._entries and not self._dirty
+
+    def _flush_dirty(self) -> Any:
+        """Join the pre-encoded latest frames into one batch frame without decoding them"""
+        frames = list(self._dirty.values())
+        self._dirty.clear()
+        self._next_flush = asyncio.get_running_loop().time() + self.latest_interval
+        return encode_batch(frames, self.encoding)
+
+    def _drop_oldest(self):
+        key, _ = self._entries.popleft()
+        self._forget(key)
+        self.dropped += 1
+
+    def _forget(self, key: Optional[Hashable]):
+        if key is not None:
+            self._pending_keys.pop(key, None)
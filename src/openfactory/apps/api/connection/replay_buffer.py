@@ -0,0 +1,58 @@
+import uuid
+from collections import deque
+from itertools import islice
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+class ReplayBuffer:
+    """
+    Per-device sequence numbers and ring buffer of the latest device messages.
+    Sequence numbers restart with the process, so they are only comparable within one epoch. A client
+    reconnecting with the epoch and last sequence number it received gets the missed messages replayed,
+    provided they are all still buffered.
+    In worker mode every worker has its own buffer and epoch: a client only resumes when it reconnects to
+    the worker that served it, e.g. on the direct port a device connection is redirected to. Reconnecting
+    through the shared port usually lands on another worker and falls back to a snapshot.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        """
+        Args:
+            capacity: Number of messages kept per device
+        """
+        self.capacity = capacity
+        self.epoch = uuid.uuid4().hex[:12]
+        self._buffers: Dict[str, Deque[Tuple[int, Dict[str, Any]]]] = {}
+        self._last_seq: Dict[str, int] = {}
+
+    def stamp(self, device_uuid: str, message: Dict[str, Any]) -> int:
+        """Give a message the next sequence number of its device and buffer it"""
+        seq = self._last_seq.get(device_uuid, 0) + 1
+        self._last_seq[device_uuid] = seq
+        message["seq"] = seq
+        buffer = self._buffers.get(device_uuid)
+        if buffer is None:
+            buffer = self._buffers[device_uuid] = deque(maxlen=self.capacity)
+        buffer.append((seq, message))
+        return seq
+
+    def last_seq(self, device_uuid: str) -> int:
+        return self._last_seq.get(device_uuid, 0)
+
+    def replay(self, device_uuid: str, last_seq: int, epoch: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+        """Return the messages following last_seq, None when the client must resync from a snapshot"""
+        if epoch != self.epoch:
+            return None
+        current = self._last_seq.get(device_uuid, 0)
+        if last_seq > current:
+            return None
+        if last_seq == current:
+            return []
+        buffer = self._buffers.get(device_uuid)
+        if not buffer or buffer[0][0] > last_seq + 1:
+            return None
+        return [message for _, message in islice(buffer, last_seq + 1 - buffer[0][0], None)]
+
+    def forget(self, device_uuid: str):
+        """Drop the buffered messages of a device, its sequence keeps counting"""
+        self._buffers.pop(device_uuid, None)
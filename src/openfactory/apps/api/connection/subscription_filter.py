@@ -0,0 +1,152 @@
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+Threshold = Union[float, Dict[str, float]]
+
+
+class SubscriptionFilter:
+    """
+    Per-subscription selection of the device updates worth sending to a client.
+    An update passes when its dataitem is selected, at least min_interval has elapsed since the last update of
+    that dataitem sent, a numeric value moved by at least the deadband, and, with change_only, the value differs
+    from the last one sent. Intervals and deadbands are either one value for every dataitem or a value per ID.
+    With trailing, the latest update held back by min_interval is kept and sent once the interval expires
+    (see due), so a dataitem that stops changing still ends on its latest value.
+    """
+
+    def __init__(self, dataitems: Optional[Iterable[str]] = None, min_interval: Threshold = 0.0,
+                 deadband: Threshold = 0.0, change_only: bool = False, trailing: bool = True):
+        """
+        Args:
+            dataitems: IDs of the dataitems sent, every dataitem when None
+            min_interval: Minimum time (s) between two updates of a dataitem
+            deadband: Minimum change of a numeric value for an update to be sent
+            change_only: Only send an update when its value differs from the last one sent
+            trailing: Send the latest update held back by min_interval when the interval expires
+        """
+        self.dataitems = set(dataitems) if dataitems else None
+        self.min_interval = min_interval
+        self.deadband = deadband
+        self.change_only = change_only
+        self.trailing = trailing
+        self.passed = 0
+        self.filtered = 0
+        self._last_sent: Dict[str, Tuple[float, Any]] = {}
+        self._held: Dict[str, Any] = {}
+
+    @classmethod
+    def from_params(cls, params: Optional[Dict[str, Any]]) -> Optional['SubscriptionFilter']:
+        """
+        Build a filter from subscribe parameters or a query string, None when they select everything
+        {"dataitems": ["a", "b"] or "a,b", "min_interval_ms": 1000 or {"a": 1000} or "a:1000,b:200",
+         "deadband": 0.5 or {"a": 0.5} or "a:0.5", "change_only": true, "trailing": true}
+        """
+        if not params:
+            return None
+        dataitems = params.get("dataitems")
+        if isinstance(dataitems, str):
+            dataitems = [dataitem for dataitem in dataitems.split(",") if dataitem]
+        min_interval = _parse_threshold(params.get("min_interval_ms"), 0.001)
+        deadband = _parse_threshold(params.get("deadband"), 1.0)
+        change_only = str(params.get("change_only", False)).lower() in ("1", "true", "yes")
+        trailing = str(params.get("trailing", True)).lower() in ("1", "true", "yes")
+        if not dataitems and not min_interval and not deadband and not change_only:
+            return None
+        return cls(dataitems, min_interval, deadband, change_only, trailing)
+
+    def accept(self, data: Dict[str, Any], now: Optional[float] = None, message: Any = None) -> bool:
+        """
+        Return whether an update is sent, recording it as the last one sent when it is.
+        With trailing, a message held back by min_interval replaces the one held for its dataitem.
+        """
+        dataitem_id = data.get("ID")
+        if self.dataitems is not None and dataitem_id not in self.dataitems:
+            self.filtered += 1
+            return False
+
+        now = time.monotonic() if now is None else now
+        value = data.get("VALUE")
+        last = self._last_sent.get(dataitem_id)
+        if last is not None:
+            if now - last[0] < _threshold(self.min_interval, dataitem_id):
+                if self.trailing and message is not None:
+                    self._held[dataitem_id] = message
+                self.filtered += 1
+                return False
+            if not self._changed(dataitem_id, value, last[1]):
+                self._held.pop(dataitem_id, None)
+                self.filtered += 1
+                return False
+
+        self._held.pop(dataitem_id, None)
+        self._last_sent[dataitem_id] = (now, value)
+        self.passed += 1
+        return True
+
+    def next_due(self) -> Optional[float]:
+        """Monotonic time at which the first held message is due, None when none is held"""
+        if not self._held:
+            return None
+        return min(
+            self._last_sent[dataitem_id][0] + _threshold(self.min_interval, dataitem_id)
+            for dataitem_id in self._held
+        )
+
+    def due(self, now: Optional[float] = None) -> List[Any]:
+        """Take the held messages whose interval expired and still pass the value filters, recording them as sent"""
+        now = time.monotonic() if now is None else now
+        messages = []
+        for dataitem_id, message in list(self._held.items()):
+            last_time, last_value = self._last_sent[dataitem_id]
+            if now - last_time < _threshold(self.min_interval, dataitem_id):
+                continue
+            del self._held[dataitem_id]
+            value = message.get("data", {}).get("VALUE") if isinstance(message, dict) else None
+            if not self._changed(dataitem_id, value, last_value):
+                continue
+            self._last_sent[dataitem_id] = (now, value)
+            self.filtered -= 1
+            self.passed += 1
+            messages.append(message)
+        return messages
+
+    def _changed(self, dataitem_id: str, value: Any, last_value: Any) -> bool:
+        """Whether a value passes change_only and the deadband against the last value sent"""
+        if self.change_only and value == last_value:
+            return False
+        deadband = _threshold(self.deadband, dataitem_id)
+        return not (deadband and _within_deadband(value, last_value, deadband))
+
+    def select(self, dataitems: Dict[str, Any]) -> Dict[str, Any]:
+        """Keep the selected dataitems of a snapshot"""
+        if self.dataitems is None:
+            return dataitems
+        return {dataitem_id: value for dataitem_id, value in dataitems.items() if dataitem_id in self.dataitems}
+
+
+def _parse_threshold(value: Any, scale: float) -> Threshold:
+    """Parse a threshold given as a number, a {id: number} dict or an "id:number,..." string"""
+    if value is None or value == "":
+        return 0.0
+    if isinstance(value, dict):
+        return {dataitem_id: float(threshold) * scale for dataitem_id, threshold in value.items()}
+    if isinstance(value, str) and ":" in value:
+        thresholds = {}
+        for pair in value.split(","):
+            dataitem_id, _, threshold = pair.partition(":")
+            thresholds[dataitem_id] = float(threshold) * scale
+        return thresholds
+    return float(value) * scale
+
+
+def _threshold(threshold: Threshold, dataitem_id: str) -> float:
+    if isinstance(threshold, dict):
+        return threshold.get(dataitem_id, 0.0)
+    return threshold
+
+
+def _within_deadband(value: Any, last_value: Any, deadband: float) -> bool:
+    try:
+        return abs(float(value) - float(last_value)) < deadband
+    except (TypeError, ValueError):
+        return False
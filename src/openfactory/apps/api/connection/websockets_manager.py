@@ -1,45 +1,102 @@
 import asyncio
-import json
 import time
-from queue import Queue
+from collections import deque
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
 from models import ClientMessage
 from websockets.exceptions import ConnectionClosed
 from websockets.server import WebSocketServerProtocol
 
-from exceptions import DeviceNotFoundException, StreamCreationException
+from exceptions import DeviceNotFoundException, StreamCreationException, HistoryQueryException
 from connection.connection_manager import ConnectionManager
+from connection.frames import decode_frame, encode_batch, encode_frame, frame_size, negotiate_encoding, JSON
+from connection.outbound_queue import POLICIES
+from connection.replay_buffer import ReplayBuffer
+from connection.subscription_filter import SubscriptionFilter
+from connection.worker_router import WorkerRouter, REDIRECT, REDIRECT_CLOSE_CODE
+from metrics import REGISTRY
 from services.device_service import DeviceService
+from services.history_service import HistoryService
+from services.snapshot_cache import DeviceSnapshotCache
+from services.enrichment_cache import EnrichmentCache
 from services.stream_service import StreamService
 
+DEFAULT_LATEST_INTERVAL_MS = 100
+MIN_LATEST_INTERVAL_MS = 10
+
+BROADCAST_SECONDS = REGISTRY.histogram(
+    "ofa_api_broadcast_seconds", "Time spent fanning a device message out to its connections"
+)
+SENT_BYTES = REGISTRY.counter(
+    "ofa_api_sent_bytes_total", "Bytes of the frames sent to clients, before websocket compression", ("encoding",)
+)
+
 
 class WebsocketsManager:
     def __init__(self, connection_manager: ConnectionManager, device_service: DeviceService, 
-                 stream_service: StreamService, topic_subscriber, openfactory_app):
+                 stream_service: StreamService, topic_subscriber, openfactory_app,
+                 history_service: Optional[HistoryService] = None,
+                 enrichment_cache: Optional[EnrichmentCache] = None,
+                 worker_router: Optional[WorkerRouter] = None,
+                 max_batch_frames: int = 100,
+                 replay_buffer_size: int = 1000):
         self.connection_manager = connection_manager
         self.device_service = device_service
         self.stream_service = stream_service
+        self.history_service = history_service
+        self.enrichment_cache = enrichment_cache or EnrichmentCache(device_service)
+        self.snapshot_cache = DeviceSnapshotCache(device_service, self.enrichment_cache)
         self.topic_subscriber = topic_subscriber
         self.openfactory_app = openfactory_app
+        self.worker_router = worker_router
+        self.max_batch_frames = max_batch_frames
+        self.replay_buffer = ReplayBuffer(replay_buffer_size)
         self.device_assets = {}
         self.device_topics = {}
+        self.encodings: Dict[WebSocketServerProtocol, str] = {}
         
-        self.message_queue = Queue()
+        self.pending_messages = deque()
+        self.max_messages_per_wakeup = 1000
         self.running = True
         
         self.asyncio_loop = None
+        self._messages_ready = None
+        self._wakeup_scheduled = False
         
         self.message_processor_task = None
+        REGISTRY.gauge(
+            "ofa_api_kafka_bridge_pending", "Kafka messages waiting to be handed to the event loop",
+            function=lambda: len(self.pending_messages)
+        )
     
     def set_asyncio_loop(self, loop):
         """Set the asyncio loop reference"""
         self.asyncio_loop = loop
         if not self.message_processor_task:
+            self._messages_ready = asyncio.Event()
+            if self.pending_messages:
+                self._messages_ready.set()
             self.message_processor_task = asyncio.create_task(self._process_stream_messages())
+            self.enrichment_cache.start(self.topic_subscriber)
+            asyncio.create_task(self.enrichment_cache.seed())
     
+    def _is_monitored(self, msg_key: str) -> bool:
+        """Message filter of the device topics, also routes the shared stream by key"""
+        return msg_key in self.device_assets
+
+    def _update_topic_keys(self, topic: str):
+        """Only fetch the partitions of a device topic holding the monitored devices"""
+        self.topic_subscriber.set_topic_keys(
+            topic, [device_uuid for device_uuid, device_topic in self.device_topics.items() if device_topic == topic]
+        )
+
     def _on_message(self, msg_key: str, msg_value: dict):
-        """Handle messages from dedicated Kafka topic"""
+        """Handle messages from the Kafka consumer thread, waking the event loop once per batch"""
         try:
-            self.message_queue.put((msg_key, msg_value))
+            self.pending_messages.append((msg_key, msg_value))
+            if not self._wakeup_scheduled and self._messages_ready is not None:
+                self._wakeup_scheduled = True
+                self.asyncio_loop.call_soon_threadsafe(self._messages_ready.set)
             
         except Exception as e:
             print(f"Error queuing Kafka message for {msg_key}: {e}")
@@ -49,44 +106,58 @@ class WebsocketsManager:
         if not self.asyncio_loop:
             self.set_asyncio_loop(asyncio.get_running_loop())
         
-        path = websocket.request.path
-        
+        url = urlsplit(websocket.request.path)
+        query = parse_qs(url.query)
+        self.encodings[websocket] = negotiate_encoding(websocket.subprotocol, query)
+        try:
+            await self._route_connection(websocket, url.path, query)
+        finally:
+            self.encodings.pop(websocket, None)
+
+    async def _route_connection(self, websocket: WebSocketServerProtocol, path: str, query: dict):
+        """Dispatch a connection to the handler of its endpoint"""
         if path == "/ws/devices":
             await self._send_devices_list(websocket) ##this is for dashboard app only
             return
+
+        if path == "/ws/stream":
+            assets = query.get("assets", [""])[0]
+            await self._handle_stream_connection(websocket, [asset for asset in assets.split(",") if asset], query)
+            return
+
+        if path == "/ws/history":
+            await self._handle_history_connection(websocket)
+            return
         
         if not path.startswith("/ws/devices/"):
             await self._send_error(websocket, "Invalid endpoint")
             return
         
         device_uuid = path.split("/")[3]
-        await self._handle_device_connection(websocket, device_uuid)
+        await self._handle_device_connection(websocket, device_uuid, query)
     
-    async def _handle_device_connection(self, websocket: WebSocketServerProtocol, device_uuid: str):
+    async def _handle_device_connection(self, websocket: WebSocketServerProtocol, device_uuid: str, query: dict):
         """Handle connection to a specific device"""
+        if self.worker_router and self.worker_router.routing == REDIRECT and not self.worker_router.owns(device_uuid):
+            await self._redirect(websocket, device_uuid)
+            return
+
+        if not await self._validate_query(websocket, query, [device_uuid]):
+            return
+
         try:
-            await self.connection_manager.add_connection(websocket, device_uuid)
+            await self.connection_manager.register_connection(
+                websocket, encoding=self.encodings[websocket], policy=query.get("policy", [None])[0]
+            )
+            self._set_mode(websocket, query.get("mode", ["all"])[0], query.get("interval_ms", [None])[0])
+            self._set_batching(websocket, query.get("batch", ["false"])[0])
+            self._set_filter(websocket, [device_uuid], self._filter_params(query))
+            resume_points = self._resume_points(query.get("last_seq", [None])[0], [device_uuid])
             await self._initialize_device(device_uuid)
-            await self._send_initial_data(websocket, device_uuid)
-            
-            sender_task = asyncio.create_task(self._handle_outgoing_messages(websocket))
-            receiver_task = asyncio.create_task(self._handle_incoming_messages(websocket, device_uuid))
-            
-            done, pending = await asyncio.wait(
-                [sender_task, receiver_task], 
-                return_when=asyncio.FIRST_COMPLETED
+            await self._start_subscription(
+                websocket, device_uuid, resume_points.get(device_uuid), query.get("epoch", [None])[0]
             )
-            
-            for task in pending:
-                task.cancel()
-                try:
-                    await task
-                except asyncio.CancelledError:
-                    pass
-            
-            for task in done:
-                if task.exception():
-                    print(f"Task completed with exception: {task.exception()}")
+            await self._run_connection(websocket, device_uuid)
             
         except Exception as e:
             print(f"Error in device connection handler for {device_uuid}: {e}")
@@ -94,6 +165,202 @@ class WebsocketsManager:
             await self.connection_manager.remove_connection(websocket)
             print(f"WebSocket connection closed for device: {device_uuid}")
 
+    async def _redirect(self, websocket: WebSocketServerProtocol, device_uuid: str):
+        """Send the client the direct URL of the worker owning the device, then close the connection"""
+        owner = self.worker_router.owner(device_uuid)
+        response = {
+            "event": "redirect",
+            "device_uuid": device_uuid,
+            "worker": owner,
+            "url": self.worker_router.worker_url(owner, websocket.request.headers.get("Host", ""), websocket.request.path),
+            "timestamp": time.time()
+        }
+        try:
+            await self._send(websocket, response)
+            await websocket.close(code=REDIRECT_CLOSE_CODE, reason="redirect")
+        except ConnectionClosed:
+            pass
+
+    async def _handle_stream_connection(self, websocket: WebSocketServerProtocol, assets: List[str], query: dict):
+        """Handle a single connection multiplexing the messages of several devices"""
+        if not await self._validate_query(websocket, query, assets):
+            return
+
+        try:
+            await self.connection_manager.register_connection(
+                websocket, endpoint="stream", encoding=self.encodings[websocket], policy=query.get("policy", [None])[0]
+            )
+            self._set_mode(websocket, query.get("mode", ["all"])[0], query.get("interval_ms", [None])[0])
+            self._set_batching(websocket, query.get("batch", ["false"])[0])
+            await self._subscribe_assets(
+                websocket, assets, self._filter_params(query),
+                query.get("last_seq", [None])[0], query.get("epoch", [None])[0]
+            )
+            await self._run_connection(websocket, None)
+
+        except Exception as e:
+            print(f"Error in stream connection handler: {e}")
+        finally:
+            await self.connection_manager.remove_connection(websocket)
+            print("WebSocket stream connection closed")
+
+    async def _handle_history_connection(self, websocket: WebSocketServerProtocol):
+        """Handle a connection only used for history queries, answered one at a time"""
+        try:
+            async for raw_message in websocket:
+                try:
+                    client_message = ClientMessage.from_dict(decode_frame(raw_message))
+                except (ValueError, AttributeError) as e:
+                    await self._send_error(websocket, f"Invalid message: {e}")
+                    continue
+                if client_message.method != "query_history":
+                    await self._send_error(websocket, f"Unknown method: {client_message.method}")
+                    continue
+                await self._query_history(websocket, client_message.params)
+        except ConnectionClosed:
+            pass
+        except Exception as e:
+            print(f"Error in history connection handler: {e}")
+        finally:
+            print("WebSocket history connection closed")
+
+    async def _run_connection(self, websocket: WebSocketServerProtocol, device_uuid: Optional[str]):
+        """Run sender and receiver tasks until one of them completes"""
+        sender_task = asyncio.create_task(self._handle_outgoing_messages(websocket))
+        receiver_task = asyncio.create_task(self._handle_incoming_messages(websocket, device_uuid))
+        
+        done, pending = await asyncio.wait(
+            [sender_task, receiver_task], 
+            return_when=asyncio.FIRST_COMPLETED
+        )
+        
+        for task in pending:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        
+        for task in done:
+            if task.exception():
+                print(f"Task completed with exception: {task.exception()}")
+
+    async def _validate_query(self, websocket: WebSocketServerProtocol, query: dict, assets: List[str]) -> bool:
+        """Check the options of a connection before it is registered, sending the client an error if one is invalid"""
+        try:
+            self._latest_interval(query.get("mode", ["all"])[0], query.get("interval_ms", [None])[0])
+            policy = query.get("policy", [None])[0]
+            if policy is not None and policy not in POLICIES:
+                raise ValueError(f"Unknown policy: {policy}")
+            SubscriptionFilter.from_params(self._filter_params(query))
+            self._resume_points(query.get("last_seq", [None])[0], assets)
+        except (TypeError, ValueError) as e:
+            print(f"Rejected connection with invalid parameters: {e}")
+            await self._send_error(websocket, f"Invalid connection parameters: {e}")
+            return False
+        return True
+
+    @staticmethod
+    def _latest_interval(mode: str, interval_ms=None) -> Optional[float]:
+        """Parse a mode into its latest-value batching interval (s), None for every message"""
+        if mode == "all":
+            return None
+        if mode != "latest":
+            raise ValueError(f"Unknown mode: {mode}")
+        try:
+            interval_ms = int(interval_ms or DEFAULT_LATEST_INTERVAL_MS)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid interval_ms: {interval_ms}")
+        return max(interval_ms, MIN_LATEST_INTERVAL_MS) / 1000
+
+    def _set_mode(self, websocket: WebSocketServerProtocol, mode: str, interval_ms=None):
+        """Switch a connection between every message ("all") and latest values batched every interval_ms ("latest")"""
+        self.connection_manager.set_latest_mode(websocket, self._latest_interval(mode, interval_ms))
+
+    def _set_batching(self, websocket: WebSocketServerProtocol, batch: str):
+        """Let a connection receive the frames queued while it was sending as one batch frame"""
+        enabled = str(batch).lower() in ("1", "true", "yes")
+        self.connection_manager.set_batching(websocket, self.max_batch_frames if enabled else 1)
+
+    def _set_filter(self, websocket: WebSocketServerProtocol, assets: List[str], filter_params: Optional[dict]):
+        """Filter the updates of devices sent to a connection, each device keeping its own filter state"""
+        for asset_uuid in assets:
+            self.connection_manager.set_filter(websocket, asset_uuid, SubscriptionFilter.from_params(filter_params))
+
+    @staticmethod
+    def _filter_params(query: dict) -> dict:
+        """Filter parameters given in the query string of a connection"""
+        return {key: values[0] for key, values in query.items() if values}
+
+    async def _subscribe_assets(self, websocket: WebSocketServerProtocol, assets: List[str],
+                                filter_params: Optional[dict] = None, last_seq=None, epoch: Optional[str] = None):
+        """Subscribe a connection to several devices, resuming those it gives a last sequence number for"""
+        resume_points = self._resume_points(last_seq, assets)
+        for asset_uuid in assets:
+            try:
+                await self._initialize_device(asset_uuid)
+                self._set_filter(websocket, [asset_uuid], filter_params)
+                await self._start_subscription(websocket, asset_uuid, resume_points.get(asset_uuid), epoch)
+            except Exception as e:
+                print(f"Failed to subscribe to device {asset_uuid}: {e}")
+                await self._send_error(websocket, f"Failed to subscribe to device {asset_uuid}: {e}")
+        await self._send_subscriptions(websocket)
+
+    async def _start_subscription(self, websocket: WebSocketServerProtocol, device_uuid: str,
+                                  last_seq: Optional[int] = None, epoch: Optional[str] = None):
+        """Subscribe a connection to a device, replaying the messages it missed if still buffered, else sending a snapshot"""
+        backlog = None
+        if last_seq is not None:
+            backlog = lambda: self._replay_backlog(device_uuid, last_seq, epoch)
+        if await self.connection_manager.subscribe(websocket, device_uuid, backlog) is None:
+            await self._send_initial_data(websocket, device_uuid)
+
+    def _replay_backlog(self, device_uuid: str, last_seq: int, epoch: Optional[str]) -> Optional[List[dict]]:
+        """The resumed event followed by the messages missed since last_seq, None when they are no longer buffered"""
+        replayed = self.replay_buffer.replay(device_uuid, last_seq, epoch)
+        if replayed is None:
+            print(f"Cannot resume device {device_uuid} from {epoch}/{last_seq}, sending a snapshot")
+            return None
+        resumed = {
+            "event": "resumed",
+            "device_uuid": device_uuid,
+            "epoch": self.replay_buffer.epoch,
+            "seq": self.replay_buffer.last_seq(device_uuid),
+            "replayed": len(replayed),
+            "timestamp": time.time()
+        }
+        return [resumed] + replayed
+
+    @staticmethod
+    def _resume_points(last_seq, assets: List[str]) -> Dict[str, int]:
+        """Parse the last sequence number received per device: {device: seq}, "device:seq,..." or one number"""
+        if last_seq is None or last_seq == "":
+            return {}
+        if isinstance(last_seq, dict):
+            return {device_uuid: int(seq) for device_uuid, seq in last_seq.items()}
+        if isinstance(last_seq, str) and ":" in last_seq:
+            points = {}
+            for pair in last_seq.split(","):
+                device_uuid, _, seq = pair.rpartition(":")
+                points[device_uuid] = int(seq)
+            return points
+        return {assets[0]: int(last_seq)} if len(assets) == 1 else {}
+
+    async def _unsubscribe_assets(self, websocket: WebSocketServerProtocol, assets: List[str]):
+        """Unsubscribe a connection from several devices"""
+        for asset_uuid in assets:
+            await self.connection_manager.unsubscribe(websocket, asset_uuid)
+        await self._send_subscriptions(websocket)
+
+    async def _send_subscriptions(self, websocket: WebSocketServerProtocol):
+        """Send the current subscriptions of a connection"""
+        response = {
+            "event": "subscriptions",
+            "assets": sorted(self.connection_manager.get_subscriptions(websocket)),
+            "timestamp": time.time()
+        }
+        await self._send(websocket, response)
+
     async def _initialize_device(self, device_uuid: str):
         """Initialize device monitoring if not already done"""
         if device_uuid in self.device_assets:
@@ -101,19 +368,23 @@ class WebsocketsManager:
             return
         
         try:
-            self.openfactory_app.initialize_asset(device_uuid)
+            await asyncio.get_running_loop().run_in_executor(None, self.openfactory_app.initialize_asset, device_uuid)
             
-            topic = self.stream_service.create_device_stream(device_uuid)
-            
-            self.topic_subscriber.subscribe_to_kafka_topic(
-                topic=topic,
-                kafka_group_id=f'api_device_stream_group_{device_uuid}',
-                on_message=self._on_message,
-                message_filter=lambda key: key == device_uuid
-            )
+            topic = await self.stream_service.create_device_stream(device_uuid)
             
+            new_topic = topic not in self.device_topics.values()
             self.device_topics[device_uuid] = topic
+            self._update_topic_keys(topic)
+            if new_topic:
+                self.topic_subscriber.subscribe_to_kafka_topic(
+                    topic=topic,
+                    kafka_group_id=self.topic_subscriber.group_id,
+                    on_message=self._on_message,
+                    message_filter=self._is_monitored
+                )
+            
             self.device_assets[device_uuid] = True
+            self.snapshot_cache.set_streamed(device_uuid)
             print(f"Successfully initialized monitoring for device {device_uuid}")
             
         except StreamCreationException as e:
@@ -126,15 +397,20 @@ class WebsocketsManager:
     async def _send_initial_data(self, websocket: WebSocketServerProtocol, device_uuid: str):
         """Send initial data to newly connected client"""
         try:
-            data_items = self.device_service.get_device_dataitems(device_uuid)
+            data_items = await self.snapshot_cache.get_dataitems(device_uuid)
+            subscription_filter = self.connection_manager.get_filter(websocket, device_uuid)
+            if subscription_filter is not None:
+                data_items = subscription_filter.select(data_items)
             initial_data = {
                 "event": "connection_established",
                 "device_uuid": device_uuid,
                 "timestamp": time.time(),
                 "data_items": data_items,
+                "epoch": self.replay_buffer.epoch,
+                "seq": self.replay_buffer.last_seq(device_uuid),
                 "connection_count": self.connection_manager.get_connection_count(device_uuid)
             }
-            await websocket.send(json.dumps(initial_data))
+            await self._send(websocket, initial_data)
             print(f"Sent initial data to client for device {device_uuid}")
             
         except DeviceNotFoundException as e:
@@ -154,15 +430,10 @@ class WebsocketsManager:
         try:
             while True:
                 try:
-                    message = await asyncio.wait_for(queue.get(), timeout=1.0)
-                    await websocket.send(message)
-                    
-                except asyncio.TimeoutError:
-                    ping_msg = {
-                        "event": "ping", 
-                        "timestamp": time.time()
-                    }
-                    await websocket.send(json.dumps(ping_msg))
+                    frames = await queue.get_many()
+                    frame = frames[0] if len(frames) == 1 else encode_batch(frames, queue.encoding)
+                    await websocket.send(frame)
+                    SENT_BYTES.inc(frame_size(frame), encoding=queue.encoding)
                     
                 except ConnectionClosed:
                     print("WebSocket connection closed in outgoing handler")
@@ -171,28 +442,25 @@ class WebsocketsManager:
         except Exception as e:
             print(f"Error in outgoing message handler: {e}")
     
-    async def _handle_incoming_messages(self, websocket: WebSocketServerProtocol, device_uuid: str):
+    async def _handle_incoming_messages(self, websocket: WebSocketServerProtocol, device_uuid: Optional[str]):
         """Handle incoming messages from client"""
         try:
             while True:
                 try:
-                    raw_message = await asyncio.wait_for(websocket.recv(), timeout=30.0)
+                    raw_message = await websocket.recv()
                     
                     try:
-                        message = json.loads(raw_message)
+                        message = decode_frame(raw_message)
                         client_message = ClientMessage.from_dict(message)
                         await self._process_client_message(websocket, device_uuid, client_message)
                         
-                    except json.JSONDecodeError as e:
-                        print(f"Invalid JSON received from {device_uuid}: {e}")
-                        await self._send_error(websocket, f"Invalid JSON: {e}")
+                    except ValueError as e:
+                        print(f"Invalid message received from {device_uuid}: {e}")
+                        await self._send_error(websocket, f"Invalid message: {e}")
                         
                     except Exception as e:
                         print(f"Error parsing client message from {device_uuid}: {e}")
                         await self._send_error(websocket, f"Message parsing error: {e}")
-                
-                except asyncio.TimeoutError:
-                    continue
                     
                 except ConnectionClosed:
                     print(f"WebSocket connection closed in incoming handler for {device_uuid}")
@@ -202,7 +470,7 @@ class WebsocketsManager:
             print(f"Error in incoming message handler for {device_uuid}: {e}")
     
     async def _process_client_message(self, websocket: WebSocketServerProtocol, 
-                                    device_uuid: str, message: ClientMessage):
+                                    device_uuid: Optional[str], message: ClientMessage):
         """Process client messages based on method"""
         try:
             print(f"Processing client message from {device_uuid}: {message.method}")
@@ -211,7 +479,41 @@ class WebsocketsManager:
                 await self._send_simulation_mode(websocket, message.params)
                 
             elif message.method == "drop_stream":
-                await self._drop_stream(websocket, device_uuid)
+                target_uuid = device_uuid or message.params.get("device_uuid")
+                if not target_uuid:
+                    await self._send_error(websocket, "Missing device_uuid for drop_stream")
+                    return
+                await self._drop_stream(websocket, target_uuid)
+
+            elif message.method == "subscribe":
+                await self._subscribe_assets(
+                    websocket, message.params.get("assets", []), message.params.get("filter"),
+                    message.params.get("last_seq"), message.params.get("epoch")
+                )
+
+            elif message.method == "unsubscribe":
+                await self._unsubscribe_assets(websocket, message.params.get("assets", []))
+
+            elif message.method == "set_mode":
+                self._set_mode(websocket, message.params.get("mode", "all"), message.params.get("interval_ms"))
+                await self._send(websocket, {
+                    "event": "mode_updated",
+                    "mode": message.params.get("mode", "all"),
+                    "timestamp": time.time()
+                })
+
+            elif message.method == "set_filter":
+                assets = message.params.get("assets") or ([device_uuid] if device_uuid else [])
+                self._set_filter(websocket, assets, message.params.get("filter"))
+                await self._send(websocket, {
+                    "event": "filter_updated",
+                    "assets": assets,
+                    "filter": message.params.get("filter"),
+                    "timestamp": time.time()
+                })
+
+            elif message.method == "query_history":
+                await self._query_history(websocket, message.params)
                 
             else:
                 print(f"Unknown method from {device_uuid}: {message.method}")
@@ -222,17 +524,23 @@ class WebsocketsManager:
             await self._send_error(websocket, f"Processing error: {e}")
 
     async def _process_stream_messages(self):
-        """Background task to process messages in async context (stream updates)"""
+        """Background task draining every pending stream update each time the Kafka thread wakes it up"""
         while self.running:
             try:
-                if not self.message_queue.empty():
+                await self._messages_ready.wait()
+                self._messages_ready.clear()
+                self._wakeup_scheduled = False
+
+                handled = 0
+                while self.pending_messages:
+                    msg_key, msg_value = self.pending_messages.popleft()
                     try:
-                        msg_key, msg_value = self.message_queue.get_nowait()
                         await self._handle_stream_message(msg_key, msg_value)
                     except Exception as e:
                         print(f"Error processing queued message: {e}")
-                
-                await asyncio.sleep(0.01)
+                    handled += 1
+                    if handled % self.max_messages_per_wakeup == 0:
+                        await asyncio.sleep(0)
                 
             except Exception as e:
                 print(f"Error in message processor: {e}")
@@ -242,23 +550,71 @@ class WebsocketsManager:
         """Parse and thread messages for device updates"""
         try:
             device_uuid = msg_key
+            self.snapshot_cache.update(device_uuid, msg_value)
             
             if device_uuid == 'IVAC':
-                self.device_service.add_duration_updates(msg_value)
+                msg_value['durations'] = self.enrichment_cache.get_durations(msg_value.get('ID', ''))
             elif device_uuid == 'DUSTTRAK':
-                self.device_service.add_avg_data(msg_value)
+                msg_value['avg_value'] = self.enrichment_cache.get_average(msg_value.get('ID', ''), msg_value.get('TIMESTAMP'))
             
             message = {
                 "asset_uuid": device_uuid,
                 "data": dict(msg_value),
                 "timestamp": time.time()
             }
+            self.replay_buffer.stamp(device_uuid, message)
             
-            await self.connection_manager.broadcast_to_device_connections(device_uuid, message)
+            with BROADCAST_SECONDS.time():
+                await self.connection_manager.broadcast_to_device_connections(device_uuid, message)
             
         except Exception as e:
             print(f"Error handling message for {msg_key}: {e}")
     
+    async def _query_history(self, websocket: WebSocketServerProtocol, params: dict):
+        """Stream the pages of a history query, each page being read from SQL Server off the event loop"""
+        query_id = params.get("query_id")
+        if not self.history_service:
+            await self._send_error(websocket, "History queries are not configured on this API")
+            return
+
+        loop = asyncio.get_running_loop()
+        pages = None
+        try:
+            pages = self.history_service.query_history(params)
+            row_count = 0
+            while True:
+                page = await loop.run_in_executor(None, next, pages, None)
+                if page is None:
+                    break
+                row_count += len(page["rows"])
+                await self._send(websocket, {
+                    "event": "history_page",
+                    "query_id": query_id,
+                    "rows": page["rows"],
+                    "cursor": page["cursor"]
+                })
+                if page["complete"] or page["truncated"]:
+                    await self._send(websocket, {
+                        "event": "history_complete",
+                        "query_id": query_id,
+                        "row_count": row_count,
+                        "truncated": page["truncated"],
+                        "cursor": page["cursor"],
+                        "timestamp": time.time()
+                    })
+                    break
+
+        except HistoryQueryException as e:
+            await self._send_error(websocket, f"Invalid history query: {e}")
+        except ConnectionClosed:
+            print("History query stopped, connection closed")
+        except Exception as e:
+            print(f"Error running history query: {e}")
+            await self._send_error(websocket, f"History query failed: {e}")
+        finally:
+            if pages is not None:
+                await loop.run_in_executor(None, pages.close)
+
     async def _send_simulation_mode(self, websocket: WebSocketServerProtocol, params: dict):
         """Handle simulation mode request"""
         try:
@@ -278,7 +634,7 @@ class WebsocketsManager:
                 "success": True,
                 "value": args
             }
-            await websocket.send(json.dumps(response))
+            await self._send(websocket, response)
             
         except Exception as e:
             print(f"Error sending simulation mode: {e}")
@@ -288,17 +644,22 @@ class WebsocketsManager:
                 "error": str(e),
                 "timestamp": time.time()
             }
-            await websocket.send(json.dumps(error_response))
+            await self._send(websocket, error_response)
     
     async def _drop_stream(self, websocket: WebSocketServerProtocol, device_uuid: str):
         """Handle stream drop request"""
         try:
-            self.stream_service.drop_device_stream(device_uuid)
+            await self.stream_service.drop_device_stream(device_uuid)
             
-            if device_uuid in self.device_topics:
-                del self.device_topics[device_uuid]
             if device_uuid in self.device_assets:
                 del self.device_assets[device_uuid]
+            topic = self.device_topics.pop(device_uuid, None)
+            if topic is not None and topic not in self.device_topics.values():
+                self.topic_subscriber.stop_kafka_topic_subscription(topic)
+            elif topic is not None:
+                self._update_topic_keys(topic)
+            self.snapshot_cache.set_streamed(device_uuid, False)
+            self.replay_buffer.forget(device_uuid)
             
             response = {
                 "event": "stream_dropped", 
@@ -306,7 +667,7 @@ class WebsocketsManager:
                 "device_uuid": device_uuid,
                 "timestamp": time.time()
             }
-            await websocket.send(json.dumps(response))
+            await self._send(websocket, response)
             print(f"Dropped stream for device {device_uuid}")
             
         except StreamCreationException as e:
@@ -319,43 +680,28 @@ class WebsocketsManager:
     async def _send_devices_list(self, websocket: WebSocketServerProtocol):
         """Send list of all available devices for demo dashboard"""
         try:
-            devices = self.device_service.get_all_devices()
+            devices = await self.device_service.get_all_devices()
+            results = await asyncio.gather(
+                *(self._get_device_info(device_uuid) for device_uuid in devices),
+                return_exceptions=True
+            )
             device_list = []
             
-            for device_uuid in devices:
-                try:
-                    device_info = {
-                        "device_uuid": device_uuid,
-                        "dataitems": self.device_service.get_device_dataitems(device_uuid),
-                        "durations": self.device_service.get_device_stats(device_uuid)
-                    }
-                    device_list.append(device_info)
-                except Exception as e:
-                    print(f"Error getting info for device {device_uuid}: {e}")
+            for device_uuid, device_info in zip(devices, results):
+                if isinstance(device_info, Exception):
+                    print(f"Error getting info for device {device_uuid}: {device_info}")
+                    continue
+                device_list.append(device_info)
             response = {
                 "event": "devices_list",
                 "timestamp": time.time(),
                 "devices": device_list
             }
-            await websocket.send(json.dumps(response))
+            await self._send(websocket, response)
             print(f"Sent devices list with {len(device_list)} devices")
             
-            while True:
-                try:
-                    await asyncio.sleep(30)
-                    ping = {
-                        "event": "ping", 
-                        "timestamp": time.time(),
-                        "active_devices": len(device_list)
-                    }
-                    await websocket.send(json.dumps(ping))
-                    
-                except ConnectionClosed:
-                    print("Devices list connection closed")
-                    break
-                except Exception as e:
-                    print(f"Error sending ping to devices list connection: {e}")
-                    break
+            await websocket.wait_closed()
+            print("Devices list connection closed")
                     
         except Exception as e:
             print(f"Error in devices list handler: {e}")
@@ -366,6 +712,22 @@ class WebsocketsManager:
             except:
                 pass
     
+    async def _get_device_info(self, device_uuid: str) -> dict:
+        """Build the devices list entry of a device from the snapshot cache"""
+        dataitems, durations = await asyncio.gather(
+            self.snapshot_cache.get_dataitems(device_uuid),
+            self.snapshot_cache.get_stats(device_uuid)
+        )
+        return {
+            "device_uuid": device_uuid,
+            "dataitems": dataitems,
+            "durations": durations
+        }
+    
+    async def _send(self, websocket: WebSocketServerProtocol, message: dict):
+        """Send a message in the encoding negotiated by the connection"""
+        await websocket.send(encode_frame(message, self.encodings.get(websocket, JSON)))
+
     async def _send_error(self, websocket: WebSocketServerProtocol, message: str):
         """Send error message to client"""
         error_msg = {
@@ -374,7 +736,7 @@ class WebsocketsManager:
             "timestamp": time.time()
         }
         try:
-            await websocket.send(json.dumps(error_msg))
+            await self._send(websocket, error_msg)
         except ConnectionClosed:
             print("Cannot send error - connection closed")
         except Exception as e:
@@ -0,0 +1,88 @@
+import bisect
+import hashlib
+from typing import Iterable, List, Optional, Tuple
+
+from topic_subscription import kafka_partition
+
+REDIRECT = "redirect"
+GUEST = "guest"
+ROUTING_MODES = (REDIRECT, GUEST)
+REDIRECT_CLOSE_CODE = 4307
+
+
+class HashRing:
+    """Consistent hash ring, adding or removing a node only moves the keys of its neighbours"""
+
+    def __init__(self, nodes: Iterable[int], replicas: int = 100):
+        """
+        Args:
+            nodes: Node identifiers placed on the ring
+            replicas: Virtual points per node, more points spread the keys more evenly
+        """
+        self.replicas = replicas
+        self._points: List[Tuple[int, int]] = []
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node: int):
+        for replica in range(self.replicas):
+            bisect.insort(self._points, (self._hash(f"{node}:{replica}"), node))
+
+    def remove_node(self, node: int):
+        self._points = [point for point in self._points if point[1] != node]
+
+    def get_node(self, key: str) -> Optional[int]:
+        """Return the node owning a key, the first point clockwise from its hash"""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, (self._hash(key), -1))
+        return self._points[index % len(self._points)][1]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class WorkerRouter:
+    """
+    Maps devices to the API worker owning them.
+    Clients reach any worker through the shared port; a device connection landing on another worker is
+    either redirected to the direct port of the owner (redirect) or served locally as a guest (guest).
+    On a shared stream a device belongs to the worker owning its Kafka partition, so the workers read
+    disjoint partitions; otherwise devices are spread on a hash ring.
+    """
+
+    def __init__(self, worker_id: int, workers: int, base_port: int, routing: str = REDIRECT,
+                 partitions: Optional[int] = None):
+        """
+        Args:
+            worker_id: Index of this worker
+            workers: Number of workers
+            base_port: Direct port of worker 0, worker n listens on base_port + n
+            routing: redirect or guest
+            partitions: Number of partitions of the shared stream topic, None when each device has its own topic
+        """
+        if routing not in ROUTING_MODES:
+            raise ValueError(f"Unknown worker routing: {routing}")
+        self.worker_id = worker_id
+        self.workers = workers
+        self.base_port = base_port
+        self.routing = routing
+        self.partitions = partitions
+        self.ring = HashRing(range(workers))
+
+    def owner(self, device_uuid: str) -> int:
+        if self.partitions:
+            return kafka_partition(device_uuid, self.partitions) % self.workers
+        return self.ring.get_node(device_uuid)
+
+    def owns(self, device_uuid: str) -> bool:
+        return self.owner(device_uuid) == self.worker_id
+
+    def worker_port(self, worker_id: int) -> int:
+        return self.base_port + worker_id
+
+    def worker_url(self, worker_id: int, host: str, path: str) -> str:
+        """Return the URL reaching a path on the direct port of a worker"""
+        hostname = host.rsplit(":", 1)[0] if host and not host.endswith("]") else host
+        return f"ws://{hostname or 'localhost'}:{self.worker_port(worker_id)}{path}"
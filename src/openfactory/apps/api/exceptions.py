@@ -8,4 +8,8 @@ class DeviceNotFoundException(APIException):
 
 class StreamCreationException(APIException):
     """Raised when stream creation fails"""
+    pass
+
+class HistoryQueryException(APIException):
+    """Raised when a history query is invalid or targets unknown data"""
     pass
\ No newline at end of file
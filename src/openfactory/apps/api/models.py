@@ -1,7 +1,9 @@
 from dataclasses import dataclass
-from typing import Dict, Any
+from typing import Dict, Any, Union
 import json
 
+from connection.frames import encode_frame, JSON
+
 @dataclass
 class DeviceMessage:
     device_uuid: str
@@ -9,13 +11,19 @@ class DeviceMessage:
     data: Dict[str, Any]
     timestamp: float
 
-    def to_json(self) -> str:
-        return json.dumps({
+    def to_dict(self) -> Dict[str, Any]:
+        return {
             "device_uuid": self.device_uuid,
             "event": self.event_type,
             "data": self.data,
             "timestamp": self.timestamp
-        })
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def encode(self, encoding: str = JSON) -> Union[str, bytes]:
+        return encode_frame(self.to_dict(), encoding)
 
 @dataclass
 class ClientMessage:
@@ -0,0 +1,90 @@
+import threading
+from collections import deque
+from typing import Deque, Dict, Iterable, Tuple
+
+from services.device_service import DeviceService
+
+AVERAGE_WINDOWS_KEPT = 16
+
+
+class EnrichmentCache:
+    """
+    Local materialization of the ksqlDB tables used to enrich device messages.
+    IVAC_POWER_STATE_TOTALS and the *_moving_average tables are followed through their changelog topics
+    on the shared consumer, so enriching a message is a dictionary lookup instead of a pull query.
+    """
+
+    def __init__(self, device_service: DeviceService, power_totals_topic: str = "IVAC_POWER_STATE_TOTALS",
+                 moving_average_dataitems: Iterable[str] = ()):
+        """
+        Args:
+            device_service: Service used to seed the power totals once at startup
+            power_totals_topic: Changelog topic of IVAC_POWER_STATE_TOTALS
+            moving_average_dataitems: Dataitems having a {dataitem}_moving_average table
+        """
+        self.device_service = device_service
+        self.power_totals_topic = power_totals_topic
+        self.moving_average_dataitems = list(moving_average_dataitems)
+        self._power_totals: Dict[str, float] = {}
+        self._averages: Dict[str, Deque[Tuple[str, float]]] = {}
+        self._lock = threading.Lock()
+
+    def start(self, topic_subscriber):
+        """Follow the changelog topics on the shared consumer"""
+        topic_subscriber.subscribe_to_kafka_topic(
+            topic=self.power_totals_topic,
+            kafka_group_id=topic_subscriber.group_id,
+            on_message=self._on_power_total
+        )
+        for dataitem_id in self.moving_average_dataitems:
+            topic_subscriber.subscribe_to_kafka_topic(
+                topic=f"{dataitem_id}_moving_average".upper(),
+                kafka_group_id=topic_subscriber.group_id,
+                on_message=lambda key, value, dataitem_id=dataitem_id: self._on_average(dataitem_id, value)
+            )
+
+    async def seed(self):
+        """Load the current power totals, the changelog only carries later changes"""
+        totals = await self.device_service.get_power_state_totals()
+        with self._lock:
+            for key, total in totals.items():
+                self._power_totals.setdefault(key, total)
+        print(f"Enrichment cache seeded with {len(totals)} power state totals")
+
+    def get_durations(self, dataitem_id: str) -> Dict[str, float]:
+        """Return the total duration (s) of each power state of a dataitem"""
+        prefix = dataitem_id + '_'
+        with self._lock:
+            return {
+                key[len(prefix):] if key.startswith(prefix) else key: total
+                for key, total in self._power_totals.items() if key.startswith(dataitem_id)
+            }
+
+    def get_average(self, dataitem_id: str, timestamp: str) -> dict:
+        """Return the moving average window matching a message timestamp, else the latest one"""
+        with self._lock:
+            windows = sorted(self._averages.get(dataitem_id, ()))
+        if not windows:
+            return {}
+        prefix = (timestamp or '')[:-10]
+        for window_end, average in reversed(windows):
+            if prefix and window_end.startswith(prefix):
+                return {'value': average, 'timestamp': window_end}
+        window_end, average = windows[-1]
+        return {'value': average, 'timestamp': window_end}
+
+    def _on_power_total(self, key: str, value: dict):
+        if key and 'TOTAL_DURATION_SEC' in value:
+            with self._lock:
+                self._power_totals[key] = value['TOTAL_DURATION_SEC']
+
+    def _on_average(self, dataitem_id: str, value: dict):
+        if 'AVERAGE_VALUE' not in value or 'TIMESTAMP' not in value:
+            return
+        with self._lock:
+            windows = self._averages.setdefault(dataitem_id, deque(maxlen=AVERAGE_WINDOWS_KEPT))
+            for index, (window_end, _) in enumerate(windows):
+                if window_end == value['TIMESTAMP']:
+                    del windows[index]
+                    break
+            windows.append((value['TIMESTAMP'], value['AVERAGE_VALUE']))
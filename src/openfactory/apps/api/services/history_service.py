@@ -0,0 +1,251 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+import pyodbc
+
+from exceptions import HistoryQueryException
+
+VALUE_TABLES = ("FloatValue", "IntValue", "StrValue")
+NUMERIC_TABLES = ("FloatValue", "IntValue")
+ROLLUP_BUCKETS = (3600, 60, 1)
+
+VARIABLE_QUERY = "SELECT VariableId FROM OpenFactoryLink WHERE AssetUuid = ? AND DataItemId = ?"
+
+ROLLUP_START_QUERY = "SELECT MIN(BucketStart) FROM ValueRollup WHERE VariableId = ? AND BucketSeconds = ?"
+
+ROLLUP_LATE_QUERY = "SELECT LatestSkipped FROM ValueRollupLate WHERE VariableId = ?"
+
+TABLE_QUERY = (
+    "SELECT CASE "
+    "WHEN EXISTS (SELECT 1 FROM {float} WHERE VariableId = ?) THEN 'FloatValue' "
+    "WHEN EXISTS (SELECT 1 FROM {int} WHERE VariableId = ?) THEN 'IntValue' "
+    "WHEN EXISTS (SELECT 1 FROM {str} WHERE VariableId = ?) THEN 'StrValue' END"
+)
+
+BUCKET_START = (
+    "DATEADD(SECOND, b.Seconds % 86400, DATEADD(DAY, b.Seconds / 86400, CAST('19700101' AS DATETIME2)))"
+)
+
+
+def bucket_number(column: str) -> str:
+    """CROSS APPLY source aligning column on buckets, taking the bucket size (s) twice as parameters"""
+    return f"(SELECT DATEDIFF_BIG(SECOND, '19700101', {column}) / ? * ? AS Seconds) AS b"
+
+
+class HistoryService:
+    """
+    Serves time-range queries over the SQL Server historian fed by database_connector.
+    Timestamps are stored as naive local times of the timezone the streams are rendered in; query times
+    carrying an offset are converted to it.
+    """
+
+    def __init__(self, connection_string: str, page_size: int = 1000, max_rows: int = 100000,
+                 timezone_name: str = "Canada/Eastern"):
+        """
+        Args:
+            connection_string: ODBC connection string of the historian database
+            page_size: Default number of rows per streamed page
+            max_rows: Maximum number of rows a single query may stream before it has to be resumed
+            timezone_name: Timezone of the stored timestamps
+        """
+        self.connection_string = connection_string
+        self.page_size = page_size
+        self.max_rows = max_rows
+        self.timezone = ZoneInfo(timezone_name)
+        self._variables: Dict[Tuple[str, str], Tuple[int, str]] = {}
+        self._sources: Optional[Dict[str, str]] = None
+        self._has_rollups: Optional[bool] = None
+        self._has_late_rollups: Optional[bool] = None
+
+    def query_history(self, params: dict) -> Iterator[dict]:
+        """
+        Yield pages of a history query, resuming after params["cursor"] when given.
+        Each page holds its rows and the cursor of its last row, the last page has "complete" set.
+        """
+        asset_uuid = params.get("asset_uuid")
+        dataitem_id = params.get("dataitem_id")
+        if not asset_uuid or not dataitem_id:
+            raise HistoryQueryException("Missing asset_uuid or dataitem_id")
+        start = self._parse_time(params.get("start"), "start")
+        end = self._parse_time(params.get("end"), "end") if params.get("end") else self._now()
+        bucket_seconds = self._parse_count(params.get("bucket_seconds"), "bucket_seconds", 0, minimum=0)
+        page_size = min(self._parse_count(params.get("page_size"), "page_size", self.page_size), self.page_size * 10)
+        max_rows = min(self._parse_count(params.get("max_rows"), "max_rows", self.max_rows), self.max_rows)
+        cursor = params.get("cursor") or {}
+
+        connection = pyodbc.connect(self.connection_string)
+        try:
+            variable_id, table_name = self._resolve(connection, asset_uuid, dataitem_id)
+            if bucket_seconds and table_name not in NUMERIC_TABLES:
+                raise HistoryQueryException(f"{dataitem_id} holds {table_name} rows, which can not be aggregated")
+
+            sent = 0
+            while True:
+                limit = min(page_size, max_rows - sent)
+                if bucket_seconds:
+                    rows, cursor = self._fetch_buckets(connection, variable_id, table_name, start, end,
+                                                       bucket_seconds, limit, cursor)
+                else:
+                    rows, cursor = self._fetch_raw(connection, variable_id, table_name, start, end, limit, cursor)
+                sent += len(rows)
+                complete = len(rows) < limit
+                yield {
+                    "rows": rows,
+                    "cursor": cursor,
+                    "complete": complete,
+                    "truncated": not complete and sent >= max_rows
+                }
+                if complete or sent >= max_rows:
+                    return
+        finally:
+            connection.close()
+
+    def _fetch_raw(self, connection, variable_id: int, table_name: str, start: datetime, end: datetime,
+                   limit: int, cursor: dict) -> Tuple[List[dict], dict]:
+        """Fetch one keyset page of raw values ordered by (Timestamp, Id)"""
+        query = (
+            f"SELECT TOP (?) Id, Timestamp, Value FROM {self._source(connection, table_name)} "
+            f"WHERE VariableId = ? AND Timestamp >= ? AND Timestamp < ?"
+        )
+        params = [limit, variable_id, start, end]
+        if cursor.get("timestamp"):
+            query += " AND (Timestamp > ? OR (Timestamp = ? AND Id > ?))"
+            after = self._parse_time(cursor["timestamp"], "cursor")
+            params += [after, after, int(cursor.get("id", 0))]
+        query += " ORDER BY Timestamp, Id"
+
+        rows = self._fetch(connection, query, params)
+        if rows:
+            cursor = {"timestamp": rows[-1][1].isoformat(), "id": rows[-1][0]}
+        return [{"timestamp": row[1].isoformat(), "value": row[2]} for row in rows], cursor
+
+    def _fetch_buckets(self, connection, variable_id: int, table_name: str, start: datetime, end: datetime,
+                       bucket_seconds: int, limit: int, cursor: dict) -> Tuple[List[dict], dict]:
+        """Fetch one page of buckets aggregated by SQL Server, from the rollups when they cover the bucket size"""
+        if cursor.get("timestamp"):
+            start = max(start, self._parse_time(cursor["timestamp"], "cursor") + timedelta(seconds=bucket_seconds))
+
+        rollup_bucket = self._rollup_bucket(connection, variable_id, bucket_seconds, start)
+        if rollup_bucket:
+            query = (
+                f"SELECT TOP (?) {BUCKET_START}, MIN(MinValue), MAX(MaxValue), "
+                f"SUM(SumValue) / SUM(SampleCount), SUM(SampleCount) FROM ValueRollup "
+                f"CROSS APPLY {bucket_number('BucketStart')} "
+                f"WHERE VariableId = ? AND BucketSeconds = ? AND BucketStart >= ? AND BucketStart < ? "
+                f"GROUP BY b.Seconds ORDER BY b.Seconds"
+            )
+            params = [limit, bucket_seconds, bucket_seconds, variable_id, rollup_bucket, start, end]
+        else:
+            query = (
+                f"SELECT TOP (?) {BUCKET_START}, MIN(Value), MAX(Value), "
+                f"AVG(CAST(Value AS FLOAT)), COUNT_BIG(*) FROM {self._source(connection, table_name)} "
+                f"CROSS APPLY {bucket_number('Timestamp')} "
+                f"WHERE VariableId = ? AND Timestamp >= ? AND Timestamp < ? "
+                f"GROUP BY b.Seconds ORDER BY b.Seconds"
+            )
+            params = [limit, bucket_seconds, bucket_seconds, variable_id, start, end]
+
+        rows = self._fetch(connection, query, params)
+        if rows:
+            cursor = {"timestamp": rows[-1][0].isoformat()}
+        return [
+            {"timestamp": row[0].isoformat(), "min": row[1], "max": row[2], "avg": row[3], "count": row[4]}
+            for row in rows
+        ], cursor
+
+    def _resolve(self, connection, asset_uuid: str, dataitem_id: str) -> Tuple[int, str]:
+        """Return the VariableId and value table of a dataitem"""
+        key = (asset_uuid, dataitem_id)
+        if key in self._variables:
+            return self._variables[key]
+
+        rows = self._fetch(connection, VARIABLE_QUERY, (asset_uuid, dataitem_id))
+        if not rows:
+            raise HistoryQueryException(f"No historized variable for {asset_uuid}/{dataitem_id}")
+        variable_id = rows[0][0]
+        query = TABLE_QUERY.format(**{
+            "float": self._source(connection, "FloatValue"),
+            "int": self._source(connection, "IntValue"),
+            "str": self._source(connection, "StrValue"),
+        })
+        table_name = self._fetch(connection, query, (variable_id,) * 3)[0][0]
+        if not table_name:
+            raise HistoryQueryException(f"No values stored yet for {asset_uuid}/{dataitem_id}")
+
+        self._variables[key] = (variable_id, table_name)
+        return variable_id, table_name
+
+    def _source(self, connection, table_name: str) -> str:
+        """Return the view covering hot and archived rows when the partitioned layout is used, else the table"""
+        if self._sources is None:
+            self._sources = {}
+            for value_table in VALUE_TABLES:
+                view = f"{value_table}History"
+                exists = self._fetch(connection, "SELECT OBJECT_ID(?, 'V')", (f"dbo.{view}",))[0][0]
+                self._sources[value_table] = view if exists is not None else value_table
+        return self._sources[table_name]
+
+    def _rollup_bucket(self, connection, variable_id: int, bucket_seconds: int, start: datetime) -> Optional[int]:
+        """
+        Return the largest rollup bucket of the variable that evenly divides bucket_seconds and covers the range
+        from start: rollups only exist since they were enabled (or since retention last purged them), and miss
+        the values the connector skipped for arriving too late, so older ranges are aggregated from raw values
+        """
+        if self._has_rollups is None:
+            self._has_rollups = self._fetch(connection, "SELECT OBJECT_ID('dbo.ValueRollup', 'U')")[0][0] is not None
+            self._has_late_rollups = (
+                self._fetch(connection, "SELECT OBJECT_ID('dbo.ValueRollupLate', 'U')")[0][0] is not None
+            )
+        if not self._has_rollups:
+            return None
+
+        if self._has_late_rollups:
+            late = self._fetch(connection, ROLLUP_LATE_QUERY, (variable_id,))
+            if late and start <= late[0][0]:
+                return None
+
+        for bucket in ROLLUP_BUCKETS:
+            if bucket_seconds % bucket:
+                continue
+            earliest = self._fetch(connection, ROLLUP_START_QUERY, (variable_id, bucket))[0][0]
+            if earliest is not None and start >= earliest:
+                return bucket
+        return None
+
+    def _now(self) -> datetime:
+        return datetime.now(self.timezone).replace(tzinfo=None)
+
+    @staticmethod
+    def _fetch(connection, query: str, params=()) -> List[tuple]:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _parse_count(value, name: str, default: int, minimum: int = 1) -> int:
+        """Parse an integer parameter of at least minimum, default when it is missing"""
+        if value is None or value == "":
+            return default
+        try:
+            count = int(value)
+        except (TypeError, ValueError):
+            raise HistoryQueryException(f"Invalid {name}: {value}")
+        if count < minimum:
+            raise HistoryQueryException(f"{name} must be at least {minimum}")
+        return count
+
+    def _parse_time(self, value, name: str) -> datetime:
+        """Parse an ISO time, converting times with an offset to the timezone of the stored timestamps"""
+        text = str(value)
+        if text.endswith("Z"):
+            text = text[:-1] + "+00:00"
+        try:
+            parsed = datetime.fromisoformat(text)
+        except ValueError:
+            raise HistoryQueryException(f"Invalid {name} time: {value}")
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(self.timezone)
+        return parsed.replace(tzinfo=None)
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+
+KSQL_CONTENT_TYPE = "application/vnd.ksql.v1+json"
+
+
+class AsyncKSQLClient:
+    """
+    Asynchronous ksqlDB REST client shared by the API services.
+    Requests go through one keep-alive connection pool; concurrent identical pull queries share one
+    in-flight request and their results are cached for a short TTL.
+    """
+
+    def __init__(self, url: str, timeout: float = 5.0, cache_ttl: float = 2.0, max_connections: int = 10):
+        """
+        Args:
+            url: ksqlDB server URL
+            timeout: Default time (s) a request may take before it is abandoned
+            cache_ttl: Time (s) a pull query result is reused (0 disables the cache)
+            max_connections: Maximum number of pooled HTTP connections to ksqlDB
+        """
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._cache: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+
+    async def query(self, query: str, timeout: Optional[float] = None, use_cache: bool = True) -> List[Dict[str, Any]]:
+        """Run a pull query and return its rows as dictionaries keyed by column name"""
+        if use_cache and self.cache_ttl:
+            cached = self._cache.get(query)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+
+        future = self._in_flight.get(query)
+        if future is None:
+            future = asyncio.ensure_future(self._run_query(query, timeout or self.timeout))
+            self._in_flight[query] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(query, None))
+        rows = await asyncio.shield(future)
+
+        if self.cache_ttl:
+            self._cache[query] = (time.monotonic() + self.cache_ttl, rows)
+            if len(self._cache) > 1000:
+                self._evict_expired()
+        return rows
+
+    async def statement_query(self, statement: str, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Run a statement (CREATE, DROP, ...) and return the ksqlDB response"""
+        response = await self._post("/ksql", statement, timeout or self.timeout)
+        self._cache.clear()
+        return response
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run_query(self, query: str, timeout: float) -> List[Dict[str, Any]]:
+        response = await self._post("/query", query, timeout)
+        columns: List[str] = []
+        rows = []
+        for item in response:
+            if "header" in item:
+                columns = parse_schema_columns(item["header"].get("schema", ""))
+            elif "row" in item:
+                rows.append(dict(zip(columns, item["row"].get("columns", []))))
+            elif "errorMessage" in item:
+                raise RuntimeError(item["errorMessage"])
+        return rows
+
+    async def _post(self, path: str, ksql: str, timeout: float) -> Any:
+        response = await self._http().post(
+            path,
+            content=json.dumps({"ksql": ksql, "streamsProperties": {}}),
+            timeout=timeout
+        )
+        if response.status_code >= 400:
+            raise RuntimeError(f"ksqlDB returned {response.status_code}: {response.text}")
+        return response.json()
+
+    def _http(self) -> httpx.AsyncClient:
+        """Create the pooled HTTP client lazily, inside the loop that uses it"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.url,
+                headers={"Accept": KSQL_CONTENT_TYPE, "Content-Type": KSQL_CONTENT_TYPE},
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                timeout=self.timeout
+            )
+        return self._client
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for query in [query for query, (expires, _) in self._cache.items() if expires <= now]:
+            del self._cache[query]
+
+
+def parse_schema_columns(schema: str) -> List[str]:
+    """Return the top-level column names of a ksqlDB schema such as "`ID` STRING, `DATA` STRUCT<`A` INT>" """
+    columns = []
+    depth = 0
+    name = None
+    for char in schema:
+        if name is not None:
+            if char == "`":
+                columns.append(name)
+                name = None
+            else:
+                name += char
+        elif char == "<":
+            depth += 1
+        elif char == ">":
+            depth -= 1
+        elif char == "`" and depth == 0:
+            name = ""
+    return columns
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from typing import Dict, Optional, Set
+
+from services.device_service import DeviceService
+from services.enrichment_cache import EnrichmentCache
+
+SNAPSHOT_TYPES = ('Events', 'Condition')
+
+
+class DeviceSnapshotCache:
+    """
+    In-memory snapshot of the latest dataitem values and stats of each device.
+    Dataitems of streamed devices are kept current from the device stream and reloaded from ksqlDB every
+    streamed_ttl, since the stream never carries UNAVAILABLE values; other devices are reloaded once older
+    than the TTL. A failed load is never cached. Concurrent loads of a device share one query.
+    Stats are read from the IVAC_POWER_STATE_TOTALS changelog followed by the enrichment cache.
+    """
+
+    def __init__(self, device_service: DeviceService, enrichment_cache: EnrichmentCache, ttl: float = 30.0,
+                 streamed_ttl: float = 300.0):
+        """
+        Args:
+            device_service: Service running the ksqlDB pull queries used to seed the snapshots
+            enrichment_cache: Cache following the power state totals changelog
+            ttl: Age (s) after which the snapshot of a device not kept current by its stream is reloaded
+            streamed_ttl: Age (s) after which the snapshot of a streamed device is reloaded
+        """
+        self.device_service = device_service
+        self.enrichment_cache = enrichment_cache
+        self.ttl = ttl
+        self.streamed_ttl = streamed_ttl
+        self.dataitems: Dict[str, Dict[str, str]] = {}
+        self._dataitems_loaded: Dict[str, float] = {}
+        self._streamed: Set[str] = set()
+        self._loads: Dict[tuple, asyncio.Future] = {}
+
+    def set_streamed(self, device_uuid: str, streamed: bool = True):
+        """Mark whether stream updates of a device reach the cache"""
+        if streamed:
+            self._streamed.add(device_uuid)
+        else:
+            self._streamed.discard(device_uuid)
+            self._dataitems_loaded.pop(device_uuid, None)
+
+    def update(self, device_uuid: str, msg_value: dict):
+        """Fold a stream update into the snapshot of its device"""
+        snapshot = self.dataitems.get(device_uuid)
+        dataitem_id = msg_value.get('ID')
+        if snapshot is None or dataitem_id is None:
+            return
+        value_type = msg_value.get('TYPE')
+        if value_type is not None and value_type not in SNAPSHOT_TYPES:
+            return
+        if value_type is None and dataitem_id not in snapshot:
+            return
+        if msg_value.get('VALUE') == 'UNAVAILABLE':
+            snapshot.pop(dataitem_id, None)
+        else:
+            snapshot[dataitem_id] = msg_value.get('VALUE')
+
+    async def get_dataitems(self, device_uuid: str) -> Dict[str, str]:
+        """Return the latest Events/Condition values of a device, the last snapshot if it can not be reloaded"""
+        ttl = self.streamed_ttl if device_uuid in self._streamed else self.ttl
+        if device_uuid in self.dataitems and not self._expired(device_uuid, ttl):
+            return dict(self.dataitems[device_uuid])
+        try:
+            dataitems = await self._load(('dataitems', device_uuid), self.device_service.get_device_dataitems, device_uuid)
+        except Exception as e:
+            print(f"Failed to load the dataitems of {device_uuid}, serving the last snapshot: {e}")
+            return dict(self.dataitems.get(device_uuid, {}))
+        self.dataitems[device_uuid] = dict(dataitems)
+        self._dataitems_loaded[device_uuid] = time.monotonic()
+        return dict(dataitems)
+
+    async def get_stats(self, device_uuid: str) -> Dict[str, float]:
+        """Return the power state durations of a device"""
+        return self.enrichment_cache.get_durations(device_uuid)
+
+    def _expired(self, device_uuid: str, ttl: float) -> bool:
+        return time.monotonic() - self._dataitems_loaded.get(device_uuid, float('-inf')) > ttl
+
+    async def _load(self, key: tuple, loader, device_uuid: str):
+        """Run a loader coroutine, sharing the result with concurrent callers"""
+        future: Optional[asyncio.Future] = self._loads.get(key)
+        if future is None:
+            future = asyncio.ensure_future(loader(device_uuid))
+            self._loads[key] = future
+            future.add_done_callback(lambda _: self._loads.pop(key, None))
+        return await asyncio.shield(future)
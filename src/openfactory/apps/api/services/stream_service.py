@@ -1,36 +1,97 @@
 from exceptions import StreamCreationException
+from services.ksql_client import AsyncKSQLClient
+
+PER_DEVICE = "per_device"
+SHARED = "shared"
+STREAM_MODES = (PER_DEVICE, SHARED)
+
 
 class StreamService:
-    """Handles Kafka stream operations"""
+    """
+    Handles Kafka stream operations.
+    In per_device mode each monitored device gets its own persistent query and topic. In shared mode a single
+    persistent query writes the updates of every device to one topic partitioned and keyed by ASSET_UUID,
+    and devices are routed by key in the API, so onboarding a device issues no DDL.
+    With keep_streams, per-device streams are never dropped: in worker mode other workers may still be
+    reading the topic of a device, and would not notice its stream was dropped.
+    """
     
-    def __init__(self, ksqlClient):
+    def __init__(self, ksqlClient: AsyncKSQLClient, mode: str = PER_DEVICE,
+                 shared_topic: str = "ofa_api_device_stream", shared_partitions: int = 6,
+                 keep_streams: bool = False):
+        """
+        Args:
+            ksqlClient: ksqlDB client running the statements
+            mode: per_device or shared
+            shared_topic: Name of the shared stream and of its topic
+            shared_partitions: Number of partitions of the shared topic
+            keep_streams: Leave per-device streams in ksqlDB when they are dropped
+        """
+        if mode not in STREAM_MODES:
+            raise ValueError(f"Unknown stream mode: {mode}")
         self.ksqlClient = ksqlClient
+        self.mode = mode
+        self.shared_topic = shared_topic
+        self.shared_partitions = shared_partitions
+        self.keep_streams = keep_streams
+        self._shared_stream_ready = False
     
-    def create_device_stream(self, device_uuid: str) -> str:
-        """Create a Kafka stream for device monitoring"""
+    async def create_device_stream(self, device_uuid: str) -> str:
+        """Create a Kafka stream for device monitoring, returns the topic carrying its updates"""
+        if self.mode == SHARED:
+            await self.ensure_shared_stream()
+            return self.shared_topic
+
         topic_name = f'{device_uuid}_monitoring'
         try:
             query = (
                 f"CREATE STREAM IF NOT EXISTS device_stream_{device_uuid} "
                 f"WITH (KAFKA_TOPIC='{topic_name}', PARTITIONS=1) AS "
-                f"SELECT ASSET_UUID AS KEY, ID, VALUE, "
+                f"SELECT ASSET_UUID AS KEY, ID, VALUE, TYPE, "
                 f"TIMESTAMPTOSTRING(ROWTIME, 'yyyy-MM-dd''T''HH:mm:ss[.nnnnnnn]', 'Canada/Eastern') AS TIMESTAMP "
                 f"FROM ASSETS_STREAM WHERE ASSET_UUID = '{device_uuid}' "
                 f"AND TYPE IN ('Events', 'Condition', 'Samples') AND VALUE != 'UNAVAILABLE' "
                 f"EMIT CHANGES;"
             )
-            self.ksqlClient.statement_query(query)
+            await self.ksqlClient.statement_query(query)
             return topic_name
         except Exception as e:
             print(f"Failed to create stream for {device_uuid}: {e}")
             raise StreamCreationException(f"Failed to create stream for device {device_uuid}: {e}")
     
-    def drop_device_stream(self, device_uuid: str) -> None:
-        """Drop a device stream"""
+    async def drop_device_stream(self, device_uuid: str) -> None:
+        """Drop a device stream, the shared stream and the streams kept for other workers outlive their devices"""
+        if self.mode == SHARED:
+            return
+        if self.keep_streams:
+            print(f"Keeping stream of device {device_uuid}, other workers may still be reading it")
+            return
         try:
             query = f"DROP STREAM IF EXISTS device_stream_{device_uuid};"
-            self.ksqlClient.statement_query(query)
+            await self.ksqlClient.statement_query(query)
             print(f"Dropped stream for device {device_uuid}")
         except Exception as e:
             print(f"Failed to drop stream for {device_uuid}: {e}")
-            raise StreamCreationException(f"Failed to drop stream for device {device_uuid}: {e}")
\ No newline at end of file
+            raise StreamCreationException(f"Failed to drop stream for device {device_uuid}: {e}")
+
+    async def ensure_shared_stream(self) -> None:
+        """Create the stream shared by every device once"""
+        if self._shared_stream_ready:
+            return
+        try:
+            query = (
+                f"CREATE STREAM IF NOT EXISTS {self.shared_topic} "
+                f"WITH (KAFKA_TOPIC='{self.shared_topic}', PARTITIONS={self.shared_partitions}) AS "
+                f"SELECT ASSET_UUID, ID, VALUE, TYPE, "
+                f"TIMESTAMPTOSTRING(ROWTIME, 'yyyy-MM-dd''T''HH:mm:ss[.nnnnnnn]', 'Canada/Eastern') AS TIMESTAMP "
+                f"FROM ASSETS_STREAM "
+                f"WHERE TYPE IN ('Events', 'Condition', 'Samples') AND VALUE != 'UNAVAILABLE' "
+                f"PARTITION BY ASSET_UUID "
+                f"EMIT CHANGES;"
+            )
+            await self.ksqlClient.statement_query(query)
+            self._shared_stream_ready = True
+            print(f"Shared device stream {self.shared_topic} ready")
+        except Exception as e:
+            print(f"Failed to create shared device stream: {e}")
+            raise StreamCreationException(f"Failed to create shared device stream: {e}")
@@ -1,101 +1,261 @@
 import threading
 import json
-from typing import Callable, Optional, Dict, Any
-from kafka import KafkaConsumer
+import time
+from typing import Callable, Optional, Dict, Any, Iterable, List, Set, Tuple
+from kafka import KafkaConsumer, TopicPartition
+from kafka.partitioner.default import murmur2
+
+from metrics import REGISTRY
+
+KAFKA_RECORDS = REGISTRY.counter("ofa_api_kafka_records_total", "Kafka records consumed", ("topic",))
+KAFKA_LAG = REGISTRY.gauge(
+    "ofa_api_kafka_consumer_lag", "Records between the consumer position and the end of its partitions", ("topic",)
+)
+
+
+def kafka_partition(key: str, partitions: int) -> int:
+    """Partition of a key under the default Kafka partitioner, the one ksqlDB uses for PARTITION BY"""
+    return (murmur2(key.encode("utf-8")) & 0x7fffffff) % partitions
 
 
 class TopicSubscriber:
-    
-    
-    def __init__(self):
-        self._active_consumers: Dict[str, KafkaConsumer] = {}
-        self._consumer_threads: Dict[str, threading.Thread] = {}
-        self._stop_flags: Dict[str, threading.Event] = {}
-
-    def subscribe_to_kafka_topic(self, 
-                            topic: str, 
+    """
+    Single multi-topic Kafka consumer dispatching records to the handlers of their topic.
+    Partitions are assigned manually: every partition of a topic, or only the partitions holding the keys
+    set with set_topic_keys. Topics and keys change while the consumer runs; the change is applied by the
+    poll thread, the only thread touching the consumer.
+    """
+
+    def __init__(self, bootstrap_servers: str = "broker:29092", group_id: str = "api_device_streams",
+                 max_poll_records: int = 500, poll_timeout_ms: int = 100, lag_interval: float = 10.0,
+                 retry_delay: float = 1.0, max_retry_delay: float = 30.0):
+        """
+        Args:
+            bootstrap_servers: Kafka bootstrap servers
+            group_id: Consumer group shared by every subscribed topic
+            max_poll_records: Maximum number of records returned by one poll
+            poll_timeout_ms: Time (ms) a poll waits for records, also bounds how late a topic change is applied
+            lag_interval: Time (s) between two measures of the consumer lag
+            retry_delay: Time (s) before the consumer is rebuilt after an error, doubled on each failure in a row
+            max_retry_delay: Upper bound (s) of the delay before the consumer is rebuilt
+        """
+        self.bootstrap_servers = bootstrap_servers
+        self.group_id = group_id
+        self.max_poll_records = max_poll_records
+        self.poll_timeout_ms = poll_timeout_ms
+        self.lag_interval = lag_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self._handlers: Dict[str, List[Tuple[Callable[[str, Dict[str, Any]], None], Optional[Callable[[str], bool]]]]] = {}
+        self._lock = threading.Lock()
+        self._topics_changed = threading.Event()
+        self._stop_event = threading.Event()
+        self._consumer: Optional[KafkaConsumer] = None
+        self._topic_keys: Dict[str, Set[str]] = {}
+        self._assignment: Set[TopicPartition] = set()
+        self._assignment_retry_at: Optional[float] = None
+        self._poll_thread: Optional[threading.Thread] = None
+        self._failures = 0
+
+    def subscribe_to_kafka_topic(self,
+                            topic: str,
                             kafka_group_id: str,
-                            on_message: Callable[[Dict[str, Any]], None],
+                            on_message: Callable[[str, Dict[str, Any]], None],
                             bootstrap_servers: str = "broker:29092",
-                            message_filter: Optional[Callable[[Dict[str, Any]], bool]] = None) -> None:
+                            message_filter: Optional[Callable[[str], bool]] = None) -> None:
         """
-        Subscribe to a Kafka topic with a callback function
-        
+        Add a topic to the shared consumer with a callback function
+
         Args:
             topic: Kafka topic name
-            kafka_group_id: Consumer group ID
+            kafka_group_id: Ignored, every topic is consumed by the shared group
             on_message: Callback function for processing messages
-            bootstrap_servers: Kafka bootstrap servers
-            message_filter: Optional filter function
+            bootstrap_servers: Ignored, the shared consumer uses the subscriber's bootstrap servers
+            message_filter: Optional filter function on the message key
         """
-        if topic in self._active_consumers:
-            print(f"Already subscribed to topic: {topic}")
-            return
-        
-        self._stop_flags[topic] = threading.Event()
-        
-        consumer_thread = threading.Thread(
-            target=self._consume_kafka_topic,
-            args=(topic, kafka_group_id, on_message, bootstrap_servers, message_filter),
-            daemon=True
-        )
-        consumer_thread.start()
-        self._consumer_threads[topic] = consumer_thread
-
-    def _consume_kafka_topic(self, 
-                        topic: str, 
-                        kafka_group_id: str,
-                        on_message: Callable[[str, Dict[str, Any]], None],
-                        bootstrap_servers: str,
-                        message_filter: Optional[Callable[[Dict[str, Any]], bool]] = None) -> None:
-        """Internal function to consume messages from a topic"""
-        try:
-            consumer = KafkaConsumer(
-                topic,
-                bootstrap_servers=bootstrap_servers,
-                group_id=kafka_group_id,
-                value_deserializer=lambda m: json.loads(m.decode('utf-8')) if m else None,
-                key_deserializer=lambda m: m.decode('utf-8') if m else None,
-                auto_offset_reset='latest',
-                enable_auto_commit=True
-            )
-            
-            self._active_consumers[topic] = consumer
-
-            for message in consumer:
-                if self._stop_flags[topic].is_set():
-                    break
-                if message.value is not None:
-                    if message_filter and not message_filter(message.key):
-                        continue
-                    
-                    on_message(message.key, message.value)
-                    
-        except Exception as e:
-            print(f"Error in topic consumer for {topic}: {e}")
-        finally:
-            if topic in self._active_consumers:
-                self._active_consumers[topic].close()
-                del self._active_consumers[topic]
+        with self._lock:
+            if topic in self._handlers:
+                print(f"Already subscribed to topic: {topic}")
+                return
+            self._handlers[topic] = [(on_message, message_filter)]
+        self._topics_changed.set()
+        self._ensure_poll_thread()
+
+    def set_topic_keys(self, topic: str, keys: Optional[Iterable[str]]) -> None:
+        """
+        Restrict a topic to the partitions holding some keys, records of other keys are never fetched
+
+        Args:
+            topic: Kafka topic name, subscribed or not yet
+            keys: Message keys to follow, None to read every partition of the topic again
+        """
+        with self._lock:
+            if keys is None:
+                self._topic_keys.pop(topic, None)
+            else:
+                self._topic_keys[topic] = set(keys)
+        self._topics_changed.set()
 
     def stop_kafka_topic_subscription(self, topic: str) -> None:
-        """Stop subscription to a specific topic"""
-        if topic in self._stop_flags:
-            self._stop_flags[topic].set()
-            
-        if topic in self._consumer_threads:
-            self._consumer_threads[topic].join(timeout=5)
-            del self._consumer_threads[topic]
-            
-        if topic in self._stop_flags:
-            del self._stop_flags[topic]
+        """Remove a topic from the shared consumer"""
+        with self._lock:
+            self._topic_keys.pop(topic, None)
+            if self._handlers.pop(topic, None) is None:
+                return
+        self._topics_changed.set()
 
     def stop_all_kafka_subscriptions(self) -> None:
-        """Stop all topic subscriptions"""
-        topics_to_stop = list(self._stop_flags.keys())
-        for topic in topics_to_stop:
-            self.stop_kafka_topic_subscription(topic)
+        """Stop all topic subscriptions and the shared consumer"""
+        with self._lock:
+            self._handlers.clear()
+        self._stop_event.set()
+        if self._poll_thread:
+            self._poll_thread.join(timeout=5)
+            self._poll_thread = None
 
     def get_active_kafka_subscriptions(self) -> list:
         """Get list of currently active subscriptions"""
-        return list(self._active_consumers.keys())
\ No newline at end of file
+        with self._lock:
+            return list(self._handlers.keys())
+
+    def ensure_running(self) -> bool:
+        """
+        Restart the poll thread if it died while topics are still subscribed
+
+        Returns:
+            True if the poll thread had to be restarted
+        """
+        with self._lock:
+            if not self._handlers or self._stop_event.is_set():
+                return False
+            if self._poll_thread and self._poll_thread.is_alive():
+                return False
+        print("Shared consumer thread is not running, restarting it")
+        self._ensure_poll_thread()
+        return True
+
+    def _ensure_poll_thread(self):
+        with self._lock:
+            if self._poll_thread and self._poll_thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._poll_thread = threading.Thread(target=self._consume, daemon=True)
+            self._poll_thread.start()
+
+    def _create_consumer(self) -> KafkaConsumer:
+        return KafkaConsumer(
+            bootstrap_servers=self.bootstrap_servers,
+            group_id=self.group_id,
+            key_deserializer=lambda m: m.decode('utf-8', errors='replace') if m else None,
+            auto_offset_reset='latest',
+            enable_auto_commit=True,
+            max_poll_records=self.max_poll_records
+        )
+
+    def _consume(self) -> None:
+        """Run the consumer until stopped, rebuilding it after a backoff whenever it fails"""
+        self._failures = 0
+        while not self._stop_event.is_set():
+            try:
+                self._consumer = self._create_consumer()
+                self._topics_changed.set()
+                self._poll()
+            except Exception as e:
+                self._failures += 1
+                delay = min(self.retry_delay * 2 ** (self._failures - 1), self.max_retry_delay)
+                print(f"Error in shared topic consumer, rebuilding it in {delay:g}s: {e}")
+                self._close_consumer()
+                self._stop_event.wait(delay)
+        self._close_consumer()
+
+    def _close_consumer(self) -> None:
+        if self._consumer:
+            try:
+                self._consumer.close()
+            except Exception as e:
+                print(f"Error closing shared topic consumer: {e}")
+            self._consumer = None
+        self._assignment = set()
+
+    def _poll(self) -> None:
+        """Poll every subscribed topic in batches and dispatch the records until stopped"""
+        next_lag_update = time.monotonic() + self.lag_interval
+        while not self._stop_event.is_set():
+            if self._topics_changed.is_set() or (
+                    self._assignment_retry_at is not None and time.monotonic() >= self._assignment_retry_at):
+                self._apply_topic_changes()
+            if not self._assignment:
+                self._topics_changed.wait(1.0)
+                continue
+
+            records = self._consumer.poll(timeout_ms=self.poll_timeout_ms, max_records=self.max_poll_records)
+            self._failures = 0
+            if time.monotonic() >= next_lag_update:
+                next_lag_update = time.monotonic() + self.lag_interval
+                self._update_lag()
+            for partition, messages in records.items():
+                KAFKA_RECORDS.inc(len(messages), topic=partition.topic)
+                with self._lock:
+                    handlers = list(self._handlers.get(partition.topic, ()))
+                for message in messages:
+                    if not message.value:
+                        continue
+                    # Records of keys no handler follows are skipped before their value is decoded
+                    accepted = [on_message for on_message, message_filter in handlers
+                                if not message_filter or message_filter(message.key)]
+                    if not accepted:
+                        continue
+                    try:
+                        value = json.loads(message.value)
+                    except ValueError as e:
+                        print(f"Skipping undecodable message from {partition.topic}: {e}")
+                        continue
+                    for on_message in accepted:
+                        try:
+                            on_message(message.key, value)
+                        except Exception as e:
+                            print(f"Error handling message from {partition.topic}: {e}")
+
+    def _update_lag(self) -> None:
+        """Measure the lag of every assigned partition, summed per topic, called from the poll thread only"""
+        try:
+            assignment = list(self._consumer.assignment())
+            end_offsets = self._consumer.end_offsets(assignment) if assignment else {}
+            lag: Dict[Tuple[str], float] = {}
+            for partition in assignment:
+                position = self._consumer.position(partition)
+                lag[(partition.topic,)] = lag.get((partition.topic,), 0) + max(0, end_offsets.get(partition, position) - position)
+            KAFKA_LAG.replace(lag)
+        except Exception as e:
+            print(f"Error measuring consumer lag: {e}")
+
+    def _apply_topic_changes(self) -> None:
+        """Assign the consumer the partitions of the current topics, called from the poll thread only"""
+        self._topics_changed.clear()
+        self._assignment_retry_at = None
+        with self._lock:
+            topics = sorted(self._handlers.keys())
+            topic_keys = {topic: set(keys) for topic, keys in self._topic_keys.items()}
+
+        assignment = set()
+        for topic in topics:
+            partitions = self._consumer.partitions_for_topic(topic)
+            if not partitions:
+                # Topic just created by ksqlDB, its metadata is not there yet
+                self._assignment_retry_at = time.monotonic() + 1.0
+                continue
+            if topic in topic_keys:
+                assignment.update(TopicPartition(topic, kafka_partition(key, len(partitions)))
+                                  for key in topic_keys[topic])
+            else:
+                assignment.update(TopicPartition(topic, partition) for partition in partitions)
+
+        if assignment == self._assignment:
+            return
+        if assignment:
+            self._consumer.assign(list(assignment))
+        else:
+            self._consumer.unsubscribe()
+        self._assignment = assignment
+        print(f"Shared consumer now reads {len(assignment)} partitions of {len(topics)} topics")
@@ -0,0 +1,184 @@
+import asyncio
+import multiprocessing
+import os
+from typing import Optional
+import websockets
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+from openfactory.assets import Asset
+from openfactory.kafka import KSQLDBClient
+
+from config import Config
+from services.ksql_client import AsyncKSQLClient
+from services.device_service import DeviceService
+from services.stream_service import StreamService, SHARED
+from services.history_service import HistoryService
+from services.enrichment_cache import EnrichmentCache
+from connection.connection_manager import ConnectionManager
+from connection.frames import select_subprotocol
+from connection.websockets_manager import WebsocketsManager
+from connection.worker_router import WorkerRouter
+from metrics import process_metrics_request
+from topic_subscription import TopicSubscriber
+
+
+def build_websockets_manager(config: Config, openfactory_app, async_ksql_client: AsyncKSQLClient,
+                             worker_router: Optional[WorkerRouter] = None) -> WebsocketsManager:
+    """Build the websocket stack of one event loop, the single process API or one worker"""
+    group_id = config.kafka_group_id
+    if worker_router is not None:
+        group_id = f"{group_id}_{worker_router.worker_id}"
+    device_service = DeviceService(async_ksql_client)
+    return WebsocketsManager(
+        ConnectionManager(
+            max_queue_size=config.outbound_queue_size,
+            endpoint_policies={
+                "device": config.device_queue_policy,
+                "stream": config.stream_queue_policy
+            }
+        ),
+        device_service,
+        StreamService(
+            async_ksql_client,
+            mode=config.stream_mode,
+            shared_topic=config.shared_stream_topic,
+            shared_partitions=config.shared_stream_partitions,
+            keep_streams=config.workers > 1
+        ),
+        TopicSubscriber(bootstrap_servers=config.kafka_brokers, group_id=group_id),
+        openfactory_app,
+        history_service=HistoryService(
+            config.history_connection_string(),
+            page_size=config.history_page_size,
+            max_rows=config.history_max_rows,
+            timezone_name=config.history_timezone
+        ) if config.history_server else None,
+        enrichment_cache=EnrichmentCache(
+            device_service,
+            power_totals_topic=config.power_totals_topic,
+            moving_average_dataitems=config.moving_average_dataitems
+        ),
+        worker_router=worker_router,
+        max_batch_frames=config.max_batch_frames,
+        replay_buffer_size=config.replay_buffer_size
+    )
+
+
+def websocket_server_options(config: Config, serve_metrics: bool = True) -> dict:
+    """
+    Keyword arguments of websockets.serve shared by the single process API and the workers
+
+    Args:
+        config: API configuration
+        serve_metrics: Answer GET /metrics on this server when metrics are enabled
+    """
+    options = {
+        "select_subprotocol": select_subprotocol,
+        "ping_interval": config.ping_interval,
+        "ping_timeout": config.ping_timeout,
+        "compression": None
+    }
+    if config.metrics_enabled and serve_metrics:
+        options["process_request"] = process_metrics_request
+    if config.compression == "deflate":
+        options["extensions"] = [
+            ServerPerMessageDeflateFactory(
+                server_max_window_bits=12,
+                compress_settings={"level": config.compression_level, "memLevel": 5}
+            )
+        ]
+    return options
+
+
+class WorkerApp:
+    """Stands in for the OpenFactory app inside a worker process"""
+
+    def __init__(self, config: Config, asset_id: str = 'IVAC'):
+        self.config = config
+        self.asset_id = asset_id
+        self.ksqlClient = KSQLDBClient(config.ksqldb_url)
+        self._asset: Optional[Asset] = None
+
+    def initialize_asset(self, device_uuid: str):
+        return Asset(
+            device_uuid,
+            ksqlClient=self.ksqlClient,
+            bootstrap_servers=self.config.kafka_brokers
+        )
+
+    def send_method(self, name, args):
+        if self._asset is None:
+            self._asset = self.initialize_asset(self.asset_id)
+        self._asset.method(name, args)
+
+
+def start_worker(config: Config, worker_id: int) -> multiprocessing.Process:
+    """Start a worker process, spawned so it inherits none of the threads of the OpenFactory app"""
+    process = multiprocessing.get_context("spawn").Process(
+        target=run_worker,
+        args=(config, worker_id),
+        name=f"ofa-api-worker-{worker_id}",
+        daemon=True
+    )
+    process.start()
+    return process
+
+
+def run_worker(config: Config, worker_id: int):
+    """Entry point of a worker process"""
+    try:
+        asyncio.run(_serve_worker(config, worker_id))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _serve_worker(config: Config, worker_id: int):
+    """Serve the shared port and the direct port of this worker until the parent process exits"""
+    parent_pid = os.getppid()
+    async_ksql_client = AsyncKSQLClient(
+        config.ksqldb_url,
+        timeout=config.ksql_timeout,
+        cache_ttl=config.ksql_cache_ttl,
+        max_connections=config.ksql_max_connections
+    )
+    router = WorkerRouter(
+        worker_id, config.workers, config.worker_base_port, config.worker_routing,
+        partitions=config.shared_stream_partitions if config.stream_mode == SHARED else None
+    )
+    manager = build_websockets_manager(config, WorkerApp(config), async_ksql_client, router)
+    manager.set_asyncio_loop(asyncio.get_running_loop())
+
+    servers = [
+        await websockets.serve(
+            manager.handle_connection,
+            config.websocket_host,
+            port,
+            reuse_port=reuse_port,
+            # Metrics are per process, they are only served on the direct port of the worker
+            **websocket_server_options(config, serve_metrics=not reuse_port)
+        )
+        for port, reuse_port in ((config.websocket_port, True), (router.worker_port(worker_id), False))
+    ]
+    print(
+        f"Worker {worker_id} serving on {config.websocket_host}:{config.websocket_port} "
+        f"(direct port {router.worker_port(worker_id)})"
+    )
+
+    try:
+        elapsed = 0
+        while os.getppid() == parent_pid:
+            await asyncio.sleep(1)
+            elapsed += 1
+            if elapsed % 5 == 0:
+                manager.topic_subscriber.ensure_running()
+            if elapsed % 30 == 0 and manager.connection_manager.connection_to_devices:
+                stats = manager.connection_manager.get_queue_stats()
+                print(
+                    f"Worker {worker_id}: {len(manager.connection_manager.connection_to_devices)} connections, "
+                    f"{stats['queued_frames']} frames queued, {stats['dropped_frames']} dropped"
+                )
+    finally:
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+        manager.topic_subscriber.stop_all_kafka_subscriptions()
+        await async_ksql_client.close()